@@ -3,10 +3,18 @@ import json
 import os
 import re
 import sqlite3
+import sys
 from dataclasses import dataclass
 from glob import glob
+from pathlib import Path
 from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
  
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+ 
+from django_qa.utils.code_blocks import dedupe_codes, extract_code_blocks
+ 
 try:
     import pyarrow.parquet as pq
 except ImportError as e:
@@ -41,53 +49,18 @@ def _normalize_tags(tags: object) -> List[str]:
     return [str(tags).strip().lower()] if str(tags).strip() else []
  
  
-def _extract_fenced_code_blocks(markdown: str) -> List[str]:
-    if not markdown:
-        return []
-    blocks = []
-    for m in _FENCED_CODE_RE.finditer(markdown):
-        code = (m.group(1) or "").rstrip()
-        if code:
-            blocks.append(code)
-    return blocks
- 
- 
-def _extract_indented_code_blocks(markdown: str) -> List[str]:
-    if not markdown:
-        return []
-    lines = markdown.splitlines()
-    blocks: List[str] = []
-    buf: List[str] = []
-    for line in lines + [""]:
-        is_code = line.startswith("    ") or line.startswith("\t")
-        if is_code:
-            buf.append(line[4:] if line.startswith("    ") else line[1:])
-            continue
-        if buf:
-            if len(buf) >= 2:
-                blocks.append("\n".join(buf).rstrip())
-            buf = []
-    return [b for b in blocks if b]
- 
- 
 def extract_code_snippets(markdown: str, *, min_chars: int = 12, max_snippets: int = 20) -> List[str]:
     snippets: List[str] = []
-    for b in _extract_fenced_code_blocks(markdown) + _extract_indented_code_blocks(markdown):
-        s = (b or "").strip("\n")
+    for b in extract_code_blocks(markdown):
+        if b.kind == "html" or (b.kind == "indented" and b.line_count < 2):
+            continue
+        s = b.code.strip("\n")
         if len(s) < min_chars:
             continue
         snippets.append(s)
         if len(snippets) >= max_snippets:
             break
-    seen = set()
-    deduped: List[str] = []
-    for s in snippets:
-        key = s.strip()
-        if not key or key in seen:
-            continue
-        seen.add(key)
-        deduped.append(s)
-    return deduped
+    return dedupe_codes(snippets)
  
  
 def strip_code_from_markdown(markdown: str) -> str:
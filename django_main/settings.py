@@ -115,12 +115,17 @@ else:
 
 # Model Selection Configuration
 # Options: 'qwen', 'doubao-pro', 'gpt-4-code', 'codellama', 'starcoder', 'ollama:llama3', etc.
+# 也可以用逗号分隔多个候选（如 "qwen,glm-4-flash,ollama:llama3"），按近期延迟路由到最快的健康 provider
 CURRENT_LLM_MODEL = os.environ.get("CURRENT_LLM_MODEL", "qwen")
 
 # Ollama Configuration
 OLLAMA_API_BASE = os.environ.get("OLLAMA_API_BASE", "http://localhost:11434")
 OLLAMA_MODEL_CODELLAMA = os.environ.get("OLLAMA_MODEL_CODELLAMA", "codellama:7b-instruct")
 OLLAMA_MODEL_STARCODER = os.environ.get("OLLAMA_MODEL_STARCODER", "starcoder2")
+# 模型常驻时长（Ollama keep_alive 语法，如 "30m"、"-1" 表示常驻）与上下文窗口（0 表示用模型默认值）
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
 
 # Qwen (Tongyi Qianwen) Configuration
 # 兼容 OpenAI 格式
@@ -130,6 +135,118 @@ QWEN_API_BASE = os.environ.get("QWEN_API_BASE", "https://dashscope.aliyuncs.com/
 QWEN_MODEL_NAME = os.environ.get("QWEN_MODEL_NAME", "qwen-coder-turbo")
 OLLAMA_MODEL_STARCODER = os.environ.get("OLLAMA_MODEL_STARCODER", "starcoder2")
 
+# Zhipu (GLM) Configuration，兼容 OpenAI 格式，模型对比脚本也会使用
+ZHIPU_API_KEY = os.environ.get("ZHIPU_API_KEY", "")
+ZHIPU_API_BASE = os.environ.get("ZHIPU_API_BASE", "https://open.bigmodel.cn/api/paas/v4/")
+ZHIPU_MODEL_NAME = os.environ.get("ZHIPU_MODEL_NAME", "glm-4-flash")
+
+# Doubao (Volcengine Ark) Configuration，兼容 OpenAI 格式，模型 ID 见下方 ARK_LLM_TEXT_MODEL_ID
+ARK_API_KEY = os.environ.get("ARK_API_KEY", "")
+ARK_API_BASE = os.environ.get("ARK_API_BASE", "https://ark.cn-beijing.volces.com/api/v3")
+
+# 任意 OpenAI 兼容服务（CURRENT_LLM_MODEL=openai 或 openai:<model>，gpt-4-code 也走这里）
+OPENAI_COMPAT_API_KEY = os.environ.get("OPENAI_COMPAT_API_KEY", "")
+OPENAI_COMPAT_API_BASE = os.environ.get("OPENAI_COMPAT_API_BASE", "https://api.openai.com/v1")
+OPENAI_COMPAT_MODEL_NAME = os.environ.get("OPENAI_COMPAT_MODEL_NAME", "gpt-4o")
+
+# LLM Routing Configuration
+# 连续失败 N 次的 provider 冷却一段时间；开启对冲后，首个请求超过该路由 p95 仍未返回时向次优路由再发一次
+LLM_ROUTE_FAILURE_THRESHOLD = int(os.environ.get("LLM_ROUTE_FAILURE_THRESHOLD", "3"))
+LLM_ROUTE_COOLDOWN = float(os.environ.get("LLM_ROUTE_COOLDOWN", "30"))
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# LLM HTTP Client Configuration（各 provider 共享的连接池参数）
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# 需要安装 h2（pip install "httpx[http2]"），未安装时自动退回 HTTP/1.1
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "1") == "1"
+
+# LLM Response Cache Configuration
+# 按 (模型, temperature, 提示词版本, 渲染后的消息) 哈希缓存回答，默认关闭；temperature 高于阈值时不走缓存
+QA_LLM_CACHE_ENABLED = os.environ.get("QA_LLM_CACHE_ENABLED", "0") == "1"
+QA_LLM_CACHE_TTL = int(os.environ.get("QA_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+QA_LLM_CACHE_MAX_TEMPERATURE = float(os.environ.get("QA_LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+
+# 相同请求（消息哈希一致）并发时只向上游发一次；跨进程合并基于 output/ 下的 flock 文件锁，仅 Linux/macOS
+QA_LLM_SINGLEFLIGHT_ENABLED = os.environ.get("QA_LLM_SINGLEFLIGHT_ENABLED", "1") == "1"
+QA_LLM_SINGLEFLIGHT_CROSS_PROCESS = os.environ.get("QA_LLM_SINGLEFLIGHT_CROSS_PROCESS", "0") == "1"
+QA_LLM_SINGLEFLIGHT_WAIT = float(os.environ.get("QA_LLM_SINGLEFLIGHT_WAIT", "120"))
+# 单进程内同时进行的模型调用上限（0 表示不限制），按用户轮转排队；排队超时返回 code=42901 / HTTP 429
+QA_LLM_MAX_CONCURRENCY = int(os.environ.get("QA_LLM_MAX_CONCURRENCY", "8"))
+QA_LLM_MAX_QUEUE_WAIT = float(os.environ.get("QA_LLM_MAX_QUEUE_WAIT", "20"))
+QA_LLM_MAX_QUEUE_PER_USER = int(os.environ.get("QA_LLM_MAX_QUEUE_PER_USER", "4"))
+# 熔断：最近 WINDOW 次调用中失败（含超过 SLOW_CALL_SECONDS 的慢调用）占比达到阈值后打开，OPEN_SECONDS 后放行探测请求
+# 熔断期间消息接口默认退化为仅基于相似问答检索结果的回答（QA_LLM_CIRCUIT_FALLBACK=0 则直接返回 503）
+QA_LLM_CIRCUIT_ENABLED = os.environ.get("QA_LLM_CIRCUIT_ENABLED", "1") == "1"
+QA_LLM_CIRCUIT_WINDOW = int(os.environ.get("QA_LLM_CIRCUIT_WINDOW", "20"))
+QA_LLM_CIRCUIT_MIN_CALLS = int(os.environ.get("QA_LLM_CIRCUIT_MIN_CALLS", "10"))
+QA_LLM_CIRCUIT_FAILURE_RATE = float(os.environ.get("QA_LLM_CIRCUIT_FAILURE_RATE", "0.5"))
+QA_LLM_CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get("QA_LLM_CIRCUIT_SLOW_CALL_SECONDS", "30"))
+QA_LLM_CIRCUIT_OPEN_SECONDS = float(os.environ.get("QA_LLM_CIRCUIT_OPEN_SECONDS", "30"))
+QA_LLM_CIRCUIT_FALLBACK = os.environ.get("QA_LLM_CIRCUIT_FALLBACK", "1") == "1"
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "llm": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "output" / "llm_cache",
+        "TIMEOUT": QA_LLM_CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("QA_LLM_CACHE_MAX_ENTRIES", "20000"))},
+    },
+}
+
+# Answer Evaluation Configuration
+# 助手回答的代码评估默认放到后台线程池执行，消息接口先返回 status=pending 的评估
+QA_EVALUATION_ASYNC = os.environ.get("QA_EVALUATION_ASYNC", "1") == "1"
+QA_EVALUATION_WORKERS = int(os.environ.get("QA_EVALUATION_WORKERS", "2"))
+# 可选：在常驻沙箱进程池中实际执行代码块，参与逻辑分计算
+# 仅支持 Linux x86_64/aarch64：需要用户/网络/PID 命名空间与 seccomp，环境不满足时系统检查报错，不会无隔离执行
+QA_SANDBOX_ENABLED = os.environ.get("QA_SANDBOX_ENABLED", "0") == "1"
+QA_SANDBOX_WORKERS = int(os.environ.get("QA_SANDBOX_WORKERS", "2"))
+QA_SANDBOX_TIMEOUT = float(os.environ.get("QA_SANDBOX_TIMEOUT", "2.0"))
+QA_SANDBOX_MEMORY_MB = int(os.environ.get("QA_SANDBOX_MEMORY_MB", "256"))
+
+# Prompt Token Budget Configuration
+# 提示词总 token 预算：系统提示与问题原样保留，剩余部分按比例分给对话历史与检索结果（一方用不完让给另一方）
+# 安装 tiktoken 时按 cl100k_base 计数，否则使用中英文近似分词
+QA_PROMPT_TOKEN_BUDGET = int(os.environ.get("QA_PROMPT_TOKEN_BUDGET", "4096"))
+QA_PROMPT_RETRIEVAL_SHARE = float(os.environ.get("QA_PROMPT_RETRIEVAL_SHARE", "0.4"))
+
+# Retrieval Pipeline Configuration
+# 发消息时检索与消息入库、历史/提示词读取并行；超过 QA_RETRIEVAL_TIMEOUT 秒（从提交检索算起）仍未返回则跳过检索直接调用模型，0 表示一直等
+# 冷启动时候选回答要逐条跑 pylint（12 条约 8 秒），之后质量分按回答缓存，命中后通常在百毫秒内
+# 被放弃的检索占满 QA_RETRIEVAL_WORKERS 个线程时，新请求不再排队，直接跳过检索
+QA_RETRIEVAL_TIMEOUT = float(os.environ.get("QA_RETRIEVAL_TIMEOUT", "10"))
+QA_RETRIEVAL_WORKERS = int(os.environ.get("QA_RETRIEVAL_WORKERS", "4"))
+
+# Batch QA Configuration
+# POST /api/qa/batch/：单次最多题数与单个批次内同时进行的模型调用数（全局并发仍受 QA_LLM_MAX_CONCURRENCY 约束）
+QA_BATCH_MAX_QUESTIONS = int(os.environ.get("QA_BATCH_MAX_QUESTIONS", "50"))
+QA_BATCH_CONCURRENCY = int(os.environ.get("QA_BATCH_CONCURRENCY", "4"))
+# 所有批量请求共用的线程数上限，超出的题目在进程内排队
+QA_BATCH_WORKERS = int(os.environ.get("QA_BATCH_WORKERS", "8"))
+
+# Thread Summary Configuration
+# 长会话的滚动摘要：摘要之后可折叠的消息（不含最近 KEEP_RECENT 条）达到 EVERY 条时在后台调用模型刷新摘要，
+# 提示词只包含摘要 + 摘要之后的消息；EVERY=0 关闭
+QA_THREAD_SUMMARY_EVERY = int(os.environ.get("QA_THREAD_SUMMARY_EVERY", "6"))
+QA_THREAD_SUMMARY_KEEP_RECENT = int(os.environ.get("QA_THREAD_SUMMARY_KEEP_RECENT", "4"))
+QA_THREAD_SUMMARY_MAX_TOKENS = int(os.environ.get("QA_THREAD_SUMMARY_MAX_TOKENS", "600"))
+QA_THREAD_SUMMARY_ASYNC = os.environ.get("QA_THREAD_SUMMARY_ASYNC", "1") == "1"
+
+# Semantic Answer Cache Configuration
+# 会话首轮问题与历史问题的 TF-IDF 余弦相似度超过阈值、且提示词版本一致时，直接复用历史回答与评估
+QA_SEMANTIC_CACHE_ENABLED = os.environ.get("QA_SEMANTIC_CACHE_ENABLED", "0") == "1"
+QA_SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("QA_SEMANTIC_CACHE_THRESHOLD", "0.9"))
+QA_SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("QA_SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+# 默认只在同一用户的会话之间复用回答（回答和引用里可能有提问者自己的代码）；设为 1 才跨用户共享
+QA_SEMANTIC_CACHE_SHARED = os.environ.get("QA_SEMANTIC_CACHE_SHARED", "0") == "1"
+
 # Selected optimal model after comparison: CodeLlama-34b / GPT-4 Code equivalent
 ARK_LLM_TEXT_MODEL_ID = os.environ.get("ARK_LLM_TEXT_MODEL_ID", "doubao-1-5-pro-32k-250115")
 ARK_LLM_EMBEDDING_MODEL_ID = os.environ.get("ARK_LLM_EMBEDDING_MODEL_ID", "doubao-embedding-text-240715")
@@ -5,3 +5,6 @@ class DjangoQaConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "django_qa"
 
+
+    def ready(self) -> None:
+        from django_qa import checks, signals  # noqa: F401
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from django.conf import settings
+from django.core import checks
+
+
+@checks.register()
+def check_sandbox_isolation(app_configs, **kwargs) -> list[checks.CheckMessage]:
+    if not getattr(settings, "QA_SANDBOX_ENABLED", False):
+        return []
+    from django_qa.utils.sandbox import sandbox_supported
+
+    if sandbox_supported():
+        return []
+    return [
+        checks.Error(
+            "QA_SANDBOX_ENABLED=1 但当前环境无法建立沙箱隔离（需要 Linux 用户/网络/PID 命名空间与 seccomp）。",
+            hint="关闭 QA_SANDBOX_ENABLED，或在支持非特权用户命名空间的 Linux 主机上运行。",
+            id="django_qa.E001",
+        )
+    ]
+
+
+@checks.register(checks.Tags.database)
+def check_fulltext_triggers(app_configs, databases=None, **kwargs) -> list[checks.CheckMessage]:
+    """SQLite 上有 FTS5 表却缺同步触发器时，新写入的问答对不会进索引，搜索结果悄悄变旧。"""
+    from django.db import connections
+
+    from django_qa.utils.fulltext import FTS_TABLE
+
+    errors: list[checks.CheckMessage] = []
+    for alias in databases or []:
+        connection = connections[alias]
+        if connection.vendor != "sqlite":
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT type, name FROM sqlite_master WHERE name LIKE %s", [f"{FTS_TABLE}%"])
+            rows = cursor.fetchall()
+        if ("table", FTS_TABLE) not in rows:
+            continue
+        triggers = {name for kind, name in rows if kind == "trigger"}
+        missing = [f"{FTS_TABLE}_{suffix}" for suffix in ("ai", "ad", "au") if f"{FTS_TABLE}_{suffix}" not in triggers]
+        if missing:
+            errors.append(
+                checks.Error(
+                    f"数据库 {alias} 缺少全文索引同步触发器：{', '.join(missing)}。",
+                    hint="重建问答对表的迁移之后要补回触发器（见迁移 0009），补回后执行一次 FTS 'rebuild'。",
+                    id="django_qa.E002",
+                )
+            )
+    return errors
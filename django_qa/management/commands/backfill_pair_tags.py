@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_qa.models import PairTag, ProgrammingQAPair
+from django_qa.utils.tag_stats import link_pair_tags, recount_tags
+
+
+class Command(BaseCommand):
+    help = "根据 tags_json 回填问答对与标签的关联表，并按关联表重算标签计数"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000, help="每批处理的问答对数")
+        parser.add_argument("--start-id", type=int, default=0, help="从大于该 id 的问答对开始，用于中断后续跑")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, int(options["batch_size"] or 2000))
+        last_id = int(options["start_id"] or 0)
+        processed = 0
+        while True:
+            rows = list(
+                ProgrammingQAPair.objects.filter(id__gt=last_id).order_by("id").values_list("id", "tags_json")[:batch_size]
+            )
+            if not rows:
+                break
+            with transaction.atomic():
+                link_pair_tags(rows)
+            last_id = rows[-1][0]
+            processed += len(rows)
+            self.stdout.write(f"已处理 {processed} 条，last_id={last_id}")
+
+        recount_tags()
+        self.stdout.write(self.style.SUCCESS(f"回填完成：处理 {processed} 条问答对，当前关联 {PairTag.objects.count()} 条"))
@@ -4,10 +4,12 @@ import json
 from datetime import datetime, timezone
 
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection, transaction
 from django.utils.dateparse import parse_datetime
 
-from django_qa.models import ProgrammingQAPair
+from django_qa.models import PairTag, ProgrammingQAPair, Tag
+from django_qa.utils.excerpt import fill_pair_excerpts
+from django_qa.utils.tag_stats import apply_tag_deltas, count_tags, link_pair_tags
 
 
 def _parse_dt(value: object) -> datetime | None:
@@ -30,6 +32,17 @@ def _parse_dt(value: object) -> datetime | None:
     return None
 
 
+def _dedupe(rows: list[ProgrammingQAPair]) -> list[ProgrammingQAPair]:
+    seen: set[tuple[int, int]] = set()
+    out: list[ProgrammingQAPair] = []
+    for qa in rows:
+        key = (qa.question_id, qa.answer_id)
+        if key not in seen:
+            seen.add(key)
+            out.append(qa)
+    return out
+
+
 class Command(BaseCommand):
     help = "导入清洗后的 StackOverflow 问答数据到数据库"
 
@@ -51,7 +64,12 @@ class Command(BaseCommand):
         truncate: bool = bool(options["truncate"])
 
         if truncate:
-            ProgrammingQAPair.objects.all().delete()
+            # 整表清空不逐行触发删除信号，标签计数直接一起清掉
+            with transaction.atomic():
+                PairTag.objects.all().delete()
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DELETE FROM {connection.ops.quote_name(ProgrammingQAPair._meta.db_table)}")
+                Tag.objects.all().delete()
 
         before = ProgrammingQAPair.objects.count()
         created = 0
@@ -63,7 +81,25 @@ class Command(BaseCommand):
             if not buf:
                 return
             with transaction.atomic():
+                # ignore_conflicts 不会告诉我们哪些行是新插入的，先查出已存在的键，只给新行累加标签计数
+                existing = set(
+                    ProgrammingQAPair.objects.filter(
+                        question_id__in={qa.question_id for qa in buf},
+                        answer_id__in={qa.answer_id for qa in buf},
+                    ).values_list("question_id", "answer_id")
+                )
+                fresh = _dedupe([qa for qa in buf if (qa.question_id, qa.answer_id) not in existing])
                 ProgrammingQAPair.objects.bulk_create(buf, ignore_conflicts=True, batch_size=batch_size)
+                apply_tag_deltas(count_tags(qa.tags_json for qa in fresh))
+                if fresh:
+                    ids = {
+                        (qid, aid): pk
+                        for pk, qid, aid in ProgrammingQAPair.objects.filter(
+                            question_id__in={qa.question_id for qa in fresh},
+                            answer_id__in={qa.answer_id for qa in fresh},
+                        ).values_list("id", "question_id", "answer_id")
+                    }
+                    link_pair_tags((ids[(qa.question_id, qa.answer_id)], qa.tags_json) for qa in fresh)
             created = ProgrammingQAPair.objects.count() - before
             buf = []
 
@@ -88,6 +124,7 @@ class Command(BaseCommand):
                     question_code_snippets_json=list(obj.get("question_code_snippets") or []),
                     answer_code_snippets_json=list(obj.get("answer_code_snippets") or []),
                 )
+                fill_pair_excerpts(qa)
                 buf.append(qa)
                 seen += 1
                 if len(buf) >= batch_size:
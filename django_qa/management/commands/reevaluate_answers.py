@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from django_qa.models import AnswerEvaluation, ConversationMessage
+from django_qa.utils.code_analysis import analyze_code_comprehensive
+from django_qa.utils.evaluation import evaluation_fields
+from django_qa.utils.sandbox import SandboxPool, get_default_sandbox
+
+
+_UPDATE_FIELDS = [
+    "syntax_score",
+    "logic_score",
+    "utility_score",
+    "readability_score",
+    "total_score",
+    "analysis_report",
+    "status",
+    "error_msg",
+    "updated_at",
+]
+
+
+def _read_checkpoint(path: Path) -> int:
+    if not path.exists():
+        return 0
+    try:
+        return int(json.loads(path.read_text(encoding="utf-8")).get("last_message_id") or 0)
+    except Exception:
+        return 0
+
+
+def _write_checkpoint(path: Path, last_message_id: int, processed: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(
+        json.dumps({"last_message_id": last_message_id, "processed": processed, "updated_at": int(time.time())}),
+        encoding="utf-8",
+    )
+    os.replace(tmp, path)
+
+
+class Command(BaseCommand):
+    help = "按当前评分公式重新计算历史助手回答的代码评估"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="每批分析与写回的消息数")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="进程池大小，1 表示在当前进程内计算")
+        parser.add_argument(
+            "--checkpoint",
+            type=str,
+            default="",
+            help="断点文件路径，默认 output/reevaluate_answers.json",
+        )
+        parser.add_argument("--resume", action="store_true", help="从断点文件记录的消息 id 之后继续")
+        parser.add_argument("--only-pending", action="store_true", help="只处理缺失、pending 或 failed 的评估")
+        parser.add_argument("--limit", type=int, default=0, help="最多处理多少条，0 表示全部")
+
+    def handle(self, *args, **options):
+        batch_size: int = max(1, int(options["batch_size"] or 500))
+        workers: int = max(1, int(options["workers"] or 1))
+        limit: int = int(options["limit"] or 0)
+        checkpoint = Path(options["checkpoint"] or Path(settings.BASE_DIR) / "output" / "reevaluate_answers.json")
+
+        start_id = _read_checkpoint(checkpoint) if options["resume"] else 0
+        qs = ConversationMessage.objects.filter(role="assistant", id__gt=start_id)
+        if options["only_pending"]:
+            qs = qs.filter(Q(evaluation__isnull=True) | Q(evaluation__status__in=["pending", "failed"]))
+        rows = qs.order_by("id").values_list("id", "content").iterator(chunk_size=batch_size)
+
+        # 启用沙箱时沙箱进程池本身就是并行的执行单元，改用线程把代码块分发给它
+        sandbox = get_default_sandbox()
+        pool: Executor | None = None
+        if workers > 1:
+            pool = ThreadPoolExecutor(max_workers=workers) if sandbox else ProcessPoolExecutor(max_workers=workers)
+        processed = 0
+        started = time.perf_counter()
+        try:
+            batch: list[tuple[int, str]] = []
+            for row in rows:
+                batch.append(row)
+                if limit and processed + len(batch) >= limit:
+                    break
+                if len(batch) >= batch_size:
+                    processed += self._process_batch(batch, pool, workers, sandbox)
+                    _write_checkpoint(checkpoint, batch[-1][0], processed)
+                    self.stdout.write(f"已处理 {processed} 条，断点 message_id={batch[-1][0]}")
+                    batch = []
+            if batch:
+                processed += self._process_batch(batch, pool, workers, sandbox)
+                _write_checkpoint(checkpoint, batch[-1][0], processed)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"重新评估完成：共 {processed} 条，耗时 {elapsed:.1f}s"))
+
+    def _process_batch(
+        self,
+        batch: list[tuple[int, str]],
+        pool: Executor | None,
+        workers: int,
+        sandbox: SandboxPool | None,
+    ) -> int:
+        contents = [content or "" for _, content in batch]
+        analyze = partial(analyze_code_comprehensive, sandbox=sandbox) if sandbox else analyze_code_comprehensive
+        if pool is None:
+            analyses = [analyze(c) for c in contents]
+        else:
+            chunksize = max(1, len(contents) // (workers * 4))
+            analyses = list(pool.map(analyze, contents, chunksize=chunksize))
+
+        ids = [message_id for message_id, _ in batch]
+        existing = {row.message_id: row for row in AnswerEvaluation.objects.filter(message_id__in=ids)}
+        to_update: list[AnswerEvaluation] = []
+        to_create: list[AnswerEvaluation] = []
+        now = timezone.now()
+        for message_id, analysis in zip(ids, analyses):
+            fields = evaluation_fields(analysis)
+            row = existing.get(message_id)
+            if row is None:
+                to_create.append(AnswerEvaluation(message_id=message_id, status="done", **fields))
+                continue
+            for k, v in fields.items():
+                setattr(row, k, v)
+            row.status = "done"
+            row.error_msg = ""
+            row.updated_at = now
+            to_update.append(row)
+
+        with transaction.atomic():
+            if to_update:
+                AnswerEvaluation.objects.bulk_update(to_update, _UPDATE_FIELDS, batch_size=len(to_update))
+            if to_create:
+                AnswerEvaluation.objects.bulk_create(to_create, batch_size=len(to_create))
+        return len(batch)
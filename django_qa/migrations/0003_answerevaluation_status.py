@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_qa", "0002_programmingqapair"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="answerevaluation",
+            name="status",
+            field=models.CharField(db_index=True, default="done", max_length=16),
+        ),
+        migrations.AddField(
+            model_name="answerevaluation",
+            name="error_msg",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="answerevaluation",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
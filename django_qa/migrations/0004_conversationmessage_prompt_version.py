@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_qa", "0003_answerevaluation_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversationmessage",
+            name="prompt_version",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=64),
+        ),
+    ]
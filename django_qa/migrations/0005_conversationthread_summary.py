@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_qa", "0004_conversationmessage_prompt_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversationthread",
+            name="summary",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="conversationthread",
+            name="summary_message_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversationthread",
+            name="summary_updated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from django.db import OperationalError, migrations
+
+PAIR_TABLE = "django_qa_programmingqapair"
+FTS_TABLE = "django_qa_programmingqapair_fts"
+MYSQL_INDEX = "qa_pair_fulltext"
+
+# external content 表：FTS5 只存倒排索引，正文仍在问答对表里，由触发器保持同步（bulk_create 同样会触发）
+SQLITE_FORWARD = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title, question_body, answer_body,
+        content='{PAIR_TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {PAIR_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, question_body, answer_body)
+        VALUES (new.id, new.title, new.question_body, new.answer_body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {PAIR_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, question_body, answer_body)
+        VALUES ('delete', old.id, old.title, old.question_body, old.answer_body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title, question_body, answer_body ON {PAIR_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, question_body, answer_body)
+        VALUES ('delete', old.id, old.title, old.question_body, old.answer_body);
+        INSERT INTO {FTS_TABLE}(rowid, title, question_body, answer_body)
+        VALUES (new.id, new.title, new.question_body, new.answer_body);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def create_fulltext(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        try:
+            schema_editor.execute(SQLITE_FORWARD[0])
+        except OperationalError:
+            # SQLite 未编译 FTS5 时跳过，搜索会回退到 icontains
+            return
+        for sql in SQLITE_FORWARD[1:]:
+            schema_editor.execute(sql)
+    elif vendor == "mysql":
+        schema_editor.execute(
+            f"ALTER TABLE {PAIR_TABLE} ADD FULLTEXT INDEX {MYSQL_INDEX} (title, question_body, answer_body)"
+        )
+
+
+def drop_fulltext(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for sql in SQLITE_BACKWARD:
+            schema_editor.execute(sql)
+    elif vendor == "mysql":
+        schema_editor.execute(f"ALTER TABLE {PAIR_TABLE} DROP INDEX {MYSQL_INDEX}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_qa", "0005_conversationthread_summary"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext, drop_fulltext),
+    ]
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def backfill_tag_counts(apps, schema_editor):
+    ProgrammingQAPair = apps.get_model("django_qa", "ProgrammingQAPair")
+    Tag = apps.get_model("django_qa", "Tag")
+    counter: Counter[str] = Counter()
+    for tags in ProgrammingQAPair.objects.values_list("tags_json", flat=True).iterator(chunk_size=2000):
+        counter.update({str(t or "").strip()[:128] for t in (tags or [])} - {""})
+    Tag.objects.bulk_create([Tag(name=name, pair_count=n) for name, n in counter.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_qa", "0006_programmingqapair_fulltext"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tag",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=128, unique=True)),
+                ("pair_count", models.IntegerField(db_index=True, default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["-pair_count", "name"],
+            },
+        ),
+        migrations.RunPython(backfill_tag_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from django_qa.utils.tag_stats import link_pair_tags
+
+
+def backfill_pair_tags(apps, schema_editor):
+    # 0007 已经按 tags_json 建好 Tag 与计数，这里只补关联行，计数不变
+    ProgrammingQAPair = apps.get_model("django_qa", "ProgrammingQAPair")
+    Tag = apps.get_model("django_qa", "Tag")
+    PairTag = apps.get_model("django_qa", "PairTag")
+    last_id = 0
+    while True:
+        rows = list(ProgrammingQAPair.objects.filter(id__gt=last_id).order_by("id").values_list("id", "tags_json")[:2000])
+        if not rows:
+            break
+        link_pair_tags(rows, tag_model=Tag, pair_tag_model=PairTag)
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_qa", "0007_tag"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PairTag",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "pair",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pair_tags",
+                        to="django_qa.programmingqapair",
+                    ),
+                ),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pair_tags",
+                        to="django_qa.tag",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="pairtag",
+            constraint=models.UniqueConstraint(fields=("tag", "pair"), name="uniq_pair_tag_tag_pair"),
+        ),
+        migrations.RunPython(backfill_pair_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import re
+
+from django.db import migrations, models
+
+PAIR_TABLE = "django_qa_programmingqapair"
+FTS_TABLE = "django_qa_programmingqapair_fts"
+
+# 与 0006 中的同步触发器相同：SQLite 重建问答对表时会连带删掉它们
+SQLITE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {PAIR_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, question_body, answer_body)
+        VALUES (new.id, new.title, new.question_body, new.answer_body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {PAIR_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, question_body, answer_body)
+        VALUES ('delete', old.id, old.title, old.question_body, old.answer_body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title, question_body, answer_body ON {PAIR_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, question_body, answer_body)
+        VALUES ('delete', old.id, old.title, old.question_body, old.answer_body);
+        INSERT INTO {FTS_TABLE}(rowid, title, question_body, answer_body)
+        VALUES (new.id, new.title, new.question_body, new.answer_body);
+    END
+    """,
+]
+
+SQLITE_DROP_TRIGGERS = [f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}" for suffix in ("ai", "ad", "au")]
+
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def _excerpt(text: str, max_chars: int) -> str:
+    s = _HTML_TAG_RE.sub(" ", (text or "").strip())
+    s = re.sub(r"\s+", " ", s).strip()
+    if len(s) <= max_chars:
+        return s
+    return s[: max_chars - 1].rstrip() + "…"
+
+
+def restore_sqlite_triggers(apps, schema_editor):
+    """SQLite 重建表后补回同步触发器；表的 id 与正文不变，倒排索引本身无需重建。"""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        if cursor.fetchone() is None:
+            return
+    for sql in SQLITE_DROP_TRIGGERS + SQLITE_TRIGGERS:
+        schema_editor.execute(sql)
+
+
+def backfill_excerpts(apps, schema_editor):
+    ProgrammingQAPair = apps.get_model("django_qa", "ProgrammingQAPair")
+    last_id = 0
+    while True:
+        rows = list(
+            ProgrammingQAPair.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .only("id", "question_body", "answer_body")[:1000]
+        )
+        if not rows:
+            break
+        for row in rows:
+            row.question_excerpt = _excerpt(row.question_body, 240)
+            row.answer_excerpt = _excerpt(row.answer_body, 360)
+        ProgrammingQAPair.objects.bulk_update(rows, ["question_excerpt", "answer_excerpt"], batch_size=500)
+        last_id = rows[-1].id
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_qa", "0008_pairtag"),
+    ]
+
+    operations = [
+        # SQLite 加/删列都会重建问答对表，全文索引的同步触发器随旧表一起被删掉，两个方向都要补回
+        migrations.RunPython(migrations.RunPython.noop, restore_sqlite_triggers),
+        migrations.AddField(
+            model_name="programmingqapair",
+            name="question_excerpt",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="programmingqapair",
+            name="answer_excerpt",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.RunPython(restore_sqlite_triggers, migrations.RunPython.noop),
+        migrations.RunPython(backfill_excerpts, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,8 @@ from __future__ import annotations
 from django.conf import settings
 from django.db import models
 
+from django_qa.utils.excerpt import fill_pair_excerpts
+
 
 class PromptTemplate(models.Model):
     scene = models.CharField(max_length=64, db_index=True)
@@ -43,6 +45,10 @@ class ConversationThread(models.Model):
     title = models.CharField(max_length=255, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # 滚动摘要：覆盖 id <= summary_message_id 的全部消息，之后的消息原样进入提示词
+    summary = models.TextField(blank=True, default="")
+    summary_message_id = models.BigIntegerField(default=0)
+    summary_updated_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ["-updated_at", "-id"]
@@ -60,6 +66,7 @@ class ConversationMessage(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     citations_json = models.JSONField(default=list, blank=True)
     tool_events_json = models.JSONField(default=list, blank=True)
+    prompt_version = models.CharField(max_length=64, blank=True, default="", db_index=True)
 
     class Meta:
         ordering = ["id"]
@@ -78,13 +85,16 @@ class AnswerEvaluation(models.Model):
     readability_score = models.FloatField(default=0)
     total_score = models.FloatField(default=0, db_index=True)
     analysis_report = models.TextField(blank=True, default="")
+    status = models.CharField(max_length=16, default="done", db_index=True)
+    error_msg = models.TextField(blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-created_at", "-id"]
 
     def __str__(self) -> str:
-        return f"AnswerEvaluation(id={self.id}, message_id={self.message_id}, total={self.total_score})"
+        return f"AnswerEvaluation(id={self.id}, message_id={self.message_id}, status={self.status}, total={self.total_score})"
 
 
 class ProgrammingQAPair(models.Model):
@@ -101,6 +111,9 @@ class ProgrammingQAPair(models.Model):
     answer_creation_date = models.DateTimeField(null=True, blank=True, db_index=True)
     question_code_snippets_json = models.JSONField(default=list, blank=True)
     answer_code_snippets_json = models.JSONField(default=list, blank=True)
+    # 列表页摘要，导入/保存时由正文生成（见 utils/excerpt.py），列表查询只读这两列不读正文
+    question_excerpt = models.TextField(blank=True, default="")
+    answer_excerpt = models.TextField(blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
@@ -111,3 +124,43 @@ class ProgrammingQAPair(models.Model):
 
     def __str__(self) -> str:
         return f"ProgrammingQAPair(qid={self.question_id}, aid={self.answer_id})"
+
+    def save(self, *args, **kwargs) -> None:
+        """保存前按正文重算摘要；只保存部分字段且包含正文时，摘要列也一并写入。
+
+        bulk_create 由调用方自己先算好摘要，QuerySet.update() 改正文不会刷新摘要。
+        """
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None:
+            fill_pair_excerpts(self)
+        elif {"question_body", "answer_body"} & set(update_fields):
+            fill_pair_excerpts(self)
+            kwargs["update_fields"] = {*update_fields, "question_excerpt", "answer_excerpt"}
+        super().save(*args, **kwargs)
+
+
+class Tag(models.Model):
+    # 标签维度表，pair_count 为带该标签的问答对数量，由导入命令与保存/删除信号增量维护（见 signals.py）
+    name = models.CharField(max_length=128, unique=True)
+    pair_count = models.IntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-pair_count", "name"]
+
+    def __str__(self) -> str:
+        return f"Tag(name={self.name}, pair_count={self.pair_count})"
+
+
+class PairTag(models.Model):
+    # 问答对与标签的关联表，按标签过滤、统计标签分面都走 (tag, pair) 索引，不再扫描 tags_json
+    pair = models.ForeignKey(ProgrammingQAPair, on_delete=models.CASCADE, related_name="pair_tags")
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="pair_tags")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tag", "pair"], name="uniq_pair_tag_tag_pair"),
+        ]
+
+    def __str__(self) -> str:
+        return f"PairTag(pair_id={self.pair_id}, tag_id={self.tag_id})"
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
-import re
-
+from django.conf import settings
 from rest_framework import serializers
 
 from django_qa.models import (
@@ -13,18 +12,6 @@ from django_qa.models import (
 )
 
 
-_HTML_TAG_RE = re.compile(r"<[^>]+>")
-
-
-def _excerpt(text: str, max_chars: int) -> str:
-    s = (text or "").strip()
-    s = _HTML_TAG_RE.sub(" ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    if len(s) <= max_chars:
-        return s
-    return s[: max_chars - 1].rstrip() + "…"
-
-
 class PromptTemplateListSerializer(serializers.ModelSerializer):
     class Meta:
         model = PromptTemplate
@@ -77,7 +64,10 @@ class EvaluationSerializer(serializers.ModelSerializer):
             "readability_score",
             "total_score",
             "analysis_report",
+            "status",
+            "error_msg",
             "created_at",
+            "updated_at",
         ]
 
 
@@ -90,6 +80,12 @@ class MessageListSerializer(serializers.ModelSerializer):
         model = ConversationMessage
         fields = ["id", "role", "content", "citations", "tool_events", "evaluation", "created_at"]
 
+    def __init__(self, *args, fields: set[str] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields) - {"id"}:
+                self.fields.pop(name)
+
     def get_citations(self, obj):
         return obj.citations_json or []
 
@@ -107,6 +103,17 @@ class QARequestSerializer(serializers.Serializer):
     prompt_scene = serializers.CharField(max_length=64, required=False, allow_blank=True, default="")
 
 
+class BatchQARequestSerializer(serializers.Serializer):
+    questions = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    prompt_scene = serializers.CharField(max_length=64, required=False, allow_blank=True, default="")
+
+    def validate_questions(self, value: list[str]) -> list[str]:
+        limit = int(getattr(settings, "QA_BATCH_MAX_QUESTIONS", 50))
+        if len(value) > limit:
+            raise serializers.ValidationError(f"一次最多提交 {limit} 个问题")
+        return value
+
+
 class QAResponseSerializer(serializers.Serializer):
     answer = serializers.CharField()
     evaluation = EvaluationSerializer(required=False, allow_null=True)
@@ -120,8 +127,6 @@ class AnswerMetricsSerializer(serializers.Serializer):
 
 class DatasetPairSerializer(serializers.ModelSerializer):
     tags = serializers.SerializerMethodField()
-    question_excerpt = serializers.SerializerMethodField()
-    answer_excerpt = serializers.SerializerMethodField()
 
     class Meta:
         model = ProgrammingQAPair
@@ -144,12 +149,6 @@ class DatasetPairSerializer(serializers.ModelSerializer):
     def get_tags(self, obj):
         return obj.tags_json or []
 
-    def get_question_excerpt(self, obj):
-        return _excerpt(obj.question_body or "", 240)
-
-    def get_answer_excerpt(self, obj):
-        return _excerpt(obj.answer_body or "", 360)
-
 
 class DatasetPairDetailSerializer(serializers.ModelSerializer):
     tags = serializers.SerializerMethodField()
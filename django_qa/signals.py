@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from django_qa.models import ProgrammingQAPair
+from django_qa.utils.tag_stats import apply_tag_deltas, clean_tags, diff_tags, relink_pair_tags
+
+
+@receiver(pre_save, sender=ProgrammingQAPair)
+def _remember_stored_tags(sender, instance: ProgrammingQAPair, update_fields=None, raw=False, **kwargs) -> None:
+    # 保存前记下库里现有的标签，post_save 按差异增减计数并增删关联行；bulk_create / QuerySet.update() 不走这里，由调用方自己维护
+    instance._stored_tags = None
+    if raw or (update_fields is not None and "tags_json" not in update_fields):
+        return
+    if instance._state.adding:
+        instance._stored_tags = []
+        return
+    instance._stored_tags = sender.objects.filter(pk=instance.pk).values_list("tags_json", flat=True).first() or []
+
+
+@receiver(post_save, sender=ProgrammingQAPair)
+def _apply_tag_changes(sender, instance: ProgrammingQAPair, **kwargs) -> None:
+    stored = getattr(instance, "_stored_tags", None)
+    if stored is None:
+        return
+    instance._stored_tags = None
+    deltas = diff_tags(stored, instance.tags_json)
+    if not deltas:
+        return
+    with transaction.atomic():
+        apply_tag_deltas(deltas)
+        relink_pair_tags(instance.pk, deltas)
+
+
+@receiver(post_delete, sender=ProgrammingQAPair)
+def _decrement_tag_counts(sender, instance: ProgrammingQAPair, **kwargs) -> None:
+    apply_tag_deltas(Counter({name: -1 for name in clean_tags(instance.tags_json)}))
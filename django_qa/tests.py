@@ -0,0 +1,1354 @@
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
+
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from django_qa import views
+from django_qa.checks import check_fulltext_triggers, check_sandbox_isolation
+from django_qa.models import (
+    AnswerEvaluation,
+    ConversationMessage,
+    ConversationThread,
+    PairTag,
+    ProgrammingQAPair,
+    PromptTemplate,
+    Tag,
+)
+from django_qa.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from django_qa.utils.code_analysis import StreamingCodeAnalyzer, _extract_code_blocks, analyze_code_comprehensive
+from django_qa.utils.code_blocks import extract_code_blocks
+from django_qa.utils.context_budget import count_tokens, pack_latest, truncate_tokens
+from django_qa.utils.fulltext import FTS_TABLE, fulltext_backend, search_pairs
+from django_qa.utils.llm import LLMMessage, chat, chat_stream, llm_cache_stats
+from django_qa.utils.llm_clients import ProviderConfig, ProviderRegistry
+from django_qa.utils.llm_ollama import OllamaError
+from django_qa.utils.llm_router import LatencyTracker, LLMRouter, Route, resolve_routes
+from django_qa.utils.llm_scheduler import FairScheduler, LLMQueueTimeout
+from django_qa.utils.qa_match import QAMatcher, _extract_any_code
+from django_qa.utils.sandbox import SandboxPool, get_default_sandbox, sandbox_supported
+from django_qa.utils.semantic_cache import SemanticAnswerCache
+from django_qa.utils.singleflight import SingleFlight
+from django_qa.utils.tag_stats import apply_tag_deltas, link_pair_tags
+
+
+ANSWER_WITH_CODE = "示例：\n\n```python\ndef add(a, b):\n    return a + b\n```\n"
+
+
+class MessageFlowTests(APITestCase):
+    def setUp(self):
+        self.user_password = "pass123456"
+        self.user = get_user_model().objects.create_user(username="u_qa", password=self.user_password)
+        self.other = get_user_model().objects.create_user(username="u_qa_other", password=self.user_password)
+        self.thread = ConversationThread.objects.create(owner=self.user, title="t")
+
+    def _login(self, username: str) -> None:
+        resp = self.client.post("/api/auth/login/", {"username": username, "password": self.user_password}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {resp.data['data']['token']}")
+
+    def _post_message(self, content: str = "如何相加两个数？"):
+        return self.client.post(f"/api/qa/threads/{self.thread.id}/messages/", {"content": content}, format="json")
+
+    @patch("django_qa.views.chat", return_value=ANSWER_WITH_CODE)
+    def test_post_message_returns_pending_evaluation(self, _chat):
+        self._login(self.user.username)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            resp = self._post_message()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["code"], 20001)
+        evaluation = resp.data["data"]["assistant"]["evaluation"]
+        self.assertEqual(evaluation["status"], "pending")
+        self.assertEqual(len(callbacks), 1)
+
+    @override_settings(QA_EVALUATION_ASYNC=False)
+    @patch("django_qa.views.chat", return_value=ANSWER_WITH_CODE)
+    def test_evaluation_poll_endpoint(self, _chat):
+        self._login(self.user.username)
+        resp = self._post_message()
+        self.assertEqual(resp.status_code, 200)
+        message_id = resp.data["data"]["assistant"]["id"]
+
+        resp = self.client.get(f"/api/qa/messages/{message_id}/evaluation/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["data"]["status"], "done")
+        self.assertEqual(resp.data["data"]["syntax_score"], 10.0)
+        self.assertEqual(AnswerEvaluation.objects.filter(message_id=message_id, status="done").count(), 1)
+
+        self._login(self.other.username)
+        resp = self.client.get(f"/api/qa/messages/{message_id}/evaluation/")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_stream_message_events(self):
+        self._login(self.user.username)
+        chunks = [ANSWER_WITH_CODE[i : i + 5] for i in range(0, len(ANSWER_WITH_CODE), 5)]
+        with patch("django_qa.views.chat_stream", return_value=iter(chunks)):
+            resp = self.client.post(
+                f"/api/qa/threads/{self.thread.id}/messages/stream/",
+                {"content": "如何相加两个数？"},
+                format="json",
+                HTTP_ACCEPT="text/event-stream",
+            )
+            self.assertEqual(resp.status_code, 200)
+            body = b"".join(resp.streaming_content).decode("utf-8")
+
+        events = []
+        for raw in body.strip().split("\n\n"):
+            name, data = raw.split("\n", 1)
+            events.append((name[len("event: ") :], json.loads(data[len("data: ") :])))
+        names = [name for name, _ in events]
+        self.assertEqual(names[:3], ["user", "citations", "meta"])
+        self.assertEqual(names[-1], "done")
+        self.assertEqual("".join(d["delta"] for n, d in events if n == "token"), ANSWER_WITH_CODE)
+
+        done = events[-1][1]
+        self.assertIsNotNone(done["ttft_ms"])
+        self.assertEqual(done["assistant"]["evaluation"]["status"], "done")
+        self.assertEqual(done["assistant"]["content"], ANSWER_WITH_CODE.strip())
+        self.assertIn("llm_stream", [e["name"] for e in done["assistant"]["tool_events"]])
+
+    @override_settings(QA_EVALUATION_ASYNC=False)
+    def test_async_message_endpoint(self):
+        self._login(self.user.username)
+        with patch("django_qa.views.achat", new=AsyncMock(return_value=ANSWER_WITH_CODE)):
+            resp = self.client.post(
+                f"/api/qa/async/threads/{self.thread.id}/messages/", {"content": "如何相加两个数？"}, format="json"
+            )
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()["data"]
+        self.assertEqual(data["assistant"]["content"], ANSWER_WITH_CODE)
+        self.assertEqual(data["assistant"]["evaluation"]["status"], "done")
+
+        resp = self.client.get(f"/api/qa/async/threads/{self.thread.id}/messages/")
+        self.assertEqual([m["role"] for m in resp.json()["data"]], ["user", "assistant"])
+        # 与同步接口同样支持游标分页
+        for url in (f"/api/qa/threads/{self.thread.id}/messages/", f"/api/qa/async/threads/{self.thread.id}/messages/"):
+            first = self.client.get(url, {"limit": 1, "fields": "id,role"}).json()["data"]
+            second = self.client.get(url, {"limit": 1, "cursor": first["next_cursor"]}).json()["data"]
+            self.assertEqual([first["items"][0]["role"], second["items"][0]["role"]], ["user", "assistant"])
+            self.assertIsNone(second["next_cursor"])
+            self.assertEqual(self.client.get(url, {"cursor": "bad"}).status_code, 400)
+
+        self.client.credentials()
+        resp = self.client.get(f"/api/qa/async/threads/{self.thread.id}/messages/")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_async_message_errors_match_sync_envelopes(self):
+        cases = [(self.thread.id, None), (self.thread.id, "bad-token"), (self.thread.id + 100, "login")]
+        for thread_id, auth in cases:
+            self.client.credentials()
+            if auth == "login":
+                self._login(self.user.username)
+            elif auth:
+                self.client.credentials(HTTP_AUTHORIZATION=f"Token {auth}")
+            sync = self.client.post(f"/api/qa/threads/{thread_id}/messages/", {"content": "hi"}, format="json")
+            async_ = self.client.post(f"/api/qa/async/threads/{thread_id}/messages/", {"content": "hi"}, format="json")
+            self.assertEqual(async_.status_code, sync.status_code)
+            self.assertEqual(async_.json()["code"], sync.json()["code"])
+        self.assertEqual(async_.status_code, 404)
+
+    @patch("django_qa.views.chat", side_effect=LLMQueueTimeout("1", 20000))
+    def test_queue_timeout_fails_fast_with_429(self, _chat):
+        self._login(self.user.username)
+        resp = self._post_message()
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.data["code"], 42901)
+        self.assertEqual(resp.data["data"]["waited_ms"], 20000)
+
+    def test_open_circuit_falls_back_to_retrieval_answer(self):
+        rec = {
+            "type": "recommendation",
+            "question_id": 1,
+            "answer_id": 2,
+            "title": "Add two numbers",
+            "similarity": 0.8,
+            "answer_score": 12,
+            "answer_excerpt": "use a + b",
+        }
+        self._login(self.user.username)
+        with patch("django_qa.views.chat", side_effect=CircuitOpenError(12)), patch(
+            "django_qa.views._run_retrieval", return_value=([rec], [], [rec])
+        ):
+            resp = self._post_message()
+        self.assertEqual(resp.status_code, 200)
+        assistant = resp.data["data"]["assistant"]
+        self.assertIn("Add two numbers", assistant["content"])
+        self.assertIn("https://stackoverflow.com/a/2", assistant["content"])
+        self.assertEqual(assistant["tool_events"][-1]["name"], "llm_circuit_fallback")
+        self.assertEqual(ConversationMessage.objects.get(id=assistant["id"]).prompt_version, "")
+
+        with patch("django_qa.views.chat", side_effect=CircuitOpenError(12)), patch(
+            "django_qa.views._run_retrieval", return_value=([], [], [])
+        ):
+            resp = self._post_message()
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.data["code"], 50301)
+
+    @override_settings(QA_EVALUATION_ASYNC=False)
+    def test_semantic_cache_reuses_first_turn_answer(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        vectorizer = TfidfVectorizer(stop_words="english").fit(
+            ["how to add two numbers in python", "how to sort a list of dicts", "read a csv file with pandas"]
+        )
+        cache = SemanticAnswerCache(vectorizer.transform, threshold=0.9)
+        self._login(self.user.username)
+        with patch("django_qa.views.get_semantic_cache", return_value=cache), patch(
+            "django_qa.views.chat", return_value=ANSWER_WITH_CODE
+        ) as chat_mock:
+            first = self._post_message("How to add two numbers in Python?")
+            self.thread = ConversationThread.objects.create(owner=self.user, title="")
+            second = self._post_message("add two numbers python")
+            self.assertEqual(chat_mock.call_count, 1)
+
+            self.thread = ConversationThread.objects.create(owner=self.user, title="")
+            self._post_message("how to sort a list of dicts")
+            self.assertEqual(chat_mock.call_count, 2)
+
+            # 相似度不到阈值的改写不命中
+            self.thread = ConversationThread.objects.create(owner=self.user, title="")
+            self._post_message("add numbers in a csv file")
+            self.assertEqual(chat_mock.call_count, 3)
+
+            # 另一个用户问同样的问题也不会拿到这个用户的回答
+            self._login(self.other.username)
+            self.thread = ConversationThread.objects.create(owner=self.other, title="")
+            other = self._post_message("How to add two numbers in Python?")
+            self.assertEqual(chat_mock.call_count, 4)
+            self.assertNotEqual(other.data["data"]["assistant"]["tool_events"][0]["name"], "semantic_cache")
+
+        source = first.data["data"]["assistant"]
+        reused = second.data["data"]["assistant"]
+        self.assertEqual(reused["content"], source["content"])
+        self.assertEqual(reused["evaluation"]["status"], "done")
+        self.assertEqual(reused["evaluation"]["total_score"], source["evaluation"]["total_score"])
+        self.assertEqual(reused["tool_events"][0]["tool_out"]["result"]["source_message_id"], source["id"])
+
+        cold = SemanticAnswerCache(vectorizer.transform, threshold=0.9)
+        version = ConversationMessage.objects.get(id=source["id"]).prompt_version
+        self.assertEqual(cold.lookup("python: add two numbers", version, self.user.id).message_id, source["id"])
+        self.assertIsNone(cold.lookup("python: add two numbers", version + "-changed", self.user.id))
+        self.assertEqual(
+            cold.lookup("python: add two numbers", version, self.other.id).message_id,
+            other.data["data"]["assistant"]["id"],
+        )
+        shared = SemanticAnswerCache(vectorizer.transform, threshold=0.9, shared=True)
+        self.assertIsNotNone(shared.lookup("python: add two numbers", version, 0))
+
+    def test_messages_and_threads_page_with_cursor(self):
+        for i in range(5):
+            ConversationMessage.objects.create(thread=self.thread, role="user", content=f"m{i}")
+        ConversationThread.objects.create(owner=self.user, title="t2")
+        self._login(self.user.username)
+
+        walked, cursor = [], ""
+        while cursor is not None:
+            resp = self.client.get(f"/api/qa/threads/{self.thread.id}/messages/", {"limit": 2, "cursor": cursor})
+            walked += [m["content"] for m in resp.data["data"]["items"]]
+            cursor = resp.data["data"]["next_cursor"]
+        self.assertEqual(walked, [f"m{i}" for i in range(5)])
+
+        resp = self.client.get("/api/qa/threads/", {"limit": 1})
+        self.assertEqual(len(resp.data["data"]["items"]), 1)
+        resp = self.client.get("/api/qa/threads/", {"limit": 1, "cursor": resp.data["data"]["next_cursor"]})
+        self.assertEqual(resp.data["data"]["items"][0]["title"], "t")
+        self.assertIsNone(resp.data["data"]["next_cursor"])
+
+    def test_message_list_loads_evaluations_in_one_query(self):
+        for i in range(6):
+            ConversationMessage.objects.create(thread=self.thread, role="user", content=f"q{i}")
+            answer = ConversationMessage.objects.create(
+                thread=self.thread, role="assistant", content=ANSWER_WITH_CODE, citations_json=[{"type": "match"}] * 50
+            )
+            AnswerEvaluation.objects.create(message=answer, total_score=i)
+        self._login(self.user.username)
+        url = f"/api/qa/threads/{self.thread.id}/messages/"
+
+        # 认证、会话归属、消息列表各一条，与消息条数无关
+        with self.assertNumQueries(3):
+            resp = self.client.get(url)
+        self.assertEqual(len(resp.data["data"]), 12)
+        self.assertEqual(resp.data["data"][-1]["evaluation"]["total_score"], 5.0)
+        self.assertIsNone(resp.data["data"][0]["evaluation"])
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url, {"fields": "role,content"})
+        self.assertEqual(set(resp.data["data"][1]), {"id", "role", "content"})
+        self.assertNotIn("citations_json", ctx.captured_queries[-1]["sql"])
+        self.assertNotIn("django_qa_answerevaluation", ctx.captured_queries[-1]["sql"])
+
+        with self.assertNumQueries(3):
+            resp = self.client.get(url, {"limit": 4, "fields": "content,evaluation"})
+        self.assertEqual(resp.data["data"]["items"][1]["evaluation"]["total_score"], 0.0)
+
+    @override_settings(QA_RETRIEVAL_TIMEOUT=0.2)
+    def test_slow_retrieval_is_dropped_after_budget(self):
+        rec = {"type": "recommendation", "question_id": 1, "answer_id": 2, "title": "Add two numbers"}
+        release = threading.Event()
+
+        def slow_retrieval(_content):
+            release.wait(5)
+            return [rec], [], [rec]
+
+        self._login(self.user.username)
+        try:
+            with patch("django_qa.views._run_retrieval", side_effect=slow_retrieval), patch(
+                "django_qa.views.chat", return_value=ANSWER_WITH_CODE
+            ) as chat_mock:
+                t0 = time.perf_counter()
+                resp = self._post_message()
+                elapsed = time.perf_counter() - t0
+        finally:
+            release.set()
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(elapsed, 3)
+        assistant = resp.data["data"]["assistant"]
+        self.assertEqual(assistant["citations"], [])
+        event = assistant["tool_events"][0]
+        self.assertFalse(event["tool_out"]["ok"])
+        self.assertTrue(event["tool_out"]["meta"]["dropped"])
+        self.assertNotIn("Add two numbers", "\n".join(m.content for m in chat_mock.call_args.args[0]))
+
+    @override_settings(QA_RETRIEVAL_TIMEOUT=0.2, QA_RETRIEVAL_WORKERS=1)
+    def test_retrieval_is_skipped_while_pool_is_held_by_abandoned_jobs(self):
+        release = threading.Event()
+
+        def slow_retrieval(_content):
+            release.wait(5)
+            return [], [], []
+
+        self._login(self.user.username)
+        try:
+            with patch("django_qa.views._run_retrieval", side_effect=slow_retrieval) as retrieval_mock, patch(
+                "django_qa.views.chat", return_value=ANSWER_WITH_CODE
+            ):
+                self.assertTrue(self._post_message().data["data"]["assistant"]["tool_events"][0]["tool_out"]["meta"]["dropped"])
+                resp = self._post_message("再问一次")
+        finally:
+            release.set()
+        self.assertEqual(retrieval_mock.call_count, 1)
+        event = resp.data["data"]["assistant"]["tool_events"][0]
+        self.assertTrue(event["tool_out"]["meta"]["saturated"])
+
+        deadline = time.perf_counter() + 3
+        while views._RETRIEVAL_ABANDONED and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(views._RETRIEVAL_ABANDONED, 0)
+
+    @override_settings(QA_THREAD_SUMMARY_EVERY=2, QA_THREAD_SUMMARY_KEEP_RECENT=2, QA_THREAD_SUMMARY_ASYNC=False)
+    def test_rolling_summary_replaces_folded_turns_in_prompt(self):
+        PromptTemplate.objects.create(scene="default", user_prompt_template="{{context}}\n\n问题：{{question}}")
+        self._login(self.user.username)
+        with patch("django_qa.views.chat", return_value=ANSWER_WITH_CODE) as chat_mock, patch(
+            "django_qa.utils.thread_summary.chat", return_value="用户在学习 Python 数字相加"
+        ) as summary_mock:
+            self._post_message("第一问：如何相加两个数？")
+            self.assertEqual(summary_mock.call_count, 0)
+            self._post_message("第二问：浮点数呢？")
+            self.assertEqual(summary_mock.call_count, 1)
+            self._post_message("第三问：整数溢出吗？")
+            self.assertEqual(summary_mock.call_count, 2)
+
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.summary, "用户在学习 Python 数字相加")
+        folded = ConversationMessage.objects.filter(thread=self.thread).order_by("id")[3]
+        self.assertEqual(self.thread.summary_message_id, folded.id)
+
+        first_fold = summary_mock.call_args_list[0].args[0][1].content
+        second_fold = summary_mock.call_args_list[1].args[0][1].content
+        self.assertIn("第一问", first_fold)
+        self.assertIn("已有摘要：\n用户在学习 Python 数字相加", second_fold)
+        self.assertNotIn("第一问", second_fold)
+        self.assertIn("第二问", second_fold)
+        last_prompt = "\n".join(m.content for m in chat_mock.call_args_list[-1].args[0])
+        self.assertIn("对话摘要：用户在学习 Python 数字相加", last_prompt)
+        self.assertNotIn("第一问", last_prompt)
+        self.assertIn("第二问", last_prompt)
+
+
+class BatchQATests(APITestCase):
+    def setUp(self):
+        get_user_model().objects.create_user(username="u_batch", password="pass123456")
+        resp = self.client.post("/api/auth/login/", {"username": "u_batch", "password": "pass123456"}, format="json")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {resp.data['data']['token']}")
+
+    def test_batch_streams_one_line_per_question_then_summary(self):
+        def fake_chat(messages, **kwargs):
+            if "boom" in messages[-1].content:
+                raise RuntimeError("upstream down")
+            return ANSWER_WITH_CODE
+
+        matcher = patch("django_qa.views.get_default_matcher").start()
+        self.addCleanup(patch.stopall)
+        matcher.return_value.match_and_recommend_many.side_effect = lambda qs, **kw: [
+            {"matches": [], "recommendations": []} for _ in qs
+        ]
+        with patch("django_qa.views.chat", side_effect=fake_chat) as chat_mock:
+            resp = self.client.post("/api/qa/batch/", {"questions": ["q1", "boom", "q3"]}, format="json")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp["Content-Type"], "application/x-ndjson; charset=utf-8")
+            lines = [json.loads(x) for x in b"".join(resp.streaming_content).decode("utf-8").splitlines()]
+
+        self.assertEqual(matcher.return_value.match_and_recommend_many.call_count, 1)
+        self.assertEqual(chat_mock.call_count, 3)
+        items = sorted((x for x in lines if x["type"] == "item"), key=lambda x: x["index"])
+        self.assertEqual([x["ok"] for x in items], [True, False, True])
+        self.assertEqual(items[0]["evaluation"]["syntax_score"], 10.0)
+        self.assertEqual(items[1]["code"], 50201)
+        self.assertEqual(lines[-1]["type"], "done")
+        self.assertEqual((lines[-1]["succeeded"], lines[-1]["failed"]), (2, 1))
+
+    @override_settings(QA_BATCH_CONCURRENCY=2)
+    def test_batch_shares_one_bounded_pool_and_closes_connections(self):
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+
+        def slow_chat(messages, **kwargs):
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(0.02)
+            with lock:
+                state["running"] -= 1
+            return "plain answer"
+
+        matcher = patch("django_qa.views.get_default_matcher").start()
+        self.addCleanup(patch.stopall)
+        matcher.return_value.match_and_recommend_many.side_effect = lambda qs, **kw: [
+            {"matches": [], "recommendations": []} for _ in qs
+        ]
+        with patch("django_qa.views.chat", side_effect=slow_chat), patch(
+            "django_qa.views.close_old_connections"
+        ) as close_mock:
+            for _ in range(2):
+                resp = self.client.post("/api/qa/batch/", {"questions": ["q1", "q2", "q3", "q4"]}, format="json")
+                lines = [json.loads(x) for x in b"".join(resp.streaming_content).decode("utf-8").splitlines()]
+                self.assertEqual(lines[-1]["succeeded"], 4)
+                executor = views._get_batch_executor()
+                self.assertIs(executor, views._BATCH_EXECUTOR)
+
+        self.assertEqual(state["peak"], 2)
+        self.assertEqual(close_mock.call_count, 2 * 4 * 2)
+        batch_threads = [t for t in threading.enumerate() if t.name.startswith("qa-batch")]
+        self.assertLessEqual(len(batch_threads), executor._max_workers)
+
+    def test_batch_scoring_failure_fails_only_that_item(self):
+        matcher = patch("django_qa.views.get_default_matcher").start()
+        self.addCleanup(patch.stopall)
+        matcher.return_value.match_and_recommend_many.side_effect = lambda qs, **kw: [
+            {"matches": [], "recommendations": []} for _ in qs
+        ]
+        real_analyze = views.analyze_code_comprehensive
+
+        def flaky_analyze(answer, **kwargs):
+            if "bad" in answer:
+                raise OSError("sandbox restart failed")
+            return real_analyze(answer, **kwargs)
+
+        with patch("django_qa.views.chat", side_effect=lambda messages, **kw: messages[-1].content), patch(
+            "django_qa.views.analyze_code_comprehensive", side_effect=flaky_analyze
+        ):
+            resp = self.client.post("/api/qa/batch/", {"questions": ["ok", "bad"]}, format="json")
+            lines = [json.loads(x) for x in b"".join(resp.streaming_content).decode("utf-8").splitlines()]
+
+        items = {x["index"]: x for x in lines if x["type"] == "item"}
+        self.assertTrue(items[0]["ok"])
+        self.assertEqual((items[1]["ok"], items[1]["code"], items[1]["error_type"]), (False, 50001, "OSError"))
+        self.assertEqual(lines[-1]["type"], "done")
+        self.assertEqual((lines[-1]["succeeded"], lines[-1]["failed"]), (1, 1))
+
+    @override_settings(QA_BATCH_MAX_QUESTIONS=2)
+    def test_batch_rejects_oversized_request(self):
+        resp = self.client.post("/api/qa/batch/", {"questions": ["a", "b", "c"]}, format="json")
+        self.assertEqual(resp.status_code, 400)
+
+
+class QAMatcherBatchTests(SimpleTestCase):
+    def test_batched_matching_equals_single_question_matching(self):
+        rows = [
+            ("How to add two numbers in python", "use a + b"),
+            ("How to add numbers in a list", "use sum(items)"),
+            ("Sort a list of dicts by key", "sorted(rows, key=...)"),
+            ("Sort a list in reverse order", "items.sort(reverse=True)"),
+            ("Read a csv file with pandas", "pd.read_csv(path)"),
+            ("Read a json file in python", "json.load(f)"),
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            data_path = Path(tmp) / "qa.jsonl"
+            with data_path.open("w", encoding="utf-8") as f:
+                for i, (title, answer) in enumerate(rows, start=1):
+                    f.write(json.dumps({"question_id": i, "answer_id": 100 + i, "title": title, "answer_body": answer}) + "\n")
+            matcher = QAMatcher(data_path=data_path, cache_dir=Path(tmp) / "index")
+            questions = ["add two numbers", "", "sort a list", "read csv with pandas"]
+            with patch("django_qa.utils.qa_match.analyze_code_comprehensive", wraps=analyze_code_comprehensive) as analyze:
+                batched = matcher.match_and_recommend_many(questions, top_k_match=3, top_k_recommend=2, chunk_size=2)
+                analyzed = analyze.call_count
+                single = [matcher.match_and_recommend(q, top_k_match=3, top_k_recommend=2) for q in questions]
+            # 质量分按回答跨请求缓存：后续的单条检索不再重复分析
+            self.assertLessEqual(analyzed, len(rows))
+            self.assertEqual(analyze.call_count, analyzed)
+
+        self.assertEqual(batched, single)
+        self.assertEqual(batched[1], {"matches": [], "recommendations": []})
+        self.assertEqual(batched[2]["matches"][0]["title"].split()[0], "Sort")
+
+
+class DatasetSearchTests(APITestCase):
+    def setUp(self):
+        get_user_model().objects.create_user(username="u_data", password="pass123456")
+        resp = self.client.post("/api/auth/login/", {"username": "u_data", "password": "pass123456"}, format="json")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {resp.data['data']['token']}")
+        self.body_hit = ProgrammingQAPair.objects.create(
+            question_id=1, answer_id=11, title="Load a file", question_body="<p>I use pandas to read data</p>", answer_score=50
+        )
+        self.title_hit = ProgrammingQAPair.objects.create(
+            question_id=2, answer_id=12, title="Read csv with pandas", answer_body="<p>pd.read_csv</p>", answer_score=1
+        )
+        ProgrammingQAPair.objects.create(question_id=3, answer_id=13, title="Sort a list", answer_score=99)
+
+    def _search(self, q: str, **params):
+        resp = self.client.get("/api/qa/dataset/pairs/", {"q": q, **params})
+        self.assertEqual(resp.status_code, 200)
+        return [row["id"] for row in resp.data["data"]["items"]]
+
+    def test_fulltext_search_ranks_by_relevance_and_tracks_writes(self):
+        if fulltext_backend() != "sqlite_fts5":
+            self.skipTest("需要 SQLite FTS5")
+        self.assertEqual(self._search("pand"), [self.title_hit.id, self.body_hit.id])
+        self.assertEqual(self._search("pandas", sort="answer_score"), [self.body_hit.id, self.title_hit.id])
+        self.assertEqual(self._search("csv pandas"), [self.title_hit.id])
+        first = self.client.get("/api/qa/dataset/pairs/", {"q": "pand", "cursor": "", "page_size": 1}).data["data"]
+        second = self.client.get(
+            "/api/qa/dataset/pairs/", {"q": "pand", "cursor": first["next_cursor"], "page_size": 1}
+        ).data["data"]
+        self.assertEqual([first["items"][0]["id"], second["items"][0]["id"]], [self.title_hit.id, self.body_hit.id])
+
+        ProgrammingQAPair.objects.filter(id=self.title_hit.id).update(title="Parse csv")
+        self.body_hit.delete()
+        self.assertEqual(self._search("pandas"), [])
+        self.assertEqual(self._search("parse"), [self.title_hit.id])
+
+    def test_fulltext_triggers_exist_after_migrate(self):
+        if fulltext_backend() != "sqlite_fts5":
+            self.skipTest("需要 SQLite FTS5")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [ProgrammingQAPair._meta.db_table])
+            triggers = {row[0] for row in cursor.fetchall()}
+        self.assertEqual(triggers, {f"{FTS_TABLE}_ai", f"{FTS_TABLE}_ad", f"{FTS_TABLE}_au"})
+        self.assertEqual(check_fulltext_triggers(None, databases=["default"]), [])
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {FTS_TABLE}_au")
+        errors = check_fulltext_triggers(None, databases=["default"])
+        self.assertEqual([e.id for e in errors], ["django_qa.E002"])
+        self.assertIn(f"{FTS_TABLE}_au", errors[0].msg)
+
+    def test_fulltext_search_with_tag_filter_count_and_facets(self):
+        if fulltext_backend() != "sqlite_fts5":
+            self.skipTest("需要 SQLite FTS5")
+        link_pair_tags([(self.body_hit.id, ["python"]), (self.title_hit.id, ["python", "csv"])])
+        resp = self.client.get("/api/qa/dataset/pairs/", {"q": "pandas", "facets": 1})
+        data = resp.data["data"]
+        self.assertEqual((data["total"], data["total_exact"]), (2, True))
+        self.assertEqual(data["facets"], [{"tag": "python", "count": 2}, {"tag": "csv", "count": 1}])
+        self.assertEqual(self._search("pandas", tag="csv"), [self.title_hit.id])
+
+    def test_mysql_boolean_query_only_requires_indexed_words(self):
+        with patch("django_qa.utils.fulltext.fulltext_backend", return_value="mysql_fulltext"):
+            qs, ranked = search_pairs(ProgrammingQAPair.objects.all(), "How to sort a list in py")
+            self.assertTrue(ranked)
+            self.assertIn("+sort* +list*", qs.query.sql_with_params()[1])
+            # 全是停用词或短词时 MATCH 一行都不会命中，直接走 icontains
+            qs, ranked = search_pairs(ProgrammingQAPair.objects.all(), "how to a")
+            self.assertFalse(ranked)
+
+    def test_cursor_pages_walk_the_same_order_as_page_numbers(self):
+        for i in range(4, 8):
+            ProgrammingQAPair.objects.create(question_id=i, answer_id=10 + i, title=f"t{i}", answer_score=50)
+        legacy = []
+        for page in (1, 2, 3, 4):
+            resp = self.client.get("/api/qa/dataset/pairs/", {"page": page, "page_size": 2})
+            legacy += [row["id"] for row in resp.data["data"]["items"]]
+        self.assertEqual(resp.data["data"]["total"], 7)
+        self.assertTrue(resp.data["data"]["total_exact"])
+
+        walked, cursor = [], ""
+        while cursor is not None:
+            resp = self.client.get("/api/qa/dataset/pairs/", {"cursor": cursor, "page_size": 2, "with_total": 0})
+            self.assertNotIn("total", resp.data["data"])
+            walked += [row["id"] for row in resp.data["data"]["items"]]
+            cursor = resp.data["data"]["next_cursor"]
+        self.assertEqual(walked, legacy)
+        self.assertEqual(len(walked), 7)
+
+        resp = self.client.get("/api/qa/dataset/pairs/", {"cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get("/api/qa/dataset/pairs/", {"page": "abc"})
+        self.assertEqual((resp.status_code, resp.data["code"]), (400, 40001))
+
+    def test_list_reads_precomputed_excerpts_without_bodies(self):
+        self.title_hit.answer_body = "<p>" + "x " * 400 + "</p>"
+        self.title_hit.save()
+        self.assertTrue(self.title_hit.answer_excerpt.endswith("…"))
+        self.assertEqual(len(self.title_hit.answer_excerpt), 360)
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get("/api/qa/dataset/pairs/", {"with_total": 0})
+        rows = {row["id"]: row for row in resp.data["data"]["items"]}
+        self.assertEqual(rows[self.body_hit.id]["question_excerpt"], "I use pandas to read data")
+        self.assertEqual(rows[self.title_hit.id]["answer_excerpt"], self.title_hit.answer_excerpt)
+        pair_selects = [q["sql"] for q in ctx.captured_queries if "django_qa_programmingqapair" in q["sql"]]
+        self.assertTrue(pair_selects)
+        self.assertTrue(all('"answer_body"' not in sql for sql in pair_selects))
+
+    def test_partial_save_of_body_persists_new_excerpt(self):
+        self.body_hit.answer_body = "<p>use <code>pd.read_json</code></p>"
+        self.body_hit.save(update_fields=["answer_body"])
+        self.body_hit.refresh_from_db()
+        self.assertEqual(self.body_hit.answer_excerpt, "use pd.read_json")
+
+        ProgrammingQAPair.objects.filter(id=self.body_hit.id).update(answer_body="changed")
+        self.body_hit.refresh_from_db()
+        self.assertEqual(self.body_hit.answer_excerpt, "use pd.read_json")
+
+    def test_search_falls_back_to_icontains_without_index(self):
+        with patch("django_qa.utils.fulltext.fulltext_backend", return_value=None):
+            self.assertEqual(self._search("pandas"), [self.body_hit.id, self.title_hit.id])
+
+
+class TagStatsTests(APITestCase):
+    def _import(self, rows: list[dict], *extra: str) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "qa.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+            call_command("import_cleaned_qa", "--path", path, *extra, stdout=StringIO())
+
+    def test_import_and_delete_keep_counts_and_summary_reads_them(self):
+        rows = [
+            {"question_id": 1, "answer_id": 11, "title": "a", "tags": ["python", "pandas", "python"]},
+            {"question_id": 2, "answer_id": 12, "title": "b", "tags": ["python"]},
+            {"question_id": 2, "answer_id": 12, "title": "b", "tags": ["python"]},
+        ]
+        self._import(rows)
+        self._import(rows + [{"question_id": 3, "answer_id": 13, "title": "c", "tags": ["numpy"]}])
+        counts = dict(Tag.objects.values_list("name", "pair_count"))
+        self.assertEqual(counts, {"python": 2, "pandas": 1, "numpy": 1})
+
+        ProgrammingQAPair.objects.get(question_id=1).delete()
+        self.assertEqual(Tag.objects.get(name="python").pair_count, 1)
+        self.assertEqual(Tag.objects.get(name="pandas").pair_count, 0)
+
+        get_user_model().objects.create_user(username="u_tags", password="pass123456")
+        resp = self.client.post("/api/auth/login/", {"username": "u_tags", "password": "pass123456"}, format="json")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {resp.data['data']['token']}")
+        resp = self.client.get("/api/qa/dataset/summary/")
+        self.assertEqual(resp.data["data"]["top_tags"], [{"tag": "numpy", "count": 1}, {"tag": "python", "count": 1}])
+
+        resp = self.client.get("/api/qa/dataset/pairs/", {"tag": "python", "facets": 1})
+        self.assertEqual([row["question_id"] for row in resp.data["data"]["items"]], [2])
+        self.assertEqual(resp.data["data"]["facets"], [{"tag": "python", "count": 1}])
+
+        self._import(rows[:1], "--truncate")
+        self.assertEqual(dict(Tag.objects.values_list("name", "pair_count")), {"python": 1, "pandas": 1})
+        self.assertEqual(PairTag.objects.count(), 2)
+
+    def test_orm_create_edit_and_delete_keep_counts(self):
+        pair = ProgrammingQAPair.objects.create(question_id=1, answer_id=11, tags_json=["python", "pandas"])
+        ProgrammingQAPair.objects.create(question_id=2, answer_id=12, tags_json=["python"])
+        self.assertEqual(dict(Tag.objects.values_list("name", "pair_count")), {"python": 2, "pandas": 1})
+
+        pair.tags_json = ["python", "numpy", "numpy"]
+        pair.save()
+        pair.title = "只改标题"
+        pair.save(update_fields=["title"])
+        self.assertEqual(dict(Tag.objects.values_list("name", "pair_count")), {"python": 2, "pandas": 0, "numpy": 1})
+        self.assertEqual(
+            sorted(PairTag.objects.filter(pair=pair).values_list("tag__name", flat=True)), ["numpy", "python"]
+        )
+
+        pair.delete()
+        ProgrammingQAPair.objects.get(question_id=2).delete()
+        self.assertEqual(dict(Tag.objects.values_list("name", "pair_count")), {"python": 0, "pandas": 0, "numpy": 0})
+        # 计数不会被减成负数
+        apply_tag_deltas({"python": -1})
+        self.assertEqual(Tag.objects.get(name="python").pair_count, 0)
+
+    def test_pairtag_migration_links_existing_pairs(self):
+        migration = importlib.import_module("django_qa.migrations.0008_pairtag")
+        ProgrammingQAPair.objects.create(question_id=1, answer_id=11, tags_json=["python", "csv"])
+        ProgrammingQAPair.objects.create(question_id=2, answer_id=12, tags_json=["python"])
+        PairTag.objects.all().delete()
+        migration.backfill_pair_tags(django_apps, None)
+        self.assertEqual(PairTag.objects.count(), 3)
+        self.assertEqual(dict(Tag.objects.values_list("name", "pair_count")), {"python": 2, "csv": 1})
+
+    def test_backfill_links_existing_pairs_and_recounts(self):
+        ProgrammingQAPair.objects.create(question_id=1, answer_id=11, tags_json=["python", "csv"])
+        ProgrammingQAPair.objects.create(question_id=2, answer_id=12, tags_json=["python", " ", "python"])
+        PairTag.objects.all().delete()
+        Tag.objects.filter(name="python").update(pair_count=7)
+        call_command("backfill_pair_tags", "--batch-size", "1", stdout=StringIO())
+        call_command("backfill_pair_tags", stdout=StringIO())
+        self.assertEqual(PairTag.objects.count(), 3)
+        self.assertEqual(dict(Tag.objects.values_list("name", "pair_count")), {"python": 2, "csv": 1})
+
+
+class ReevaluateAnswersCommandTests(APITestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="u_reeval", password="pass123456")
+        self.thread = ConversationThread.objects.create(owner=user, title="t")
+
+    def test_rescore_and_resume_from_checkpoint(self):
+        first = ConversationMessage.objects.create(thread=self.thread, role="assistant", content=ANSWER_WITH_CODE)
+        AnswerEvaluation.objects.create(message=first, total_score=0, status="pending")
+        second = ConversationMessage.objects.create(thread=self.thread, role="assistant", content="纯文本回答")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = os.path.join(tmp, "ckpt.json")
+            call_command("reevaluate_answers", workers=1, batch_size=1, limit=1, checkpoint=checkpoint, stdout=StringIO())
+            first_eval = AnswerEvaluation.objects.get(message=first)
+            self.assertEqual(first_eval.status, "done")
+            self.assertGreater(first_eval.total_score, 0)
+            self.assertFalse(AnswerEvaluation.objects.filter(message=second).exists())
+
+            call_command("reevaluate_answers", workers=1, resume=True, checkpoint=checkpoint, stdout=StringIO())
+            self.assertEqual(AnswerEvaluation.objects.get(message=second).status, "done")
+
+
+class CodeBlockExtractionTests(SimpleTestCase):
+    def test_single_scan_finds_all_block_kinds(self):
+        text = (
+            "说明\n\n```python\ndef f():\n    return 1\n```\n\n"
+            "正文\n\n    x = 1\n    y = 2\n\n"
+            "<pre><code>a &lt; b</code></pre>"
+        )
+        blocks = extract_code_blocks(text)
+        self.assertEqual([b.kind for b in blocks], ["fenced", "indented", "html"])
+        self.assertEqual(blocks[0].lang, "python")
+        self.assertEqual(blocks[0].code, "def f():\n    return 1")
+        self.assertEqual(blocks[1].code, "x = 1\ny = 2")
+        self.assertEqual(blocks[2].code, "a < b")
+        self.assertIs(extract_code_blocks(text), blocks)
+
+    def test_per_kind_scoring_rules(self):
+        # fenced 块里的缩进行不再单独算一块
+        fenced = "```\ndef f():\n    return 1\n```"
+        self.assertEqual([b.kind for b in extract_code_blocks(fenced)], ["fenced"])
+        self.assertEqual(_extract_code_blocks(fenced), ["def f():\n    return 1"])
+
+        # <pre><code> 先去标签再反转义，转义过的尖括号保留为代码文本
+        html_code = '<pre class="x"><code>if a &lt; b:\n    <b>print</b>("&lt;T&gt;")</code></pre>'
+        self.assertEqual(_extract_code_blocks(html_code), ['if a < b:\n    print("<T>")'])
+
+        # 标注了其他语言的 fenced 块不按 Python 评分；不标注或标注 Python 的照常评分
+        text = "```js\nconst x = 1;\n```\n```bash\nls -la\n```\n```py\nx = 1\n```\n```\ny = 2\n```"
+        self.assertEqual([b.is_python for b in extract_code_blocks(text)], [False, False, True, True])
+        self.assertEqual(_extract_code_blocks(text), ["x = 1", "y = 2"])
+        self.assertEqual(_extract_any_code(text), "x = 1\n\ny = 2")
+
+        analyzer = StreamingCodeAnalyzer()
+        analyzer.feed(text)
+        self.assertEqual(analyzer.submitted_blocks, 2)
+        self.assertEqual(analyze_code_comprehensive("```js\nconst x = 1;\n```"), analyze_code_comprehensive("无代码"))
+        self.assertEqual(analyzer.finish(), analyze_code_comprehensive(text))
+
+
+class ProviderRegistryTests(SimpleTestCase):
+    @override_settings(LLM_CONNECT_TIMEOUT=3, LLM_READ_TIMEOUT=30, LLM_MAX_CONNECTIONS=7)
+    def test_clients_are_cached_per_provider(self):
+        registry = ProviderRegistry()
+        try:
+            client, model = registry.openai_client("qwen")
+            self.assertIs(registry.openai_client("qwen")[0], client)
+            self.assertTrue(model)
+            http = registry.http_client("qwen")
+            self.assertEqual((http.timeout.connect, http.timeout.read), (3.0, 30.0))
+            self.assertIsNot(registry.http_client("zhipu"), http)
+            with self.assertRaises(ValueError):
+                registry.config("unknown")
+        finally:
+            registry.close()
+
+
+@override_settings(
+    QA_LLM_CACHE_ENABLED=True,
+    QA_LLM_CACHE_MAX_TEMPERATURE=0.3,
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "llm": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "llm-cache-tests"},
+    },
+)
+class LLMResponseCacheTests(SimpleTestCase):
+    def test_cache_hits_bypass_and_stats(self):
+        messages = [LLMMessage(role="system", content="s"), LLMMessage(role="user", content="q")]
+        with patch("django_qa.utils.llm._chat_uncached", return_value="answer") as upstream:
+            self.assertEqual(chat(messages, scene="cache_test", prompt_version="1:v1"), "answer")
+            self.assertEqual(chat(messages, scene="cache_test", prompt_version="1:v1"), "answer")
+            self.assertEqual(upstream.call_count, 1)
+
+            chat(messages, scene="cache_test", prompt_version="2:v2")
+            self.assertEqual(upstream.call_count, 2)
+
+            chat(messages, temperature=0.9, scene="cache_test", prompt_version="1:v1")
+            self.assertEqual(upstream.call_count, 3)
+
+        row = next(r for r in llm_cache_stats()["scenes"] if r["scene"] == "cache_test")
+        self.assertEqual((row["hit"], row["miss"], row["bypass"]), (1, 2, 1))
+        self.assertAlmostEqual(row["hit_rate"], 1 / 3)
+
+    def test_stats_count_concurrent_lookups_and_survive_cache_clear(self):
+        messages = [LLMMessage(role="user", content="q")]
+        barrier = threading.Barrier(8)
+
+        def worker():
+            barrier.wait()
+            for _ in range(50):
+                chat(messages, temperature=0.9, scene="cache_race")
+
+        with patch("django_qa.utils.llm._chat_uncached", return_value="answer"):
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        caches["llm"].clear()
+
+        row = next(r for r in llm_cache_stats()["scenes"] if r["scene"] == "cache_race")
+        self.assertEqual((row["hit"], row["miss"], row["bypass"]), (0, 0, 400))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def _race(self, flights, fn, n=6, **kwargs):
+        barrier = threading.Barrier(n)
+        results = [None] * n
+
+        def worker(i):
+            barrier.wait()
+            try:
+                results[i] = flights[i % len(flights)].do("k", fn, **kwargs)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def _slow_call(self, calls):
+        def fn():
+            calls.append(1)
+            time.sleep(0.3)
+            return f"answer-{len(calls)}"
+
+        return fn
+
+    def test_concurrent_calls_share_one_result(self):
+        calls = []
+        flight = SingleFlight()
+        results = self._race([flight], self._slow_call(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(results), {"answer-1"})
+        self.assertEqual(flight.in_flight(), 0)
+        self.assertEqual(flight.do("k", lambda: "fresh"), "fresh")
+
+    def test_errors_propagate_to_waiters(self):
+        def fn():
+            time.sleep(0.2)
+            raise RuntimeError("upstream down")
+
+        results = self._race([SingleFlight()], fn, n=3)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+    def test_admission_errors_are_not_shared(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            if len(calls) == 1:
+                raise LLMQueueTimeout("leader", 200)
+            return "answer"
+
+        results = self._race([SingleFlight()], fn, n=3, local_errors=(LLMQueueTimeout,))
+        self.assertEqual(sum(isinstance(r, LLMQueueTimeout) for r in results), 1)
+        self.assertEqual(results.count("answer"), 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_follower_wait_is_capped_by_caller_budget(self):
+        flight = SingleFlight(wait_timeout=30)
+        leader_started = threading.Event()
+
+        def slow():
+            leader_started.set()
+            time.sleep(1.0)
+            return "leader"
+
+        t = threading.Thread(target=flight.do, args=("k", slow))
+        t.start()
+        leader_started.wait(1)
+        t0 = time.perf_counter()
+        self.assertEqual(flight.do("k", lambda: "own", wait_timeout=0.1), "own")
+        self.assertLess(time.perf_counter() - t0, 0.5)
+        t.join()
+
+    @skipUnless(os.name == "posix", "flock 仅在 POSIX 上可用")
+    def test_lock_file_coalesces_across_instances(self):
+        calls = []
+        with tempfile.TemporaryDirectory() as d:
+            flights = [SingleFlight(lock_dir=d), SingleFlight(lock_dir=d)]
+            results = self._race(flights, self._slow_call(calls), n=4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(results), {"answer-1"})
+
+
+class _FakeBackend:
+    def __init__(self, delays, failing=()):
+        self.delays = dict(delays)
+        self.failing = set(failing)
+        self.calls = []
+
+    def chat(self, route, messages, temperature):
+        self.calls.append(route.model)
+        time.sleep(self.delays.get(route.model, 0))
+        if route.model in self.failing:
+            raise RuntimeError(f"{route.model} down")
+        return f"from {route.model}"
+
+    def stream(self, route, messages, temperature):
+        self.calls.append(route.model)
+        time.sleep(self.delays.get(route.model, 0))
+        yield "from "
+        time.sleep(0.2)
+        yield route.model
+
+
+@override_settings(OLLAMA_MODEL_CODELLAMA="codellama:7b-instruct", ARK_LLM_TEXT_MODEL_ID="doubao-pro-32k")
+class ProviderRoutingTests(SimpleTestCase):
+    def _router(self, backend, models=("fast", "slow"), **kwargs):
+        return LLMRouter([Route("qwen", m) for m in models], backends={"openai": backend}, registry=ProviderRegistry(), **kwargs)
+
+    def test_resolve_current_llm_model_options(self):
+        routes = resolve_routes("doubao-pro, ollama:llama3,codellama,glm-4-flash", ProviderRegistry())
+        self.assertEqual(
+            [r.key for r in routes],
+            ["ark:doubao-pro-32k", "ollama:llama3", "ollama:codellama:7b-instruct", "zhipu:glm-4-flash"],
+        )
+        with self.assertRaises(ValueError):
+            resolve_routes("nope", ProviderRegistry())
+
+    def test_routes_to_fastest_healthy_provider(self):
+        backend = _FakeBackend({"fast": 0.01, "slow": 0.05}, failing={"fast"})
+        router = self._router(backend, tracker=LatencyTracker(failure_threshold=1, cooldown=60))
+        self.assertEqual(router.chat([], 0.2), "from slow")
+        self.assertEqual(router.ordered_routes()[0].model, "slow")
+
+        backend.failing.clear()
+        router = self._router(backend)
+        for _ in range(3):
+            router.chat([], 0.2)
+        self.assertEqual(router.ordered_routes()[0].model, "fast")
+        self.assertEqual(router.stats()["latency"]["qwen:fast"]["samples"], 2)
+
+    def test_stream_latency_sample_is_time_to_first_chunk(self):
+        router = self._router(_FakeBackend({"fast": 0.01}), models=("fast",))
+        self.assertEqual("".join(router.stream([], 0.2)), "from fast")
+        self.assertLess(router.tracker.p95(Route("qwen", "fast")), 0.15)
+
+    def test_hedges_when_primary_exceeds_p95(self):
+        backend = _FakeBackend({"fast": 0.01, "slow": 0.05})
+        router = self._router(backend, hedge=True, hedge_min_samples=3)
+        for _ in range(3):
+            router.tracker.record(Route("qwen", "fast"), 0.02, ok=True)
+        router.tracker.record(Route("qwen", "slow"), 0.05, ok=True)
+
+        backend.delays["fast"] = 1.0
+        t0 = time.perf_counter()
+        self.assertEqual(router.chat([], 0.2), "from slow")
+        self.assertLess(time.perf_counter() - t0, 0.5)
+        self.assertEqual(backend.calls, ["fast", "slow"])
+
+
+class _OllamaStandIn(BaseHTTPRequestHandler):
+    requests: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).requests.append((self.path, body))
+        if body["model"] == "missing":
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "model \\"missing\\" not found"}')
+            return
+        words = ["def ", "add", "(a, b)"]
+        self.send_response(200)
+        if body["stream"]:
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for w in words:
+                self.wfile.write((json.dumps({"message": {"role": "assistant", "content": w}, "done": False}) + "\n").encode())
+                self.wfile.flush()
+            self.wfile.write(b'{"message": {"role": "assistant", "content": ""}, "done": true}\n')
+        else:
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({"message": {"role": "assistant", "content": "".join(words)}, "done": True}).encode())
+
+
+@override_settings(OLLAMA_KEEP_ALIVE="-1", OLLAMA_NUM_CTX=4096)
+class OllamaBackendTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _OllamaStandIn)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        _OllamaStandIn.requests = []
+        self.registry = ProviderRegistry()
+        host, port = self.server.server_address
+        self.registry.register(
+            ProviderConfig(name="ollama", base_url=f"http://{host}:{port}", api_key="", model="llama3", kind="ollama", http2=False)
+        )
+        self.router = LLMRouter([Route("ollama", "llama3")], registry=self.registry)
+        self.messages = [{"role": "user", "content": "add"}]
+
+    def tearDown(self):
+        self.registry.close()
+
+    async def _outside_client_loop(self):
+        self.registry.async_http_client("ollama")
+
+    def test_chat_and_stream_use_native_api(self):
+        self.assertEqual(self.router.chat(self.messages, 0.1), "def add(a, b)")
+        self.assertEqual(list(self.router.stream(self.messages, 0.1)), ["def ", "add", "(a, b)"])
+
+        path, body = _OllamaStandIn.requests[0]
+        self.assertEqual(path, "/api/chat")
+        self.assertEqual(body["keep_alive"], "-1")
+        self.assertEqual(body["options"], {"temperature": 0.1, "num_ctx": 4096})
+        self.assertEqual([b["stream"] for _, b in _OllamaStandIn.requests], [False, True])
+
+    def test_async_chat_and_errors(self):
+        self.assertEqual(asyncio.run(self.router.achat(self.messages, 0.1)), "def add(a, b)")
+        client = self.registry._async_http_clients["ollama"]
+        # WSGI 下每个请求的 async_to_sync 都是新的事件循环，异步连接池仍然只有一个
+        self.assertEqual(asyncio.run(self.router.achat(self.messages, 0.1)), "def add(a, b)")
+        self.assertIs(self.registry._async_http_clients["ollama"], client)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self._outside_client_loop())
+        self.registry.close()
+        self.assertTrue(client.is_closed)
+        router = LLMRouter([Route("ollama", "missing")], registry=self.registry)
+        with self.assertRaisesRegex(OllamaError, "not found"):
+            router.chat(self.messages, 0.1)
+
+
+@patch("django_qa.utils.context_budget._encoding", return_value=None)
+class ContextBudgetTests(SimpleTestCase):
+    def test_heuristic_counts_cjk_and_words_differently(self, _enc):
+        self.assertEqual(count_tokens("如何读取文件"), 6)
+        self.assertEqual(count_tokens("read a file"), 3)
+        self.assertEqual(count_tokens("internationalization 2024!"), 8)
+
+    def test_truncation_and_packing_are_deterministic(self, _enc):
+        text = "第一句话。Second sentence here. 第三句话。"
+        head = truncate_tokens(text, 6)
+        self.assertEqual(head, truncate_tokens(text, 6))
+        self.assertLessEqual(count_tokens(head), 6)
+        self.assertTrue(text.startswith(head))
+        self.assertTrue(text.endswith(truncate_tokens(text, 5, keep="tail")))
+
+        packed = pack_latest(["user: 很早的问题" * 20, "assistant: old", "user: 最新问题"], 20)
+        self.assertTrue(packed.endswith("assistant: old\n\nuser: 最新问题"))
+        self.assertLessEqual(count_tokens(packed), 20)
+
+    @override_settings(QA_PROMPT_TOKEN_BUDGET=300, QA_PROMPT_RETRIEVAL_SHARE=0.5)
+    def test_prompt_fits_budget_and_keeps_question(self, _enc):
+        from django_qa.views import _build_llm_messages
+
+        prompt = PromptTemplate(system_prompt="你是编程助手。", user_prompt_template="{{context}}\n\n问题：{{question}}")
+        history = [ConversationMessage(role=r, content="历史消息" * 80) for r in ("user", "assistant", "user")]
+        recs = [{"title": f"rec {i}", "answer_excerpt": "answer text " * 60, "question_id": i, "answer_id": i} for i in range(3)]
+        question = "如何在 Python 中合并两个字典？"
+
+        system, user = _build_llm_messages(prompt, question, history, recs)
+        self.assertLessEqual(count_tokens(system.content) + count_tokens(user.content), 300 + 2)
+        self.assertTrue(user.content.endswith("问题：" + question))
+        self.assertIn("[候选1]", user.content)
+        self.assertIn("历史消息", user.content)
+        self.assertEqual(user.content, _build_llm_messages(prompt, question, history, recs)[1].content)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def _fail(self, breaker):
+        with self.assertRaises(RuntimeError):
+            with breaker.guard():
+                raise RuntimeError("upstream down")
+
+    def test_opens_on_failure_rate_and_recovers_after_probe(self):
+        breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=0.05)
+        with breaker.guard():
+            pass
+        with breaker.guard():
+            pass
+        self._fail(breaker)
+        self.assertEqual(breaker.state, "closed")
+        self._fail(breaker)
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.check()
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, "half_open")
+        self._fail(breaker)
+        self.assertEqual(breaker.state, "open")
+
+        time.sleep(0.06)
+        with breaker.guard():
+            with self.assertRaises(CircuitOpenError):
+                breaker.allow()
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.stats()["opened"], 2)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker(window=2, min_calls=2, failure_rate=1.0, slow_call_seconds=0.0)
+        for _ in range(2):
+            with breaker.guard():
+                pass
+        self.assertEqual(breaker.state, "open")
+
+
+    def _stream(self, breaker, scheduler, upstream):
+        patch("django_qa.utils.llm._circuit_breaker", return_value=breaker).start()
+        patch("django_qa.utils.llm._scheduler", return_value=scheduler).start()
+        patch("django_qa.utils.llm._chat_stream_uncached", side_effect=lambda *a: upstream()).start()
+        self.addCleanup(patch.stopall)
+        return chat_stream([LLMMessage(role="user", content="q")], user_key="u")
+
+    def test_stream_is_judged_by_first_token_not_client_consumption(self):
+        breaker = CircuitBreaker(window=1, min_calls=1, failure_rate=1.0, slow_call_seconds=0.05)
+        scheduler = FairScheduler(max_concurrency=1, max_wait=1)
+
+        def fast():
+            yield from ["a", "b", "c"]
+
+        stream = self._stream(breaker, scheduler, fast)
+        self.assertEqual(next(stream), "a")
+        # 上游读完就归还名额，客户端还没消费完
+        deadline = time.monotonic() + 2
+        while scheduler.stats()["active"] and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(scheduler.stats()["active"], 0)
+        time.sleep(0.1)
+        self.assertEqual(list(stream), ["b", "c"])
+        self.assertEqual(breaker.stats()["window_failure_rate"], 0.0)
+        self.assertEqual(breaker.state, "closed")
+
+        def slow_first_token():
+            time.sleep(0.1)
+            yield "late"
+
+        self.assertEqual(list(self._stream(breaker, scheduler, slow_first_token)), ["late"])
+        self.assertEqual(breaker.state, "open")
+
+
+class FairSchedulerTests(SimpleTestCase):
+    def _enqueue(self, scheduler, user_key, order):
+        def worker():
+            with scheduler.slot(user_key):
+                order.append(user_key)
+
+        before = scheduler.stats()["queued"]
+        t = threading.Thread(target=worker)
+        t.start()
+        while scheduler.stats()["queued"] == before:
+            time.sleep(0.005)
+        return t
+
+    def test_round_robin_between_users(self):
+        scheduler = FairScheduler(max_concurrency=1, max_wait=5)
+        order = []
+        scheduler.acquire("holder")
+        threads = [self._enqueue(scheduler, u, order) for u in ("a", "a", "a", "b")]
+        self.assertEqual(scheduler.stats()["queued_users"], 2)
+        scheduler.release()
+        for t in threads:
+            t.join()
+        self.assertEqual(order, ["a", "b", "a", "a"])
+        stats = scheduler.stats()
+        self.assertEqual((stats["active"], stats["queued"], stats["served"]), (0, 0, 5))
+
+    def test_timeout_and_per_user_limit(self):
+        scheduler = FairScheduler(max_concurrency=1, max_wait=0.1, max_queue_per_user=1)
+        scheduler.acquire("holder")
+        with self.assertRaises(LLMQueueTimeout) as ctx:
+            scheduler.acquire("a")
+        self.assertEqual(ctx.exception.reason, "timeout")
+        self.assertGreaterEqual(ctx.exception.waited_ms, 100)
+
+        blocked = threading.Thread(target=lambda: self.assertRaises(LLMQueueTimeout, scheduler.acquire, "b"))
+        blocked.start()
+        while scheduler.stats()["queued"] == 0:
+            time.sleep(0.005)
+        with self.assertRaises(LLMQueueTimeout) as ctx:
+            scheduler.acquire("b")
+        self.assertEqual(ctx.exception.reason, "user_queue_full")
+        blocked.join()
+        scheduler.release()
+        stats = scheduler.stats()
+        self.assertEqual((stats["timed_out"], stats["rejected"], stats["queued"]), (2, 1, 0))
+
+    def test_async_waiters_are_woken_by_release_without_threads(self):
+        scheduler = FairScheduler(max_concurrency=1, max_wait=0.2)
+
+        async def main():
+            scheduler.acquire("holder")
+            with self.assertRaises(LLMQueueTimeout):
+                await scheduler.aacquire("a")
+
+            threads = threading.active_count()
+            waiter = asyncio.ensure_future(scheduler.aacquire("a"))
+            await asyncio.sleep(0.02)
+            self.assertFalse(waiter.done())
+            self.assertEqual(threading.active_count(), threads)
+            threading.Timer(0.02, scheduler.release).start()
+            await waiter
+            scheduler.release()
+
+            scheduler.acquire("holder")
+            cancelled = asyncio.ensure_future(scheduler.aacquire("b"))
+            await asyncio.sleep(0.02)
+            cancelled.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await cancelled
+            scheduler.release()
+            async with scheduler.aslot("b"):
+                self.assertEqual(scheduler.stats()["active"], 1)
+
+        asyncio.run(main())
+        stats = scheduler.stats()
+        self.assertEqual((stats["active"], stats["queued"], stats["served"], stats["timed_out"]), (0, 0, 4, 1))
+
+
+class StreamingCodeAnalyzerTests(SimpleTestCase):
+    def test_blocks_are_scored_as_fences_close(self):
+        text = "先看实现：\n```python\ndef add(a, b):\n    return a + b\n```\n然后调用：\n```python\nprint(add(1, 2))\n```\n"
+        analyzer = StreamingCodeAnalyzer()
+        cut = text.index("```\n然后") + 3
+        for i in range(0, cut, 7):
+            analyzer.feed(text[i : min(i + 7, cut)])
+        self.assertEqual(analyzer.submitted_blocks, 1)
+        analyzer.feed(text[cut:])
+        self.assertEqual(analyzer.submitted_blocks, 2)
+        self.assertEqual(analyzer.finish(), analyze_code_comprehensive(text))
+
+    def test_feed_keeps_only_the_open_fence(self):
+        body = "".join(f"x{i} = {i}\n" for i in range(200))
+        text = "说明" * 500 + "\n```python\n" + body + "```\n收尾\n```\nprint(1)\n```\n"
+        analyzer = StreamingCodeAnalyzer()
+        for ch in text[: text.index("```")]:
+            analyzer.feed(ch)
+            self.assertLessEqual(len(analyzer._pending), 2)
+        opened = text.index("```")
+        for i in range(opened, len(text)):
+            analyzer.feed(text[i])
+            if analyzer._open:
+                # 只保留从未闭合的 ``` 开始的文本，已确认没有闭合符的部分不再重扫
+                self.assertTrue(analyzer._pending.startswith("```"))
+                self.assertGreaterEqual(analyzer._scan_from, len(analyzer._pending) - 2)
+        self.assertEqual(analyzer.submitted_blocks, 2)
+        self.assertEqual(analyzer.finish(), analyze_code_comprehensive(text))
+
+
+@skipUnless(sandbox_supported(), "sandbox requires Linux namespaces and seccomp")
+class SandboxPoolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pool = SandboxPool(size=1, timeout=1.0, memory_mb=256)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        super().tearDownClass()
+
+    def test_run_statuses(self):
+        self.assertEqual(self.pool.run("print(sum(range(10)))").status, "ok")
+        self.assertEqual(self.pool.run("1 / 0").status, "error")
+        self.assertEqual(self.pool.run("while True:\n    pass").status, "timeout")
+        self.assertEqual(self.pool.run("import socket\nsocket.socket()").status, "blocked")
+        self.assertEqual(self.pool.run("open('x.txt', 'w')").status, "blocked")
+        self.assertEqual(self.pool.run("import not_a_real_module").status, "skipped")
+
+    def test_isolation_does_not_rely_on_audit_hook(self):
+        settings_path = Path(__file__).resolve().parent.parent / "django_main" / "settings.py"
+        self.assertEqual(self.pool.run(f"open({str(settings_path)!r}).read()").status, "error")
+        self.assertEqual(self.pool.run("import os\nassert os.getuid() != 0").status, "ok")
+        self.assertNotEqual(self.pool.run("import threading\nthreading.Thread(target=print).start()").status, "ok")
+
+        marker = Path(tempfile.gettempdir()) / f"qa-sandbox-escape-{os.getpid()}"
+        # _posixsubprocess 不经过审计钩子，只有 seccomp 能拦住
+        code = (
+            "import os, _posixsubprocess\n"
+            "r, w = os.pipe()\n"
+            f"_posixsubprocess.fork_exec([b'/bin/sh', b'-c', b'touch {marker}'], [b'/bin/sh'], True, (), None, None,"
+            " -1, -1, -1, -1, -1, -1, r, w, False, False, -1, None, None, -1, -1, None, False)\n"
+            "os.close(w)\n"
+            "os.read(r, 1)\n"
+        )
+        self.assertEqual(self.pool.run(code).status, "blocked")
+        time.sleep(0.1)
+        self.assertFalse(marker.exists())
+
+    def test_execution_affects_logic_score(self):
+        ok = analyze_code_comprehensive("```python\nx = 1\n```", sandbox=self.pool)
+        bad = analyze_code_comprehensive("```python\nx = 1 / 0\n```", sandbox=self.pool)
+        self.assertEqual((ok["exec_passed"], ok["exec_total"]), (1, 1))
+        self.assertEqual((bad["exec_passed"], bad["exec_total"]), (0, 1))
+        self.assertGreater(ok["logic_score"], bad["logic_score"])
+
+
+class SandboxRefusalTests(SimpleTestCase):
+    @override_settings(QA_SANDBOX_ENABLED=True)
+    def test_enabled_without_isolation_is_refused(self):
+        with patch("django_qa.utils.sandbox.sandbox_supported", return_value=False):
+            with self.assertRaises(ImproperlyConfigured):
+                get_default_sandbox()
+            errors = check_sandbox_isolation(None)
+        self.assertEqual([e.id for e in errors], ["django_qa.E001"])
+
+    @override_settings(QA_SANDBOX_ENABLED=False)
+    def test_disabled_sandbox_is_none(self):
+        self.assertIsNone(get_default_sandbox())
+        self.assertEqual(check_sandbox_isolation(None), [])
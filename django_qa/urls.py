@@ -2,12 +2,20 @@ from django.urls import path
 
 from django_qa.views import (
     AdminAnswerMetricsView,
+    AdminLLMCacheStatsView,
+    AdminLLMRoutingStatsView,
+    AdminLLMSchedulerStatsView,
     AdminPromptDetailView,
     AdminPromptListCreateView,
+    AsyncMessageListCreateView,
+    AsyncQAView,
+    BatchQAView,
     DatasetPairDetailView,
     DatasetPairsView,
     DatasetSummaryView,
+    MessageEvaluationView,
     MessageListCreateView,
+    MessageStreamView,
     QAView,
     ThreadDeleteView,
     ThreadListCreateView,
@@ -15,13 +23,21 @@ from django_qa.views import (
 
 urlpatterns = [
     path("qa/", QAView.as_view()),
+    path("batch/", BatchQAView.as_view()),
     path("threads/", ThreadListCreateView.as_view()),
     path("threads/<int:thread_id>/", ThreadDeleteView.as_view()),
     path("threads/<int:thread_id>/messages/", MessageListCreateView.as_view()),
+    path("threads/<int:thread_id>/messages/stream/", MessageStreamView.as_view()),
+    path("messages/<int:message_id>/evaluation/", MessageEvaluationView.as_view()),
     path("dataset/summary/", DatasetSummaryView.as_view()),
     path("dataset/pairs/", DatasetPairsView.as_view()),
     path("dataset/pairs/<int:pair_id>/", DatasetPairDetailView.as_view()),
+    path("async/qa/", AsyncQAView.as_view()),
+    path("async/threads/<int:thread_id>/messages/", AsyncMessageListCreateView.as_view()),
     path("admin/prompts/", AdminPromptListCreateView.as_view()),
     path("admin/prompts/<int:prompt_id>/", AdminPromptDetailView.as_view()),
     path("admin/answer-metrics/", AdminAnswerMetricsView.as_view()),
+    path("admin/llm-cache/", AdminLLMCacheStatsView.as_view()),
+    path("admin/llm-scheduler/", AdminLLMSchedulerStatsView.as_view()),
+    path("admin/llm-routing/", AdminLLMRoutingStatsView.as_view()),
 ]
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断打开期间直接拒绝调用，调用方应快速失败或走降级逻辑。"""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"LLM 熔断中，约 {retry_after:.0f}s 后重试")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """按最近 N 次调用的失败率（慢调用也算失败）熔断上游。
+
+    closed：正常放行并统计；失败率达到阈值后 open：直接抛 CircuitOpenError；
+    open 持续 open_seconds 后进入 half_open：只放行少量探测请求，成功则恢复 closed，失败则重新 open。
+    """
+
+    def __init__(
+        self,
+        *,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 30.0,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._outcomes: deque[bool] = deque(maxlen=max(1, int(window)))
+        self._min_calls = max(1, int(min_calls))
+        self._failure_rate = float(failure_rate)
+        self._slow_call_seconds = float(slow_call_seconds)
+        self._open_seconds = float(open_seconds)
+        self._half_open_max_calls = max(1, int(half_open_max_calls))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._rejected = 0
+        self._opened_count = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._opened_count += 1
+        self._outcomes.clear()
+
+    def allow(self) -> None:
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == OPEN:
+                self._rejected += 1
+                raise CircuitOpenError(max(0.0, self._open_seconds - (time.monotonic() - self._opened_at)))
+            if self._state == HALF_OPEN:
+                if self._probes >= self._half_open_max_calls:
+                    self._rejected += 1
+                    raise CircuitOpenError(self._open_seconds)
+                self._probes += 1
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        ok = ok and elapsed < self._slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if ok:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            if self._state == OPEN:
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self._min_calls and failures / len(self._outcomes) >= self._failure_rate:
+                self._open()
+
+    def check(self) -> None:
+        """不占用半开探测名额的预检：熔断打开时在排队之前就快速失败。"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == OPEN:
+                self._rejected += 1
+                raise CircuitOpenError(max(0.0, self._open_seconds - (time.monotonic() - self._opened_at)))
+
+    def release(self) -> None:
+        """调用被取消或因本地原因失败时不计入统计，但要归还半开探测名额。"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        self.allow()
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record(time.perf_counter() - t0, ok=False)
+            raise
+        except BaseException:
+            # GeneratorExit / CancelledError：客户端断开，不代表上游故障
+            self.release()
+            raise
+        self.record(time.perf_counter() - t0, ok=True)
+
+    def stats(self) -> dict[str, Any]:
+        state = self.state
+        with self._lock:
+            total = len(self._outcomes)
+            failures = self._outcomes.count(False)
+            return {
+                "state": state,
+                "window_calls": total,
+                "window_failure_rate": (failures / total) if total else 0.0,
+                "opened": self._opened_count,
+                "rejected": self._rejected,
+            }
@@ -1,50 +1,37 @@
 from __future__ import annotations
 
 import ast
-import html
 import re
 import tempfile
 import subprocess
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable
+
+from django_qa.utils.code_blocks import PYTHON_LANGS, dedupe_codes, extract_code_blocks
+
+if TYPE_CHECKING:
+    from django_qa.utils.sandbox import SandboxPool
+
+_FENCE = "```"
+_CLOSED_FENCE_RE = re.compile(r"```(?:([\w+#.-]+)?[ \t]*\n)?([\s\S]*?)```")
+_STREAM_EXECUTOR: ThreadPoolExecutor | None = None
+_STREAM_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_stream_executor() -> ThreadPoolExecutor:
+    global _STREAM_EXECUTOR
+    if _STREAM_EXECUTOR is not None:
+        return _STREAM_EXECUTOR
+    with _STREAM_EXECUTOR_LOCK:
+        if _STREAM_EXECUTOR is None:
+            _STREAM_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="qa-stream-analysis")
+        return _STREAM_EXECUTOR
+
 
 def _extract_code_blocks(text: str) -> list[str]:
-    if not text:
-        return []
-    out: list[str] = []
-
-    fenced = re.findall(r"```(?:python|py)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
-    out.extend([b.strip() for b in fenced if b and b.strip()])
-
-    html_blocks = re.findall(r"<pre><code>([\s\S]*?)</code></pre>", text, flags=re.IGNORECASE)
-    for b in html_blocks:
-        s = html.unescape(b or "")
-        s = re.sub(r"<[^>]+>", "", s)
-        s = s.replace("\r\n", "\n").replace("\r", "\n").strip()
-        if s:
-            out.append(s)
-
-    lines = (text or "").replace("\r\n", "\n").replace("\r", "\n").splitlines()
-    buf: list[str] = []
-    for line in lines + [""]:
-        is_code = line.startswith("    ") or line.startswith("\t")
-        if is_code:
-            buf.append(line[4:] if line.startswith("    ") else line[1:])
-            continue
-        if buf:
-            block = "\n".join(buf).strip()
-            if block:
-                out.append(block)
-            buf = []
-
-    deduped: list[str] = []
-    seen: set[str] = set()
-    for b in out:
-        key = b.strip()
-        if not key or key in seen:
-            continue
-        seen.add(key)
-        deduped.append(b)
-    return deduped
+    return dedupe_codes([b.code.strip() for b in extract_code_blocks(text) if b.is_python])
 
 def _run_pylint(code: str) -> float:
     """运行Pylint分析代码质量，返回0-10分的评分"""
@@ -87,49 +74,61 @@ def _run_pylint(code: str) -> float:
             except:
                 pass
 
-def analyze_code_comprehensive(text: str) -> dict:
-    code_blocks = _extract_code_blocks(text)
-    
+def _score_block(code: str, sandbox: SandboxPool | None = None) -> dict:
+    """对单个代码块计算各维度的原始指标，供整体评分聚合使用"""
+    try:
+        ast.parse(code)
+        parsed = True
+    except Exception:
+        parsed = False
+
+    utility = 0.0
+    # 检测函数定义
+    if re.search(r'def\s+\w+\s*\(', code):
+        utility += 2.0
+    # 检测类定义
+    if re.search(r'class\s+\w+', code):
+        utility += 2.0
+    # 检测导入语句
+    if re.search(r'import\s+|from\s+\w+\s+import', code):
+        utility += 1.0
+    # 检测异常处理
+    if re.search(r'try:\s*|except\s+', code):
+        utility += 1.0
+
+    # 可执行性（可选：在沙箱中实际运行语法正确的代码块，跳过依赖缺失/需要输入的代码）
+    exec_status = None
+    if sandbox is not None and parsed:
+        result = sandbox.run(code)
+        if result.conclusive:
+            exec_status = result.status
+
+    return {"parsed": parsed, "pylint": _run_pylint(code), "utility": utility, "exec": exec_status}
+
+
+def _aggregate_scores(block_scores: list[dict]) -> dict:
     # 1. 语法正确性（AST解析）
     syntax_score = 10.0
-    if code_blocks:
-        ok = 0
-        for b in code_blocks:
-            try:
-                ast.parse(b)
-                ok += 1
-            except Exception:
-                pass
-        syntax_score = 10.0 * (ok / len(code_blocks)) if code_blocks else 10.0
+    if block_scores:
+        syntax_score = 10.0 * (sum(1 for b in block_scores if b["parsed"]) / len(block_scores))
     
     # 2. 易读性（Pylint评分）
     readability_score = 4.0
-    if code_blocks:
-        pylint_scores = []
-        for b in code_blocks:
-            pylint_scores.append(_run_pylint(b))
-        readability_score = sum(pylint_scores) / len(pylint_scores) if pylint_scores else 4.0
+    if block_scores:
+        readability_score = sum(b["pylint"] for b in block_scores) / len(block_scores)
     
-    # 3. 逻辑完整性（基于易读性变换）
+    # 3. 逻辑完整性（基于易读性变换，启用沙箱时融合实际执行通过率）
     logic_score = min(10.0, readability_score * 0.9 + 1.0)
+    exec_results = [b["exec"] for b in block_scores if b["exec"] is not None]
+    exec_total = len(exec_results)
+    exec_passed = sum(1 for r in exec_results if r == "ok")
+    if exec_total:
+        logic_score = logic_score * 0.5 + 10.0 * (exec_passed / exec_total) * 0.5
     
     # 4. 通用性（启发式规则）
     utility_score = 4.0
-    if code_blocks:
-        for b in code_blocks:
-            # 检测函数定义
-            if re.search(r'def\s+\w+\s*\(', b):
-                utility_score += 2.0
-            # 检测类定义
-            if re.search(r'class\s+\w+', b):
-                utility_score += 2.0
-            # 检测导入语句
-            if re.search(r'import\s+|from\s+\w+\s+import', b):
-                utility_score += 1.0
-            # 检测异常处理
-            if re.search(r'try:\s*|except\s+', b):
-                utility_score += 1.0
-        utility_score = min(10.0, utility_score)
+    if block_scores:
+        utility_score = min(10.0, utility_score + sum(b["utility"] for b in block_scores))
     
     # 加权融合计算综合评分
     total_score = (
@@ -140,15 +139,16 @@ def analyze_code_comprehensive(text: str) -> dict:
     )
     total_score = min(10.0, max(0.0, total_score))
     
-    report = " | ".join(
-        [
-            f"syntax={syntax_score:.1f}",
-            f"logic={logic_score:.1f}",
-            f"utility={utility_score:.1f}",
-            f"readability={readability_score:.1f}",
-            f"total={total_score:.1f}"
-        ]
-    )
+    report_parts = [
+        f"syntax={syntax_score:.1f}",
+        f"logic={logic_score:.1f}",
+        f"utility={utility_score:.1f}",
+        f"readability={readability_score:.1f}",
+        f"total={total_score:.1f}"
+    ]
+    if exec_total:
+        report_parts.append(f"exec={exec_passed}/{exec_total}")
+    report = " | ".join(report_parts)
 
     return {
         "syntax_score": syntax_score,
@@ -157,4 +157,79 @@ def analyze_code_comprehensive(text: str) -> dict:
         "readability_score": readability_score,
         "total_score": total_score,
         "report": report,
+        "exec_passed": exec_passed,
+        "exec_total": exec_total,
     }
+
+
+def analyze_code_comprehensive(text: str, *, sandbox: SandboxPool | None = None) -> dict:
+    return _aggregate_scores([_score_block(b, sandbox) for b in _extract_code_blocks(text)])
+
+
+class StreamingCodeAnalyzer:
+    """边接收模型输出边分析：每当一个 ``` 代码块闭合就立即提交评分，finish() 时只补算剩余代码块。
+
+    finish() 的结果与对完整文本调用 analyze_code_comprehensive 一致。
+    """
+
+    def __init__(self, *, sandbox: SandboxPool | None = None, executor: ThreadPoolExecutor | None = None) -> None:
+        self._sandbox = sandbox
+        self._executor = executor or _get_stream_executor()
+        self._chunks: list[str] = []
+        # 没有未闭合的 ``` 时只留末尾两个字符（可能是被切开的半个 ```）；有时从那个开头 ``` 起保留，
+        # _scan_from 之前已确认没有闭合的 ```，下个 chunk 只从那里往后找
+        self._pending = ""
+        self._open = False
+        self._scan_from = 0
+        self._futures: dict[str, Future] = {}
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    @property
+    def submitted_blocks(self) -> int:
+        return len(self._futures)
+
+    def _submit(self, code: str) -> Future:
+        fut = self._futures.get(code)
+        if fut is None:
+            fut = self._executor.submit(_score_block, code, self._sandbox)
+            self._futures[code] = fut
+        return fut
+
+    def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        self._pending += chunk
+        while True:
+            if not self._open:
+                start = self._pending.find(_FENCE)
+                if start < 0:
+                    self._pending = self._pending[-(len(_FENCE) - 1) :]
+                    return
+                self._pending = self._pending[start:]
+                self._open = True
+                self._scan_from = len(_FENCE)
+            end = self._pending.find(_FENCE, self._scan_from)
+            if end < 0:
+                self._scan_from = max(len(_FENCE), len(self._pending) - len(_FENCE) + 1)
+                return
+            m = _CLOSED_FENCE_RE.match(self._pending, 0, end + len(_FENCE))
+            code = ""
+            if m and (m.group(1) or "").lower() in PYTHON_LANGS:
+                code = (m.group(2) or "").replace("\r\n", "\n").strip()
+            if code:
+                self._submit(code)
+            self._pending = self._pending[end + len(_FENCE) :]
+            self._open = False
+
+    def feed_all(self, chunks: Iterable[str]) -> str:
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.text
+
+    def finish(self) -> dict:
+        futures = [self._submit(b) for b in _extract_code_blocks(self.text)]
+        return _aggregate_scores([f.result() for f in futures])
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# 本模块不依赖 Django，data/ 下的清洗脚本也会直接导入使用。
+
+_BLOCK_RE = re.compile(
+    r"```(?:(?P<lang>[\w+#.-]+)?[ \t]*\n)?(?P<fenced>[\s\S]*?)```"
+    r"|<pre[^>]*>\s*<code[^>]*>(?P<html>[\s\S]*?)</code>\s*</pre>"
+    r"|(?P<indented>(?:^(?: {4}|\t)[^\n]*(?:\n|\Z))+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_INDENT_RE = re.compile(r"^(?: {4}|\t)", re.MULTILINE)
+# 不带语言标注的 fenced 块按 Python 处理；标了别的语言（js、bash、text ...）的不交给 Python 评分
+PYTHON_LANGS = frozenset({"", "python", "py", "python3", "py3"})
+
+
+@dataclass(frozen=True)
+class CodeBlock:
+    kind: str
+    code: str
+    lang: str = ""
+
+    @property
+    def line_count(self) -> int:
+        return self.code.count("\n") + 1 if self.code else 0
+
+    @property
+    def is_python(self) -> bool:
+        return self.kind != "fenced" or self.lang in PYTHON_LANGS
+
+
+_CACHE_MAX_ENTRIES = 2048
+_CACHE: OrderedDict[bytes, tuple[CodeBlock, ...]] = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _scan(text: str) -> tuple[CodeBlock, ...]:
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    out: list[CodeBlock] = []
+    for m in _BLOCK_RE.finditer(text):
+        if m.group("fenced") is not None:
+            kind, code = "fenced", m.group("fenced")
+        elif m.group("html") is not None:
+            kind, code = "html", html.unescape(_HTML_TAG_RE.sub("", m.group("html")))
+        else:
+            kind, code = "indented", _INDENT_RE.sub("", m.group("indented"))
+        code = code.strip("\n").rstrip()
+        if code.strip():
+            out.append(CodeBlock(kind=kind, code=code, lang=(m.group("lang") or "").lower()))
+    return tuple(out)
+
+
+def extract_code_blocks(text: str) -> tuple[CodeBlock, ...]:
+    """单次线性扫描提取 fenced / <pre><code> / 缩进 三类代码块，按文本哈希缓存结果。
+
+    fenced 块内部的缩进行属于该块本身，不再另算一个缩进块；<pre><code> 先去掉标签再反转义 HTML 实体。
+    """
+    if not text:
+        return ()
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+        if cached is not None:
+            _CACHE.move_to_end(key)
+            return cached
+    blocks = _scan(text)
+    with _CACHE_LOCK:
+        _CACHE[key] = blocks
+        if len(_CACHE) > _CACHE_MAX_ENTRIES:
+            _CACHE.popitem(last=False)
+    return blocks
+
+
+def dedupe_codes(codes: list[str]) -> list[str]:
+    out: list[str] = []
+    seen: set[str] = set()
+    for c in codes:
+        key = c.strip()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        out.append(c)
+    return out
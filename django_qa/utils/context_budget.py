@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import math
+import re
+import threading
+from typing import Any
+
+try:
+    import tiktoken
+except Exception:  # pragma: no cover
+    tiktoken = None  # type: ignore[assignment]
+
+
+# 没有 tiktoken 时的近似分词：中日韩字符各算 1 个 token，英文单词约 4 个字母 1 个 token，数字约 3 位 1 个 token，
+# 标点各算 1 个，空白不计。结果只用于分配预算，要求确定、单调，不要求与模型分词完全一致。
+_PIECE_RE = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]|[A-Za-z]+|\d+|\s+|[^\sA-Za-z\d]"
+)
+
+_ENCODING: Any | None = None
+_ENCODING_LOADED = False
+_ENCODING_LOCK = threading.Lock()
+
+
+def _encoding() -> Any | None:
+    global _ENCODING, _ENCODING_LOADED
+    if _ENCODING_LOADED:
+        return _ENCODING
+    with _ENCODING_LOCK:
+        if not _ENCODING_LOADED:
+            if tiktoken is not None:
+                try:
+                    _ENCODING = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _ENCODING = None
+            _ENCODING_LOADED = True
+        return _ENCODING
+
+
+def _piece_cost(piece: str) -> int:
+    if piece.isspace():
+        return 0
+    if piece.isascii() and piece.isalpha():
+        return math.ceil(len(piece) / 4)
+    if piece.isdigit():
+        return math.ceil(len(piece) / 3)
+    return 1
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return sum(_piece_cost(m.group(0)) for m in _PIECE_RE.finditer(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, *, keep: str = "head") -> str:
+    """截断到不超过 max_tokens；keep="tail" 时保留末尾（用于对话历史中最早那条消息）。"""
+    if not text or max_tokens <= 0:
+        return ""
+    enc = _encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        return enc.decode(ids[-max_tokens:] if keep == "tail" else ids[:max_tokens]).strip()
+
+    pieces = [m.group(0) for m in _PIECE_RE.finditer(text)]
+    if keep == "tail":
+        pieces.reverse()
+    used = 0
+    kept: list[str] = []
+    for piece in pieces:
+        cost = _piece_cost(piece)
+        if used + cost > max_tokens:
+            break
+        used += cost
+        kept.append(piece)
+    if len(kept) == len(pieces):
+        return text
+    if keep == "tail":
+        kept.reverse()
+    return "".join(kept).strip()
+
+
+def allocate(available: int, *, history_need: int, retrieval_need: int, retrieval_share: float) -> tuple[int, int]:
+    """把剩余预算分给对话历史与检索结果：各自先拿自己的份额，一方用不完的部分让给另一方。"""
+    available = max(0, int(available))
+    retrieval_floor = int(available * max(0.0, min(1.0, retrieval_share)))
+    retrieval = min(retrieval_need, max(retrieval_floor, available - history_need))
+    history = min(history_need, available - retrieval)
+    return history, retrieval
+
+
+def pack_latest(parts: list[str], max_tokens: int, *, separator: str = "\n\n") -> str:
+    """从最新的一段往前装，装不下的最早一段保留末尾，其余更早的丢弃。"""
+    sep_cost = count_tokens(separator)
+    kept: list[str] = []
+    used = 0
+    for part in reversed(parts):
+        cost = count_tokens(part) + (sep_cost if kept else 0)
+        if used + cost <= max_tokens:
+            kept.append(part)
+            used += cost
+            continue
+        rest = max_tokens - used - (sep_cost if kept else 0)
+        tail = truncate_tokens(part, rest, keep="tail")
+        if tail:
+            kept.append(tail)
+        break
+    kept.reverse()
+    return separator.join(kept).strip()
+
+
+def pack_in_order(parts: list[str], max_tokens: int, *, separator: str = "\n\n") -> str:
+    """按给定顺序（相关性从高到低）装入，装不下的那一段保留开头，其后的丢弃。"""
+    sep_cost = count_tokens(separator)
+    kept: list[str] = []
+    used = 0
+    for part in parts:
+        cost = count_tokens(part) + (sep_cost if kept else 0)
+        if used + cost <= max_tokens:
+            kept.append(part)
+            used += cost
+            continue
+        rest = max_tokens - used - (sep_cost if kept else 0)
+        head = truncate_tokens(part, rest, keep="head")
+        if head:
+            kept.append(head)
+        break
+    return separator.join(kept).strip()
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from django_qa.models import AnswerEvaluation, ConversationMessage
+from django_qa.utils.code_analysis import analyze_code_comprehensive
+from django_qa.utils.sandbox import get_default_sandbox
+
+
+_EXECUTOR: ThreadPoolExecutor | None = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        return _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            workers = max(1, int(getattr(settings, "QA_EVALUATION_WORKERS", 2) or 2))
+            _EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qa-eval")
+        return _EXECUTOR
+
+
+def evaluation_fields(analysis: dict) -> dict:
+    return {
+        "syntax_score": analysis["syntax_score"],
+        "logic_score": analysis["logic_score"],
+        "utility_score": analysis["utility_score"],
+        "readability_score": analysis["readability_score"],
+        "total_score": analysis["total_score"],
+        "analysis_report": analysis["report"],
+    }
+
+
+def run_evaluation(evaluation_id: int) -> None:
+    row = AnswerEvaluation.objects.select_related("message").filter(id=evaluation_id).first()
+    if row is None:
+        return
+    try:
+        analysis = analyze_code_comprehensive(row.message.content or "", sandbox=get_default_sandbox())
+    except Exception as e:
+        row.status = "failed"
+        row.error_msg = f"{type(e).__name__}: {e}"
+        row.save(update_fields=["status", "error_msg", "updated_at"])
+        return
+    for k, v in evaluation_fields(analysis).items():
+        setattr(row, k, v)
+    row.status = "done"
+    row.error_msg = ""
+    row.save()
+
+
+def _run_in_worker(evaluation_id: int) -> None:
+    close_old_connections()
+    try:
+        run_evaluation(evaluation_id)
+    finally:
+        close_old_connections()
+
+
+def enqueue_evaluation(message: ConversationMessage) -> AnswerEvaluation:
+    """为助手消息创建 pending 状态的评估记录，并在事务提交后交给后台线程池计算。"""
+    row = AnswerEvaluation.objects.create(message=message, status="pending")
+    if not getattr(settings, "QA_EVALUATION_ASYNC", True):
+        run_evaluation(row.id)
+        row.refresh_from_db()
+        return row
+    evaluation_id = row.id
+    transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, evaluation_id))
+    return row
+
+
+def clone_evaluation(source: AnswerEvaluation | None, message: ConversationMessage) -> AnswerEvaluation:
+    """复用同一回答已完成的评估；来源评估不存在或尚未完成时照常排队计算。"""
+    if source is None or source.status != "done":
+        return enqueue_evaluation(message)
+    # 按 Django 复制实例的方式整行复制，不再单独维护一份评分字段清单
+    row = copy.copy(source)
+    row.pk = None
+    row._state.adding = True
+    row.message = message
+    row.save()
+    return row
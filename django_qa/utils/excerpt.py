@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import re
+
+QUESTION_EXCERPT_CHARS = 240
+ANSWER_EXCERPT_CHARS = 360
+
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def html_excerpt(text: str, max_chars: int) -> str:
+    s = (text or "").strip()
+    s = _HTML_TAG_RE.sub(" ", s)
+    s = _SPACE_RE.sub(" ", s).strip()
+    if len(s) <= max_chars:
+        return s
+    return s[: max_chars - 1].rstrip() + "…"
+
+
+def fill_pair_excerpts(pair) -> None:
+    """列表页用的摘要在写入时算好存进列，列表查询就不必再读取整段正文。"""
+    pair.question_excerpt = html_excerpt(pair.question_body, QUESTION_EXCERPT_CHARS)
+    pair.answer_excerpt = html_excerpt(pair.answer_body, ANSWER_EXCERPT_CHARS)
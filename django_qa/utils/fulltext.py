@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import re
+import threading
+
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+
+from django_qa.models import ProgrammingQAPair
+
+# 与迁移 0006/0009 中的名字保持一致
+FTS_TABLE = "django_qa_programmingqapair_fts"
+MYSQL_INDEX = "qa_pair_fulltext"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_MAX_TOKENS = 8
+# InnoDB 全文索引不收录短于 innodb_ft_min_token_size（默认 3）的词和默认停用词；
+# 这些词带着 + 出现在 BOOLEAN MODE 里会让整个 MATCH 一行都匹配不到
+_MYSQL_MIN_TOKEN = 3
+_MYSQL_STOPWORDS = frozenset(
+    "a about an are as at be by com de en for from how i in is it la of on or that the this to was what when where who will with und www".split()
+)
+
+_AVAILABLE: dict[str, bool] = {}
+_AVAILABLE_LOCK = threading.Lock()
+
+
+def fulltext_backend(alias: str = "default") -> str | None:
+    """当前数据库可用的全文索引类型："sqlite_fts5"、"mysql_fulltext"，都没有时返回 None。"""
+    connection = connections[alias]
+    vendor = connection.vendor
+    key = f"{alias}:{vendor}:{connection.settings_dict.get('NAME')}"
+    if key not in _AVAILABLE:
+        with _AVAILABLE_LOCK:
+            if key not in _AVAILABLE:
+                _AVAILABLE[key] = _probe(connection)
+    if not _AVAILABLE[key]:
+        return None
+    return {"sqlite": "sqlite_fts5", "mysql": "mysql_fulltext"}.get(vendor)
+
+
+def _probe(connection) -> bool:
+    table = ProgrammingQAPair._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            return cursor.fetchone() is not None
+        if connection.vendor == "mysql":
+            cursor.execute(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+                [table, MYSQL_INDEX],
+            )
+            return cursor.fetchone() is not None
+    return False
+
+
+def _tokens(q: str) -> list[str]:
+    return _TOKEN_RE.findall((q or "").lower())[:_MAX_TOKENS]
+
+
+def _sqlite_match(tokens: list[str]) -> str:
+    # 每个词都加引号，避免 AND/OR/NEAR 等被当成语法；末尾 * 做前缀匹配，接近原来 icontains 的手感
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def _mysql_match(tokens: list[str]) -> str:
+    """只对索引里可能存在的词加 + 和前缀通配；全部被过滤掉时返回空串，由调用方回退到 icontains。"""
+    kept = [t for t in tokens if len(t) >= _MYSQL_MIN_TOKEN and t not in _MYSQL_STOPWORDS]
+    return " ".join(f"+{t}*" for t in kept)
+
+
+def search_pairs(qs: QuerySet, q: str) -> tuple[QuerySet, bool]:
+    """按关键词过滤问答对；有全文索引时附带 search_rank（越大越相关）并返回 True，否则回退到 icontains。"""
+    tokens = _tokens(q)
+    backend = fulltext_backend(qs.db) if tokens else None
+    table = ProgrammingQAPair._meta.db_table
+
+    if backend == "sqlite_fts5":
+        # 与 FTS 表按 rowid 直接连接一次：MATCH 驱动查询，bm25 在同一行上算出，排序 + LIMIT 不再逐行跑子查询。
+        # bm25 越小越相关，取负数让排序方向与 MySQL 一致；标题命中的权重最高
+        qs = qs.extra(
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+            params=[_sqlite_match(tokens)],
+        )
+        return qs.annotate(search_rank=RawSQL(f"-bm25({FTS_TABLE}, 10.0, 2.0, 1.0)", ())), True
+
+    match = _mysql_match(tokens) if backend == "mysql_fulltext" else ""
+    if match:
+        rank = RawSQL(
+            f"MATCH ({table}.title, {table}.question_body, {table}.answer_body) AGAINST (%s IN BOOLEAN MODE)",
+            (match,),
+        )
+        return qs.annotate(search_rank=rank).filter(search_rank__gt=0), True
+
+    return (
+        qs.filter(Q(title__icontains=q) | Q(question_body__icontains=q) | Q(answer_body__icontains=q)),
+        False,
+    )
@@ -1,13 +1,37 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
-from typing import Any
+from pathlib import Path
+from typing import Any, Iterator
 
 from django.conf import settings
-import httpx
-from openai import OpenAI
+from django.core.cache import InvalidCacheBackendError, caches
 
-_HTTP_CLIENT = httpx.Client(timeout=httpx.Timeout(60.0), trust_env=True)
+from django_qa.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from django_qa.utils.llm_router import get_router
+from django_qa.utils.llm_scheduler import FairScheduler, LLMQueueTimeout
+from django_qa.utils.singleflight import SingleFlight
+
+# 命中统计放在进程内存里：响应缓存会按容量淘汰条目，而且先读后写不是原子操作，计数放在里面会丢。
+# 多进程部署时每个进程各自统计，与排队、熔断的统计口径一致
+_CACHE_EVENTS: dict[str, Counter[str]] = {}
+_CACHE_EVENTS_LOCK = threading.Lock()
+
+_SINGLEFLIGHT: SingleFlight | None = None
+_SINGLEFLIGHT_LOCK = threading.Lock()
+
+_SCHEDULER: FairScheduler | None = None
+_SCHEDULER_LOCK = threading.Lock()
+
+_BREAKER: CircuitBreaker | None = None
+_BREAKER_LOCK = threading.Lock()
 
 
 @dataclass(frozen=True)
@@ -16,23 +40,322 @@ class LLMMessage:
     content: str
 
 
-def _qwen_client() -> tuple[OpenAI, str]:
-    api_key = getattr(settings, "QWEN_API_KEY", "") or ""
-    base_url = getattr(settings, "QWEN_API_BASE", "") or ""
-    model = getattr(settings, "QWEN_MODEL_NAME", "") or ""
-    client = OpenAI(api_key=api_key, base_url=base_url, http_client=_HTTP_CLIENT)
-    return client, model
+def _current_model_name() -> str:
+    return getattr(settings, "CURRENT_LLM_MODEL", "qwen") or "qwen"
+
+
+def _response_cache():
+    if not getattr(settings, "QA_LLM_CACHE_ENABLED", False):
+        return None
+    try:
+        return caches["llm"]
+    except InvalidCacheBackendError:
+        return caches["default"]
+
+
+def _cache_key(messages: list[LLMMessage], temperature: float, prompt_version: str) -> str:
+    model_name = _current_model_name()
+    try:
+        model_tag = get_router(model_name).cache_tag
+    except ValueError:
+        model_tag = model_name
+    raw = json.dumps(
+        {
+            "model": model_tag,
+            "temperature": round(float(temperature), 3),
+            "prompt_version": prompt_version,
+            "messages": [[m.role, m.content] for m in messages],
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return "llm-answer:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _record_cache_event(scene: str, event: str) -> None:
+    with _CACHE_EVENTS_LOCK:
+        _CACHE_EVENTS.setdefault(scene or "default", Counter())[event] += 1
+
+
+def _cache_lookup(
+    messages: list[LLMMessage], temperature: float, scene: str, prompt_version: str
+) -> tuple[str | None, str | None]:
+    cache = _response_cache()
+    if cache is None:
+        return None, None
+    if float(temperature) > float(getattr(settings, "QA_LLM_CACHE_MAX_TEMPERATURE", 0.3)):
+        _record_cache_event(scene, "bypass")
+        return None, None
+    key = _cache_key(messages, temperature, prompt_version)
+    cached = cache.get(key)
+    _record_cache_event(scene, "hit" if cached is not None else "miss")
+    return key, cached
+
+
+def _cache_store(key: str | None, answer: str) -> None:
+    if key is None or not answer:
+        return
+    cache = _response_cache()
+    if cache is not None:
+        cache.set(key, answer, getattr(settings, "QA_LLM_CACHE_TTL", 7 * 24 * 3600))
+
+
+def llm_cache_stats() -> dict[str, Any]:
+    if _response_cache() is None:
+        return {"enabled": False, "scenes": []}
+    with _CACHE_EVENTS_LOCK:
+        snapshot = {scene: dict(events) for scene, events in _CACHE_EVENTS.items()}
+    rows = []
+    for scene in sorted(snapshot):
+        counts = {e: int(snapshot[scene].get(e, 0)) for e in ("hit", "miss", "bypass")}
+        lookups = counts["hit"] + counts["miss"]
+        rows.append({"scene": scene, **counts, "hit_rate": (counts["hit"] / lookups) if lookups else 0.0})
+    return {"enabled": True, "scenes": rows}
+
+
+def _singleflight() -> SingleFlight | None:
+    global _SINGLEFLIGHT
+    if not getattr(settings, "QA_LLM_SINGLEFLIGHT_ENABLED", True):
+        return None
+    if _SINGLEFLIGHT is not None:
+        return _SINGLEFLIGHT
+    with _SINGLEFLIGHT_LOCK:
+        if _SINGLEFLIGHT is None:
+            lock_dir = None
+            if getattr(settings, "QA_LLM_SINGLEFLIGHT_CROSS_PROCESS", False):
+                base_dir = Path(getattr(settings, "BASE_DIR", Path.cwd()))
+                lock_dir = Path(getattr(settings, "QA_LLM_SINGLEFLIGHT_DIR", "") or base_dir / "output" / "llm_singleflight")
+            _SINGLEFLIGHT = SingleFlight(
+                lock_dir=lock_dir,
+                wait_timeout=float(getattr(settings, "QA_LLM_SINGLEFLIGHT_WAIT", 120.0) or 120.0),
+            )
+        return _SINGLEFLIGHT
+
+
+def _scheduler() -> FairScheduler | None:
+    global _SCHEDULER
+    max_concurrency = int(getattr(settings, "QA_LLM_MAX_CONCURRENCY", 8) or 0)
+    if max_concurrency <= 0:
+        return None
+    if _SCHEDULER is not None:
+        return _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = FairScheduler(
+                max_concurrency=max_concurrency,
+                max_wait=float(getattr(settings, "QA_LLM_MAX_QUEUE_WAIT", 20.0) or 20.0),
+                max_queue_per_user=int(getattr(settings, "QA_LLM_MAX_QUEUE_PER_USER", 4) or 4),
+            )
+        return _SCHEDULER
+
+
+def llm_scheduler_stats() -> dict[str, Any]:
+    scheduler = _scheduler()
+    if scheduler is None:
+        return {"enabled": False}
+    return {"enabled": True, **scheduler.stats()}
+
+
+def _circuit_breaker() -> CircuitBreaker | None:
+    global _BREAKER
+    if not getattr(settings, "QA_LLM_CIRCUIT_ENABLED", True):
+        return None
+    if _BREAKER is not None:
+        return _BREAKER
+    with _BREAKER_LOCK:
+        if _BREAKER is None:
+            _BREAKER = CircuitBreaker(
+                window=int(getattr(settings, "QA_LLM_CIRCUIT_WINDOW", 20) or 20),
+                min_calls=int(getattr(settings, "QA_LLM_CIRCUIT_MIN_CALLS", 10) or 10),
+                failure_rate=float(getattr(settings, "QA_LLM_CIRCUIT_FAILURE_RATE", 0.5) or 0.5),
+                slow_call_seconds=float(getattr(settings, "QA_LLM_CIRCUIT_SLOW_CALL_SECONDS", 30.0) or 30.0),
+                open_seconds=float(getattr(settings, "QA_LLM_CIRCUIT_OPEN_SECONDS", 30.0) or 30.0),
+            )
+        return _BREAKER
+
+
+def llm_circuit_stats() -> dict[str, Any]:
+    breaker = _circuit_breaker()
+    if breaker is None:
+        return {"enabled": False}
+    return {"enabled": True, **breaker.stats()}
+
 
+@contextmanager
+def _guarded(user_key: str) -> Iterator[None]:
+    """熔断预检 -> 公平排队 -> 熔断计时：排队等待不计入上游耗时，熔断打开时也不必排队。"""
+    breaker = _circuit_breaker()
+    if breaker is not None:
+        breaker.check()
+    scheduler = _scheduler()
+    with scheduler.slot(user_key) if scheduler is not None else nullcontext():
+        with breaker.guard() if breaker is not None else nullcontext():
+            yield
 
-def chat(messages: list[LLMMessage], temperature: float = 0.2) -> str:
-    model_name = getattr(settings, "CURRENT_LLM_MODEL", "qwen") or "qwen"
-    if model_name == "qwen":
-        client, model = _qwen_client()
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role": m.role, "content": m.content} for m in messages],
-            temperature=temperature,
+
+def _chat_scheduled(messages: list[LLMMessage], temperature: float, user_key: str) -> str:
+    with _guarded(user_key):
+        return _chat_uncached(messages, temperature)
+
+
+_STREAM_END = object()
+
+
+@dataclass(frozen=True)
+class _StreamFailure:
+    error: Exception
+
+
+def _stream_scheduled(messages: list[LLMMessage], temperature: float, user_key: str) -> Iterator[str]:
+    """流式调用：后台线程读上游写入队列，调用方按自己的节奏从队列取。
+
+    公平调度名额在上游读完时归还，不等客户端消费完；熔断按首个 token 的耗时判断慢调用，完整读完即计成功。
+    客户端中途断开时通知后台线程停止读取，不计入熔断统计。
+    """
+    breaker = _circuit_breaker()
+    if breaker is not None:
+        breaker.check()
+    scheduler = _scheduler()
+    if scheduler is not None:
+        scheduler.acquire(user_key)
+    try:
+        if breaker is not None:
+            breaker.allow()
+    except BaseException:
+        if scheduler is not None:
+            scheduler.release()
+        raise
+
+    deltas: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    def pump() -> None:
+        t0 = time.perf_counter()
+        first_token: float | None = None
+        upstream = iter(_chat_stream_uncached(messages, temperature))
+        try:
+            for delta in upstream:
+                if first_token is None:
+                    first_token = time.perf_counter() - t0
+                if stop.is_set():
+                    break
+                deltas.put(delta)
+        except Exception as e:
+            if breaker is not None:
+                breaker.record(first_token if first_token is not None else time.perf_counter() - t0, ok=False)
+            deltas.put(_StreamFailure(e))
+            return
+        finally:
+            close = getattr(upstream, "close", None)
+            if close is not None:
+                close()
+            if scheduler is not None:
+                scheduler.release()
+        if breaker is not None:
+            if stop.is_set():
+                breaker.release()
+            else:
+                breaker.record(first_token if first_token is not None else time.perf_counter() - t0, ok=True)
+        deltas.put(_STREAM_END)
+
+    threading.Thread(target=pump, name="llm-stream", daemon=True).start()
+    try:
+        while True:
+            item = deltas.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, _StreamFailure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def _as_dicts(messages: list[LLMMessage]) -> list[dict[str, str]]:
+    return [{"role": m.role, "content": m.content} for m in messages]
+
+
+def _chat_uncached(messages: list[LLMMessage], temperature: float) -> str:
+    return get_router(_current_model_name()).chat(_as_dicts(messages), temperature)
+
+
+def _chat_stream_uncached(messages: list[LLMMessage], temperature: float) -> Iterator[str]:
+    yield from get_router(_current_model_name()).stream(_as_dicts(messages), temperature)
+
+
+async def _achat_uncached(messages: list[LLMMessage], temperature: float) -> str:
+    return await get_router(_current_model_name()).achat(_as_dicts(messages), temperature)
+
+
+def llm_router_stats() -> dict[str, Any]:
+    return get_router(_current_model_name()).stats()
+
+
+def chat(
+    messages: list[LLMMessage],
+    temperature: float = 0.2,
+    *,
+    scene: str = "",
+    prompt_version: str = "",
+    user_key: str = "",
+) -> str:
+    key, cached = _cache_lookup(messages, temperature, scene, prompt_version)
+    if cached is not None:
+        return cached
+    flight = _singleflight()
+    if flight is None:
+        answer = _chat_scheduled(messages, temperature, user_key)
+    else:
+        # 相同请求并发到达（多人同时提问、重复点击）时只向上游发一次
+        # 只共享上游的结果和错误；排队超时、熔断拒绝属于领头请求自己的准入失败，跟随者自己重试，最多等自己的排队预算
+        flight_key = key or _cache_key(messages, temperature, prompt_version)
+        scheduler = _scheduler()
+        answer = flight.do(
+            flight_key,
+            lambda: _chat_scheduled(messages, temperature, user_key),
+            wait_timeout=scheduler.max_wait if scheduler is not None else None,
+            local_errors=(LLMQueueTimeout, CircuitOpenError),
         )
-        return (resp.choices[0].message.content or "").strip()
+    _cache_store(key, answer)
+    return answer
+
+
+def chat_stream(
+    messages: list[LLMMessage],
+    temperature: float = 0.2,
+    *,
+    scene: str = "",
+    prompt_version: str = "",
+    user_key: str = "",
+) -> Iterator[str]:
+    key, cached = _cache_lookup(messages, temperature, scene, prompt_version)
+    if cached is not None:
+        yield cached
+        return
+    parts: list[str] = []
+    for delta in _stream_scheduled(messages, temperature, user_key):
+        parts.append(delta)
+        yield delta
+    _cache_store(key, "".join(parts).strip())
+
 
-    raise ValueError(f"不支持的模型配置: CURRENT_LLM_MODEL={model_name!r}")
+async def achat(
+    messages: list[LLMMessage],
+    temperature: float = 0.2,
+    *,
+    scene: str = "",
+    prompt_version: str = "",
+    user_key: str = "",
+) -> str:
+    key, cached = _cache_lookup(messages, temperature, scene, prompt_version)
+    if cached is not None:
+        return cached
+    breaker = _circuit_breaker()
+    if breaker is not None:
+        breaker.check()
+    scheduler = _scheduler()
+    async with scheduler.aslot(user_key) if scheduler is not None else nullcontext():
+        with breaker.guard() if breaker is not None else nullcontext():
+            answer = await _achat_uncached(messages, temperature)
+    _cache_store(key, answer)
+    return answer
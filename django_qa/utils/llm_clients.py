@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Coroutine, TypeVar
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+# 本模块在没有 Django 配置时回退到环境变量，model_comparison/run_benchmark.py 也直接复用。
+
+T = TypeVar("T")
+
+
+def _conf(name: str, default: Any = "") -> Any:
+    try:
+        from django.conf import settings
+
+        return getattr(settings, name, default)
+    except Exception:
+        return os.environ.get(name, default)
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    name: str
+    base_url: str
+    api_key: str
+    model: str
+    connect_timeout: float = 5.0
+    read_timeout: float = 60.0
+    max_connections: int = 50
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    http2: bool = True
+    kind: str = "openai"
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout, pool=self.connect_timeout)
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+def _provider_defaults() -> dict[str, Any]:
+    return {
+        "connect_timeout": float(_conf("LLM_CONNECT_TIMEOUT", 5.0) or 5.0),
+        "read_timeout": float(_conf("LLM_READ_TIMEOUT", 60.0) or 60.0),
+        "max_connections": int(_conf("LLM_MAX_CONNECTIONS", 50) or 50),
+        "max_keepalive_connections": int(_conf("LLM_MAX_KEEPALIVE_CONNECTIONS", 20) or 20),
+        "http2": str(_conf("LLM_HTTP2", "1")) not in {"0", "False", "false", ""},
+    }
+
+
+def provider_config(name: str) -> ProviderConfig | None:
+    defaults = _provider_defaults()
+    if name == "qwen":
+        return ProviderConfig(
+            name="qwen",
+            base_url=str(_conf("QWEN_API_BASE", "https://dashscope.aliyuncs.com/compatible-mode/v1") or ""),
+            api_key=str(_conf("QWEN_API_KEY", "") or ""),
+            model=str(_conf("QWEN_MODEL_NAME", "qwen-coder-turbo") or ""),
+            **defaults,
+        )
+    if name == "zhipu":
+        return ProviderConfig(
+            name="zhipu",
+            base_url=str(_conf("ZHIPU_API_BASE", "https://open.bigmodel.cn/api/paas/v4/") or ""),
+            api_key=str(_conf("ZHIPU_API_KEY", "") or ""),
+            model=str(_conf("ZHIPU_MODEL_NAME", "glm-4-flash") or ""),
+            **defaults,
+        )
+    if name == "ark":
+        return ProviderConfig(
+            name="ark",
+            base_url=str(_conf("ARK_API_BASE", "https://ark.cn-beijing.volces.com/api/v3") or ""),
+            api_key=str(_conf("ARK_API_KEY", "") or ""),
+            model=str(_conf("ARK_LLM_TEXT_MODEL_ID", "doubao-1-5-pro-32k-250115") or ""),
+            **defaults,
+        )
+    if name == "ollama":
+        # 走 Ollama 原生 /api/chat（见 llm_ollama.py），本地推理首 token 可能较慢，读超时单独配置
+        return ProviderConfig(
+            name="ollama",
+            base_url=str(_conf("OLLAMA_API_BASE", "http://localhost:11434") or "").rstrip("/"),
+            api_key="",
+            model=str(_conf("OLLAMA_MODEL_CODELLAMA", "codellama:7b-instruct") or ""),
+            kind="ollama",
+            **{**defaults, "http2": False, "read_timeout": float(_conf("OLLAMA_READ_TIMEOUT", 300.0) or 300.0)},
+        )
+    if name == "openai":
+        return ProviderConfig(
+            name="openai",
+            base_url=str(_conf("OPENAI_COMPAT_API_BASE", "https://api.openai.com/v1") or ""),
+            api_key=str(_conf("OPENAI_COMPAT_API_KEY", "") or ""),
+            model=str(_conf("OPENAI_COMPAT_MODEL_NAME", "gpt-4o") or ""),
+            **defaults,
+        )
+    return None
+
+
+class ProviderRegistry:
+    """按 provider 缓存 HTTP 连接池与 OpenAI 客户端，避免每次调用重新建连。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._configs: dict[str, ProviderConfig] = {}
+        self._http_clients: dict[str, httpx.Client] = {}
+        self._openai_clients: dict[str, OpenAI] = {}
+        # 异步客户端只在 _loop 上创建和使用，见 run_on_client_loop
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._async_clients: dict[str, AsyncOpenAI] = {}
+        self._async_http_clients: dict[str, httpx.AsyncClient] = {}
+
+    def config(self, name: str) -> ProviderConfig:
+        cfg = self._configs.get(name)
+        if cfg is not None:
+            return cfg
+        cfg = provider_config(name)
+        if cfg is None:
+            raise ValueError(f"未知 provider: {name!r}")
+        with self._lock:
+            self._configs.setdefault(name, cfg)
+        return self._configs[name]
+
+    def register(self, cfg: ProviderConfig) -> None:
+        with self._lock:
+            self._configs[cfg.name] = cfg
+            old = self._http_clients.pop(cfg.name, None)
+            self._openai_clients.pop(cfg.name, None)
+            loop = self._loop
+        if old is not None:
+            old.close()
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._aclose_async_clients({cfg.name}), loop).result(timeout=10)
+
+    def http_client(self, name: str) -> httpx.Client:
+        client = self._http_clients.get(name)
+        if client is not None:
+            return client
+        cfg = self.config(name)
+        with self._lock:
+            client = self._http_clients.get(name)
+            if client is None:
+                client = httpx.Client(
+                    timeout=cfg.timeout(),
+                    limits=cfg.limits(),
+                    http2=cfg.http2 and _http2_available(),
+                    trust_env=True,
+                )
+                self._http_clients[name] = client
+            return client
+
+    def openai_client(self, name: str) -> tuple[OpenAI, str]:
+        cfg = self.config(name)
+        client = self._openai_clients.get(name)
+        if client is None:
+            http_client = self.http_client(name)
+            with self._lock:
+                client = self._openai_clients.get(name)
+                if client is None:
+                    client = OpenAI(api_key=cfg.api_key, base_url=cfg.base_url, http_client=http_client)
+                    self._openai_clients[name] = client
+        return client, cfg.model
+
+    def _client_loop(self) -> asyncio.AbstractEventLoop:
+        loop = self._loop
+        if loop is not None:
+            return loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-async-clients", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    async def run_on_client_loop(self, coro: Coroutine[Any, Any, T]) -> T:
+        """在注册表常驻的事件循环上执行使用异步客户端的协程。
+
+        httpx.AsyncClient 的连接池绑定在创建它的事件循环上；WSGI 下 async_to_sync 每个请求都新建一个循环，
+        按调用方的循环建客户端会每个请求泄漏一个连接池。所以异步客户端统一建在这一个循环上，调用方的循环只等结果，
+        调用方被取消时任务也随之取消。
+        """
+        loop = self._client_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def _require_client_loop(self) -> None:
+        if self._loop is None or asyncio.get_running_loop() is not self._loop:
+            raise RuntimeError("异步客户端只能在 run_on_client_loop 中使用")
+
+    def _new_async_http_client(self, cfg: ProviderConfig) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=cfg.timeout(),
+            limits=cfg.limits(),
+            http2=cfg.http2 and _http2_available(),
+            trust_env=True,
+        )
+
+    def async_openai_client(self, name: str) -> tuple[AsyncOpenAI, str]:
+        # 只在客户端循环的线程里读写，不需要加锁
+        self._require_client_loop()
+        cfg = self.config(name)
+        client = self._async_clients.get(name)
+        if client is None:
+            http_client = self._new_async_http_client(cfg)
+            client = AsyncOpenAI(api_key=cfg.api_key, base_url=cfg.base_url, http_client=http_client)
+            self._async_clients[name] = client
+        return client, cfg.model
+
+    def async_http_client(self, name: str) -> httpx.AsyncClient:
+        self._require_client_loop()
+        client = self._async_http_clients.get(name)
+        if client is None:
+            client = self._new_async_http_client(self.config(name))
+            self._async_http_clients[name] = client
+        return client
+
+    async def _aclose_async_clients(self, names: set[str] | None = None) -> None:
+        for name in list(self._async_clients):
+            if names is None or name in names:
+                await self._async_clients.pop(name).close()
+        for name in list(self._async_http_clients):
+            if names is None or name in names:
+                await self._async_http_clients.pop(name).aclose()
+
+    def close(self) -> None:
+        with self._lock:
+            clients = list(self._http_clients.values())
+            self._http_clients.clear()
+            self._openai_clients.clear()
+            loop, self._loop = self._loop, None
+        for c in clients:
+            c.close()
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._aclose_async_clients(), loop).result(timeout=10)
+            loop.call_soon_threadsafe(loop.stop)
+
+
+_DEFAULT_REGISTRY: ProviderRegistry | None = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_registry() -> ProviderRegistry:
+    global _DEFAULT_REGISTRY
+    if _DEFAULT_REGISTRY is not None:
+        return _DEFAULT_REGISTRY
+    with _DEFAULT_LOCK:
+        if _DEFAULT_REGISTRY is None:
+            _DEFAULT_REGISTRY = ProviderRegistry()
+        return _DEFAULT_REGISTRY
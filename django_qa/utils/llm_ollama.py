@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, Any, Iterator
+
+from django_qa.utils.llm_clients import ProviderRegistry, _conf
+
+if TYPE_CHECKING:
+    from django_qa.utils.llm_router import Route
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+class OllamaBackend:
+    """Ollama 原生 /api/chat 接口：流式输出为 NDJSON，每行一个增量。
+
+    keep_alive 让模型在两次请求之间常驻显存，num_ctx 控制上下文窗口；
+    与 OpenAI 兼容的 /v1 接口相比，这两个参数只有原生接口支持。
+    """
+
+    def __init__(self, registry: ProviderRegistry) -> None:
+        self._registry = registry
+
+    def _url(self, route: Route) -> str:
+        return self._registry.config(route.provider).base_url.rstrip("/") + "/api/chat"
+
+    def _payload(self, route: Route, messages: list[dict[str, str]], temperature: float, stream: bool) -> dict[str, Any]:
+        options: dict[str, Any] = {"temperature": temperature}
+        num_ctx = int(_conf("OLLAMA_NUM_CTX", 0) or 0)
+        if num_ctx > 0:
+            options["num_ctx"] = num_ctx
+        return {
+            "model": route.model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": str(_conf("OLLAMA_KEEP_ALIVE", "30m") or "30m"),
+            "options": options,
+        }
+
+    @staticmethod
+    def _check(status_code: int, body: str) -> None:
+        if status_code < 400:
+            return
+        try:
+            detail = json.loads(body).get("error") or body
+        except (ValueError, AttributeError):
+            detail = body
+        raise OllamaError(f"Ollama HTTP {status_code}: {str(detail)[:300]}")
+
+    @staticmethod
+    def _content(obj: dict[str, Any]) -> str:
+        if obj.get("error"):
+            raise OllamaError(f"Ollama: {obj['error']}")
+        return str((obj.get("message") or {}).get("content") or "")
+
+    def chat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str:
+        client = self._registry.http_client(route.provider)
+        resp = client.post(self._url(route), json=self._payload(route, messages, temperature, stream=False))
+        self._check(resp.status_code, resp.text)
+        return self._content(resp.json()).strip()
+
+    def stream(self, route: Route, messages: list[dict[str, str]], temperature: float) -> Iterator[str]:
+        client = self._registry.http_client(route.provider)
+        payload = self._payload(route, messages, temperature, stream=True)
+        with client.stream("POST", self._url(route), json=payload) as resp:
+            if resp.status_code >= 400:
+                self._check(resp.status_code, resp.read().decode("utf-8", "replace"))
+            for line in resp.iter_lines():
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                delta = self._content(obj)
+                if delta:
+                    yield delta
+                if obj.get("done"):
+                    return
+
+    async def achat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str:
+        return await self._registry.run_on_client_loop(self._achat(route, messages, temperature))
+
+    async def _achat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str:
+        client = self._registry.async_http_client(route.provider)
+        resp = await client.post(self._url(route), json=self._payload(route, messages, temperature, stream=False))
+        self._check(resp.status_code, resp.text)
+        return self._content(resp.json()).strip()
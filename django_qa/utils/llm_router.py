@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Iterator, Protocol
+
+from django_qa.utils.llm_clients import ProviderRegistry, _conf, get_registry
+from django_qa.utils.llm_ollama import OllamaBackend
+
+
+@dataclass(frozen=True)
+class Route:
+    provider: str
+    model: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+
+def _parse_one(spec: str, registry: ProviderRegistry) -> Route:
+    name = spec.strip()
+    lowered = name.lower()
+    if lowered in {"qwen", "zhipu", "ark", "openai", "ollama"}:
+        return Route(lowered, registry.config(lowered).model)
+    if lowered.startswith("glm-"):
+        return Route("zhipu", name)
+    if lowered.startswith("doubao"):
+        return Route("ark", registry.config("ark").model)
+    if lowered == "codellama":
+        return Route("ollama", str(_conf("OLLAMA_MODEL_CODELLAMA", "codellama:7b-instruct") or ""))
+    if lowered == "starcoder":
+        return Route("ollama", str(_conf("OLLAMA_MODEL_STARCODER", "starcoder2") or ""))
+    if lowered == "gpt-4-code":
+        return Route("openai", registry.config("openai").model)
+    provider, sep, model = name.partition(":")
+    if sep and provider.lower() in {"qwen", "zhipu", "ark", "openai", "ollama"} and model:
+        return Route(provider.lower(), model)
+    raise ValueError(f"不支持的模型配置: CURRENT_LLM_MODEL={spec!r}")
+
+
+def resolve_routes(spec: str, registry: ProviderRegistry | None = None) -> list[Route]:
+    """把 CURRENT_LLM_MODEL 解析成候选路由；逗号分隔表示多个候选，由路由器按延迟挑选。"""
+    registry = registry or get_registry()
+    routes: list[Route] = []
+    for part in (spec or "qwen").split(","):
+        if part.strip():
+            route = _parse_one(part, registry)
+            if route not in routes:
+                routes.append(route)
+    if not routes:
+        raise ValueError(f"不支持的模型配置: CURRENT_LLM_MODEL={spec!r}")
+    return routes
+
+
+class Backend(Protocol):
+    def chat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str: ...
+
+    def stream(self, route: Route, messages: list[dict[str, str]], temperature: float) -> Iterator[str]: ...
+
+    async def achat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str: ...
+
+
+class OpenAICompatibleBackend:
+    def __init__(self, registry: ProviderRegistry) -> None:
+        self._registry = registry
+
+    def chat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str:
+        client, _ = self._registry.openai_client(route.provider)
+        resp = client.chat.completions.create(model=route.model, messages=messages, temperature=temperature)
+        return (resp.choices[0].message.content or "").strip()
+
+    def stream(self, route: Route, messages: list[dict[str, str]], temperature: float) -> Iterator[str]:
+        client, _ = self._registry.openai_client(route.provider)
+        stream = client.chat.completions.create(
+            model=route.model, messages=messages, temperature=temperature, stream=True
+        )
+        for event in stream:
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content
+            if delta:
+                yield delta
+
+    async def achat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str:
+        return await self._registry.run_on_client_loop(self._achat(route, messages, temperature))
+
+    async def _achat(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str:
+        client, _ = self._registry.async_openai_client(route.provider)
+        resp = await client.chat.completions.create(model=route.model, messages=messages, temperature=temperature)
+        return (resp.choices[0].message.content or "").strip()
+
+
+class LatencyTracker:
+    """记录每条路由最近的调用耗时与失败情况；连续失败达到阈值后冷却一段时间不再选用。"""
+
+    def __init__(self, *, window: int = 100, failure_threshold: int = 3, cooldown: float = 30.0) -> None:
+        self._lock = threading.Lock()
+        self._window = max(1, int(window))
+        self._failure_threshold = max(1, int(failure_threshold))
+        self._cooldown = float(cooldown)
+        self._latencies: dict[str, deque[float]] = {}
+        self._failures: dict[str, int] = {}
+        self._down_until: dict[str, float] = {}
+        self._calls: dict[str, int] = {}
+        self._errors: dict[str, int] = {}
+
+    def record(self, route: Route, elapsed: float, ok: bool) -> None:
+        key = route.key
+        with self._lock:
+            self._calls[key] = self._calls.get(key, 0) + 1
+            if ok:
+                self._latencies.setdefault(key, deque(maxlen=self._window)).append(float(elapsed))
+                self._failures[key] = 0
+                self._down_until.pop(key, None)
+                return
+            self._errors[key] = self._errors.get(key, 0) + 1
+            self._failures[key] = self._failures.get(key, 0) + 1
+            if self._failures[key] >= self._failure_threshold:
+                self._down_until[key] = time.monotonic() + self._cooldown
+
+    def healthy(self, route: Route) -> bool:
+        with self._lock:
+            return self._down_until.get(route.key, 0.0) <= time.monotonic()
+
+    def _quantile(self, key: str, q: float) -> float | None:
+        samples = sorted(self._latencies.get(key) or ())
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def p50(self, route: Route) -> float | None:
+        with self._lock:
+            return self._quantile(route.key, 0.5)
+
+    def p95(self, route: Route, *, min_samples: int = 1) -> float | None:
+        with self._lock:
+            if len(self._latencies.get(route.key) or ()) < min_samples:
+                return None
+            return self._quantile(route.key, 0.95)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            keys = set(self._calls) | set(self._latencies)
+            now = time.monotonic()
+            return {
+                k: {
+                    "calls": self._calls.get(k, 0),
+                    "errors": self._errors.get(k, 0),
+                    "samples": len(self._latencies.get(k) or ()),
+                    "p50_ms": int((self._quantile(k, 0.5) or 0.0) * 1000),
+                    "p95_ms": int((self._quantile(k, 0.95) or 0.0) * 1000),
+                    "healthy": self._down_until.get(k, 0.0) <= now,
+                }
+                for k in sorted(keys)
+            }
+
+
+class LLMRouter:
+    """在多个候选路由间选择最快的健康 provider，失败时依次降级；可选对慢请求发起对冲请求。"""
+
+    def __init__(
+        self,
+        routes: list[Route],
+        *,
+        backends: dict[str, Backend] | None = None,
+        registry: ProviderRegistry | None = None,
+        tracker: LatencyTracker | None = None,
+        hedge: bool = False,
+        hedge_min_samples: int = 20,
+    ) -> None:
+        if not routes:
+            raise ValueError("LLMRouter 至少需要一条路由")
+        self.routes = list(routes)
+        self._registry = registry or get_registry()
+        self._backends = dict(backends or {})
+        self.tracker = tracker or LatencyTracker()
+        self._hedge = bool(hedge) and len(self.routes) > 1
+        self._hedge_min_samples = max(1, int(hedge_min_samples))
+        self._executor: ThreadPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def cache_tag(self) -> str:
+        return ",".join(r.key for r in self.routes)
+
+    def _backend(self, route: Route) -> Backend:
+        kind = self._registry.config(route.provider).kind
+        backend = self._backends.get(kind)
+        if backend is None:
+            factory = OllamaBackend if kind == "ollama" else OpenAICompatibleBackend
+            backend = self._backends.setdefault(kind, factory(self._registry))
+        return backend
+
+    def ordered_routes(self) -> list[Route]:
+        """健康的路由在前；没有样本的路由先试一次，其余按 p50 升序。"""
+        def rank(item: tuple[int, Route]) -> tuple[int, float, int]:
+            i, route = item
+            p50 = self.tracker.p50(route)
+            return (0 if self.tracker.healthy(route) else 1, -1.0 if p50 is None else p50, i)
+
+        return [r for _, r in sorted(enumerate(self.routes), key=rank)]
+
+    def _call(self, route: Route, messages: list[dict[str, str]], temperature: float) -> str:
+        t0 = time.perf_counter()
+        try:
+            answer = self._backend(route).chat(route, messages, temperature)
+        except Exception:
+            self.tracker.record(route, time.perf_counter() - t0, ok=False)
+            raise
+        self.tracker.record(route, time.perf_counter() - t0, ok=True)
+        return answer
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is not None:
+            return self._executor
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def _hedged(
+        self,
+        primary: Route,
+        backup: Route,
+        messages: list[dict[str, str]],
+        temperature: float,
+        tried: list[Route],
+    ) -> str | None:
+        delay = self.tracker.p95(primary, min_samples=self._hedge_min_samples)
+        if delay is None:
+            return None
+        executor = self._get_executor()
+        tried.append(primary)
+        pending: set[Future] = {executor.submit(self._call, primary, messages, temperature)}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            # 首个请求超过自身 p95 仍未返回：向次优路由再发一次，谁先成功用谁
+            tried.append(backup)
+            pending.add(executor.submit(self._call, backup, messages, temperature))
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    return f.result()
+                error = f.exception()
+        assert error is not None
+        raise error
+
+    def chat(self, messages: list[dict[str, str]], temperature: float) -> str:
+        routes = self.ordered_routes()
+        if self._hedge and self.tracker.healthy(routes[1]):
+            tried: list[Route] = []
+            try:
+                answer = self._hedged(routes[0], routes[1], messages, temperature, tried)
+            except Exception:
+                routes = [r for r in routes if r not in tried]
+                if not routes:
+                    raise
+            else:
+                if answer is not None:
+                    return answer
+        error: Exception | None = None
+        for route in routes:
+            try:
+                return self._call(route, messages, temperature)
+            except Exception as e:
+                error = e
+        assert error is not None
+        raise error
+
+    def stream(self, messages: list[dict[str, str]], temperature: float) -> Iterator[str]:
+        # 已经输出过 token 后不能再切换 provider，只在首个 token 之前降级。
+        # 延迟样本记首个 token 的耗时：整段生成时长取决于回答长度，混进去会抬高 p95，让常走流式的路由吃亏
+        error: Exception | None = None
+        for route in self.ordered_routes():
+            t0 = time.perf_counter()
+            first_token: float | None = None
+            try:
+                for delta in self._backend(route).stream(route, messages, temperature):
+                    if first_token is None:
+                        first_token = time.perf_counter() - t0
+                    yield delta
+            except Exception as e:
+                self.tracker.record(route, time.perf_counter() - t0, ok=False)
+                if first_token is not None:
+                    raise
+                error = e
+                continue
+            self.tracker.record(route, first_token if first_token is not None else time.perf_counter() - t0, ok=True)
+            return
+        assert error is not None
+        raise error
+
+    async def achat(self, messages: list[dict[str, str]], temperature: float) -> str:
+        error: Exception | None = None
+        for route in self.ordered_routes():
+            t0 = time.perf_counter()
+            try:
+                answer = await self._backend(route).achat(route, messages, temperature)
+            except Exception as e:
+                self.tracker.record(route, time.perf_counter() - t0, ok=False)
+                error = e
+                continue
+            self.tracker.record(route, time.perf_counter() - t0, ok=True)
+            return answer
+        assert error is not None
+        raise error
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "routes": [r.key for r in self.routes],
+            "order": [r.key for r in self.ordered_routes()],
+            "hedge": self._hedge,
+            "latency": self.tracker.snapshot(),
+        }
+
+
+_ROUTERS: dict[str, LLMRouter] = {}
+_ROUTERS_LOCK = threading.Lock()
+
+
+def get_router(spec: str | None = None) -> LLMRouter:
+    spec = spec if spec is not None else str(_conf("CURRENT_LLM_MODEL", "qwen") or "qwen")
+    router = _ROUTERS.get(spec)
+    if router is not None:
+        return router
+    with _ROUTERS_LOCK:
+        router = _ROUTERS.get(spec)
+        if router is None:
+            router = LLMRouter(
+                resolve_routes(spec),
+                tracker=LatencyTracker(
+                    failure_threshold=int(_conf("LLM_ROUTE_FAILURE_THRESHOLD", 3) or 3),
+                    cooldown=float(_conf("LLM_ROUTE_COOLDOWN", 30.0) or 30.0),
+                ),
+                hedge=str(_conf("LLM_HEDGE_ENABLED", "0")) in {"1", "True", "true"},
+                hedge_min_samples=int(_conf("LLM_HEDGE_MIN_SAMPLES", 20) or 20),
+            )
+            _ROUTERS[spec] = router
+        return router
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Iterator
+
+
+class LLMQueueTimeout(Exception):
+    """排队超过最大等待时间（或该用户排队请求过多）时抛出，调用方应快速失败并提示稍后重试。"""
+
+    def __init__(self, user_key: str, waited_ms: int, reason: str = "timeout") -> None:
+        super().__init__(f"LLM 调度排队失败: user={user_key!r} reason={reason} waited_ms={waited_ms}")
+        self.user_key = user_key
+        self.waited_ms = waited_ms
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ("granted", "enqueued_at", "waiter")
+
+    def __init__(self, waiter: asyncio.Future | None = None) -> None:
+        self.granted = False
+        self.enqueued_at = time.perf_counter()
+        # 协程排队时由 _dispatch 通过事件循环唤醒，不占用任何线程
+        self.waiter = waiter
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class FairScheduler:
+    """全局并发上限 + 按用户轮转的公平排队：空出的名额依次分给各用户队首，单个用户刷请求不会饿死其他人。"""
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int = 8,
+        max_wait: float = 20.0,
+        max_queue_per_user: int = 4,
+        window: int = 500,
+    ) -> None:
+        self._max_concurrency = max(1, int(max_concurrency))
+        self._max_wait = float(max_wait)
+        self._max_queue_per_user = max(1, int(max_queue_per_user))
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queues: OrderedDict[str, deque[_Ticket]] = OrderedDict()
+        self._waits_ms: deque[int] = deque(maxlen=max(1, int(window)))
+        self._served = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    @property
+    def max_wait(self) -> float:
+        return self._max_wait
+
+    def _dispatch(self) -> None:
+        granted = False
+        while self._active < self._max_concurrency and self._queues:
+            user_key, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_key)
+            else:
+                del self._queues[user_key]
+            if ticket.waiter is not None:
+                try:
+                    ticket.waiter.get_loop().call_soon_threadsafe(_wake, ticket.waiter)
+                except RuntimeError:
+                    # 事件循环已关闭，没人会来领这个名额
+                    continue
+            ticket.granted = True
+            self._active += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _enqueue(self, user_key: str, waiter: asyncio.Future | None = None) -> _Ticket:
+        queue = self._queues.get(user_key)
+        if queue is not None and len(queue) >= self._max_queue_per_user:
+            self._rejected += 1
+            raise LLMQueueTimeout(user_key, 0, reason="user_queue_full")
+        ticket = _Ticket(waiter)
+        self._queues.setdefault(user_key, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _dequeue(self, user_key: str, ticket: _Ticket) -> None:
+        queue = self._queues.get(user_key)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[user_key]
+
+    def acquire(self, user_key: str = "") -> None:
+        with self._cond:
+            ticket = self._enqueue(user_key)
+
+            deadline = ticket.enqueued_at + self._max_wait
+            while not ticket.granted:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            waited_ms = int((time.perf_counter() - ticket.enqueued_at) * 1000)
+            if not ticket.granted:
+                self._dequeue(user_key, ticket)
+                self._timed_out += 1
+                raise LLMQueueTimeout(user_key, waited_ms)
+            self._served += 1
+            self._waits_ms.append(waited_ms)
+
+    async def aacquire(self, user_key: str = "") -> None:
+        """acquire 的协程版本：排队时挂在事件循环的 Future 上，由 release 唤醒，不占默认线程池。"""
+        with self._cond:
+            ticket = self._enqueue(user_key, asyncio.get_running_loop().create_future())
+        assert ticket.waiter is not None
+        try:
+            remaining = ticket.enqueued_at + self._max_wait - time.perf_counter()
+            await asyncio.wait_for(ticket.waiter, max(0.0, remaining))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._cond:
+                waited_ms = int((time.perf_counter() - ticket.enqueued_at) * 1000)
+                if ticket.granted and isinstance(e, asyncio.CancelledError):
+                    # 名额已经分到但调用方被取消，立即归还
+                    self._active = max(0, self._active - 1)
+                    self._dispatch()
+                    raise
+                if not ticket.granted:
+                    self._dequeue(user_key, ticket)
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    self._timed_out += 1
+                    raise LLMQueueTimeout(user_key, waited_ms) from None
+        with self._cond:
+            self._served += 1
+            self._waits_ms.append(int((time.perf_counter() - ticket.enqueued_at) * 1000))
+
+    def release(self) -> None:
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, user_key: str = "") -> Iterator[None]:
+        self.acquire(user_key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, user_key: str = "") -> AsyncIterator[None]:
+        await self.aacquire(user_key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            waits = sorted(self._waits_ms)
+            queued = {k: len(q) for k, q in self._queues.items()}
+            return {
+                "max_concurrency": self._max_concurrency,
+                "max_wait_ms": int(self._max_wait * 1000),
+                "active": self._active,
+                "queued": sum(queued.values()),
+                "queued_users": len(queued),
+                "served": self._served,
+                "timed_out": self._timed_out,
+                "rejected": self._rejected,
+                "wait_ms_avg": (sum(waits) / len(waits)) if waits else 0.0,
+                "wait_ms_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0,
+                "wait_ms_max": waits[-1] if waits else 0,
+            }
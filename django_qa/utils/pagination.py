@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+
+from django.db.models import Q, QuerySet
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ordering: list[str], values: list[Any]) -> str:
+    payload = {"o": ordering, "v": [v.isoformat() if isinstance(v, datetime) else v for v in values]}
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, ordering: list[str]) -> list[Any]:
+    """游标是不透明的 base64(JSON)，内含排序键；排序方式与生成游标时不一致视为无效。"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw.decode("utf-8"))
+        values = payload["v"]
+        if payload["o"] != ordering or not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError("ordering mismatch")
+        return values
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("无效的游标") from e
+
+
+def _after(ordering: list[str], values: list[Any]) -> Q:
+    """(k1, k2, ...) 严格排在游标之后的行：k1 更靠后，或 k1 相同且 k2 更靠后，依此类推。"""
+    condition = Q()
+    for i in reversed(range(len(ordering))):
+        field = ordering[i].lstrip("-")
+        op = "lt" if ordering[i].startswith("-") else "gt"
+        step = Q(**{f"{field}__{op}": values[i]})
+        if i < len(ordering) - 1:
+            step |= Q(**{field: values[i]}) & condition
+        condition = step
+    return condition
+
+
+@dataclass
+class KeysetPage:
+    rows: list[Any]
+    next_cursor: str | None
+
+
+def keyset_page(qs: QuerySet, ordering: list[str], *, limit: int, cursor: str | None = None) -> KeysetPage:
+    """按 ordering（最后一个键必须唯一，如 id）做游标分页：WHERE 排序键在游标之后 LIMIT n+1，与翻到第几页无关。"""
+    qs = qs.order_by(*ordering)
+    if cursor:
+        qs = qs.filter(_after(ordering, decode_cursor(cursor, ordering)))
+    rows = list(qs[: limit + 1])
+    if len(rows) <= limit:
+        return KeysetPage(rows=rows, next_cursor=None)
+    rows = rows[:limit]
+    last = rows[-1]
+    return KeysetPage(rows=rows, next_cursor=encode_cursor(ordering, [getattr(last, f.lstrip("-")) for f in ordering]))
+
+
+def approximate_count(qs: QuerySet, *, cap: int = 10000) -> tuple[int, bool]:
+    """最多数到 cap + 1 行就停：返回 (数量, 是否精确)；超过上限时数量为 cap，由前端显示为“cap+”。"""
+    n = qs.order_by()[: cap + 1].count()
+    if n > cap:
+        return cap, False
+    return n, True
+
+
+def parse_limit(value: str | None, *, default: int = 20, maximum: int = 100) -> int:
+    try:
+        limit = int(value or default)
+    except (TypeError, ValueError):
+        limit = default
+    return default if limit <= 0 else min(limit, maximum)
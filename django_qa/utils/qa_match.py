@@ -19,6 +19,7 @@ except Exception:  # pragma: no cover
     linear_kernel = None  # type: ignore[assignment]
 
 from django_qa.utils.code_analysis import analyze_code_comprehensive
+from django_qa.utils.code_blocks import extract_code_blocks
 
 
 _CODE_FENCE_RE = re.compile(r"```[^\n]*\n([\s\S]*?)\n```", re.MULTILINE)
@@ -54,22 +55,10 @@ def _extract_any_code(text: str, *, max_blocks: int = 3, max_chars: int = 1800)
     if not text:
         return ""
 
-    blocks: list[str] = []
-    for m in _CODE_FENCE_RE.finditer(text):
-        code = (m.group(1) or "").strip()
-        if code:
-            blocks.append(code)
-        if len(blocks) >= max_blocks:
-            break
-
+    found = extract_code_blocks(text)
+    blocks = [b.code.strip() for b in found if b.kind == "fenced" and b.is_python][:max_blocks]
     if not blocks:
-        for m in _HTML_CODE_RE.finditer(text):
-            code = (m.group(1) or "").strip()
-            code = _HTML_TAG_RE.sub("", code)
-            if code:
-                blocks.append(code)
-            if len(blocks) >= max_blocks:
-                break
+        blocks = [b.code.strip() for b in found if b.kind == "html"][:max_blocks]
 
     if not blocks:
         return ""
@@ -109,6 +98,8 @@ class QAMatcher:
         self._vectorizer: Any | None = None
         self._matrix: Any | None = None
         self._ready = False
+        # 每条回答的代码质量只取决于回答本身，跨请求缓存；索引重建时清空
+        self._quality: dict[int, dict[str, Any]] = {}
 
     def ensure_ready(self) -> None:
         if self._ready:
@@ -117,6 +108,7 @@ class QAMatcher:
             if self._ready:
                 return
             self._build_or_load()
+            self._quality = {}
             self._ready = True
 
     def _build_or_load(self) -> None:
@@ -218,6 +210,13 @@ class QAMatcher:
                     break
         return out
 
+    def vectorize(self, texts: list[str]) -> Any | None:
+        """用检索索引同一个 TF-IDF 向量器编码任意文本，索引不可用时返回 None。"""
+        self.ensure_ready()
+        if self._vectorizer is None:
+            return None
+        return self._vectorizer.transform([_strip_html(_strip_code_blocks(t or "")) for t in texts])
+
     def match_and_recommend(
         self,
         question: str,
@@ -225,20 +224,54 @@ class QAMatcher:
         top_k_match: int = 8,
         top_k_recommend: int = 3,
     ) -> dict[str, Any]:
+        return self.match_and_recommend_many([question], top_k_match=top_k_match, top_k_recommend=top_k_recommend)[0]
+
+    def match_and_recommend_many(
+        self,
+        questions: list[str],
+        *,
+        top_k_match: int = 8,
+        top_k_recommend: int = 3,
+        chunk_size: int = 64,
+    ) -> list[dict[str, Any]]:
+        """批量检索：一次 transform、按块做一次矩阵乘法；命中回答的代码质量分析结果在实例上跨请求复用。"""
+        empty = {"matches": [], "recommendations": []}
         self.ensure_ready()
         if not self._pairs or self._vectorizer is None or self._matrix is None:
-            return {"matches": [], "recommendations": []}
+            return [dict(empty) for _ in questions]
 
-        q = _strip_code_blocks(question or "")
-        q = _strip_html(q)
-        if not q:
-            return {"matches": [], "recommendations": []}
-
-        q_vec = self._vectorizer.transform([q])
-        scores = linear_kernel(q_vec, self._matrix).ravel()
+        cleaned = [_strip_html(_strip_code_blocks(q or "")) for q in questions]
+        todo = [i for i, q in enumerate(cleaned) if q]
+        out: list[dict[str, Any]] = [dict(empty) for _ in questions]
+        if not todo:
+            return out
 
         top_k_match = max(1, min(int(top_k_match), 30))
         top_k_recommend = max(1, min(int(top_k_recommend), 10))
+        chunk_size = max(1, int(chunk_size))
+        for start in range(0, len(todo), chunk_size):
+            rows = todo[start : start + chunk_size]
+            q_vecs = self._vectorizer.transform([cleaned[i] for i in rows])
+            scores = linear_kernel(q_vecs, self._matrix)
+            for row, i in enumerate(rows):
+                out[i] = self._rank(scores[row], top_k_match, top_k_recommend)
+        return out
+
+    def _analyze_pair(self, idx: int) -> dict[str, Any]:
+        # 单条分析要跑 pylint（约 0.7s），冷启动后同一回答不再重复分析；并发时偶尔重复算一次无妨
+        analysis = self._quality.get(idx)
+        if analysis is None:
+            code = _extract_any_code(self._pairs[idx].answer_body)
+            analysis = analyze_code_comprehensive(f"```python\n{code}\n```" if code else "")
+            self._quality[idx] = analysis
+        return analysis
+
+    def _rank(
+        self,
+        scores: Any,
+        top_k_match: int,
+        top_k_recommend: int,
+    ) -> dict[str, Any]:
         best_idx = scores.argsort()[::-1][: max(top_k_match, top_k_recommend * 4)]
 
         matches: list[dict[str, Any]] = []
@@ -258,7 +291,7 @@ class QAMatcher:
                     "answer_excerpt": _excerpt(_strip_html(_strip_code_blocks(pair.answer_body)), 260),
                 }
             )
-            candidates.append({"pair": pair, "similarity": sim})
+            candidates.append({"idx": int(idx), "pair": pair, "similarity": sim})
 
         matches = matches[:top_k_match]
 
@@ -266,8 +299,7 @@ class QAMatcher:
         for c in candidates[: top_k_recommend * 4]:
             pair: QAPair = c["pair"]
             sim = float(c["similarity"])
-            code = _extract_any_code(pair.answer_body)
-            analysis = analyze_code_comprehensive(f"```python\n{code}\n```" if code else "")
+            analysis = self._analyze_pair(c["idx"])
             quality = float(analysis.get("total_score") or 0.0) / 10.0
             upvote = float(max(0, pair.answer_score))
             upvote_norm = min(1.0, upvote / 50.0)
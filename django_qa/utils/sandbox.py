@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import selectors
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+_WORKER_PATH = Path(__file__).resolve().with_name("sandbox_worker.py")
+
+
+@dataclass(frozen=True)
+class SandboxResult:
+    status: str
+    detail: str = ""
+    elapsed_ms: int = 0
+
+    @property
+    def conclusive(self) -> bool:
+        return self.status in {"ok", "error", "timeout", "blocked"}
+
+
+_WORKER_ENV = {"PATH": os.environ.get("PATH", ""), "LANG": "C.UTF-8"}
+
+
+@lru_cache(maxsize=1)
+def sandbox_supported() -> bool:
+    """实际启动一次 worker 跑空任务，确认能建立命名空间、只读根目录与 seccomp 隔离；结果按进程缓存。"""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-I", str(_WORKER_PATH), "--probe"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=_WORKER_ENV,
+            timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return proc.returncode == 0
+
+
+class _Worker:
+    def __init__(self) -> None:
+        self._proc: subprocess.Popen | None = None
+        self._start()
+
+    def _start(self) -> None:
+        self._proc = subprocess.Popen(
+            [sys.executable, "-I", str(_WORKER_PATH)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=_WORKER_ENV,
+            close_fds=True,
+            text=True,
+            bufsize=1,
+        )
+
+    def restart(self) -> None:
+        self.close()
+        self._start()
+
+    def close(self) -> None:
+        if self._proc is None:
+            return
+        try:
+            self._proc.kill()
+            self._proc.wait(timeout=1)
+        except Exception:
+            pass
+        self._proc = None
+
+    def run(self, code: str, *, timeout: float, memory_mb: int) -> SandboxResult:
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            self.restart()
+            proc = self._proc
+        assert proc is not None and proc.stdin is not None and proc.stdout is not None
+        proc.stdin.write(json.dumps({"code": code, "timeout": timeout, "memory_mb": memory_mb}) + "\n")
+        proc.stdin.flush()
+
+        with selectors.DefaultSelector() as sel:
+            sel.register(proc.stdout, selectors.EVENT_READ)
+            if not sel.select(timeout=timeout + 2.0):
+                self.restart()
+                return SandboxResult(status="timeout", detail="worker")
+        line = proc.stdout.readline()
+        if not line:
+            self.restart()
+            return SandboxResult(status="error", detail="worker exited")
+        out = json.loads(line)
+        return SandboxResult(
+            status=str(out.get("status") or "error"),
+            detail=str(out.get("detail") or ""),
+            elapsed_ms=int(out.get("elapsed_ms") or 0),
+        )
+
+
+class SandboxPool:
+    """常驻的沙箱进程池：每个 worker 预先启动一次解释器，任务到来时只 fork 子进程执行。"""
+
+    def __init__(self, *, size: int = 2, timeout: float = 2.0, memory_mb: int = 256, max_code_chars: int = 20000) -> None:
+        self._timeout = float(timeout)
+        self._memory_mb = int(memory_mb)
+        self._max_code_chars = int(max_code_chars)
+        self._workers = [_Worker() for _ in range(max(1, int(size)))]
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        for w in self._workers:
+            self._idle.put(w)
+
+    def run(self, code: str) -> SandboxResult:
+        if not code or not code.strip():
+            return SandboxResult(status="skipped", detail="empty")
+        if len(code) > self._max_code_chars:
+            return SandboxResult(status="skipped", detail="too long")
+        try:
+            worker = self._idle.get(timeout=self._timeout * 4)
+        except queue.Empty:
+            return SandboxResult(status="skipped", detail="pool busy")
+        try:
+            result = worker.run(code, timeout=self._timeout, memory_mb=self._memory_mb)
+        except Exception as e:
+            worker.restart()
+            result = SandboxResult(status="skipped", detail=f"sandbox: {type(e).__name__}")
+        finally:
+            self._idle.put(worker)
+        return result
+
+    def close(self) -> None:
+        for w in self._workers:
+            w.close()
+
+
+_DEFAULT_POOL: SandboxPool | None = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_default_sandbox() -> SandboxPool | None:
+    """QA_SANDBOX_ENABLED 关闭时返回 None；开启但当前环境无法建立隔离时直接报错，不退化成无隔离执行。"""
+    global _DEFAULT_POOL
+    if not getattr(settings, "QA_SANDBOX_ENABLED", False):
+        return None
+    if not sandbox_supported():
+        raise ImproperlyConfigured(
+            "QA_SANDBOX_ENABLED=1 需要 Linux 用户/网络/PID 命名空间与 seccomp 隔离，当前环境不可用；请关闭该选项"
+        )
+    if _DEFAULT_POOL is not None:
+        return _DEFAULT_POOL
+    with _DEFAULT_LOCK:
+        if _DEFAULT_POOL is None:
+            _DEFAULT_POOL = SandboxPool(
+                size=int(getattr(settings, "QA_SANDBOX_WORKERS", 2) or 2),
+                timeout=float(getattr(settings, "QA_SANDBOX_TIMEOUT", 2.0) or 2.0),
+                memory_mb=int(getattr(settings, "QA_SANDBOX_MEMORY_MB", 256) or 256),
+            )
+        return _DEFAULT_POOL
@@ -0,0 +1,428 @@
+"""沙箱 zygote 进程：由 sandbox.SandboxPool 以独立解释器启动并常驻复用。
+
+每个任务从 stdin 读入一行 JSON，fork 出子进程执行代码，结果以一行 JSON 写回 stdout。
+隔离依赖 Linux 内核机制而不是审计钩子：子进程降到 nobody 后创建新的 user/mount/net/pid/ipc/uts
+命名空间，在只读挂载了标准库与共享库的 tmpfs 里 chroot，清空 capability，设置 RLIMIT_NPROC=0
+与 no_new_privs，再用 seccomp 拒绝进程创建、exec、socket、ptrace 与挂载类系统调用。
+任一步失败时不执行代码，返回 status=unavailable。审计钩子只用来把越权行为归类为 blocked。
+本文件只依赖标准库，不能导入 Django 或项目内模块。
+"""
+
+import ctypes
+import json
+import os
+import platform
+import resource
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import time
+
+if sys.path and sys.path[0] == os.path.dirname(os.path.abspath(__file__)):
+    sys.path.pop(0)
+
+_BLOCKED_EVENTS = {
+    "socket.__new__",
+    "socket.bind",
+    "socket.connect",
+    "socket.getaddrinfo",
+    "socket.gethostbyname",
+    "subprocess.Popen",
+    "os.system",
+    "os.exec",
+    "os.fork",
+    "os.forkpty",
+    "os.posix_spawn",
+    "os.spawn",
+    "os.kill",
+    "os.killpg",
+    "os.remove",
+    "os.rename",
+    "os.rmdir",
+    "os.chmod",
+    "os.chown",
+    "shutil.rmtree",
+    "ctypes.dlopen",
+    "ctypes.cdata",
+    "sys.addaudithook",
+}
+_SKIP_EXCEPTIONS = ("ModuleNotFoundError", "ImportError", "EOFError")
+
+
+class SandboxViolation(Exception):
+    pass
+
+
+class IsolationError(Exception):
+    pass
+
+
+_CLONE_NEWNS = 0x00020000
+_CLONE_NEWUTS = 0x04000000
+_CLONE_NEWIPC = 0x08000000
+_CLONE_NEWUSER = 0x10000000
+_CLONE_NEWPID = 0x20000000
+_CLONE_NEWNET = 0x40000000
+
+_MS_RDONLY = 0x1
+_MS_NOSUID = 0x2
+_MS_NODEV = 0x4
+_MS_NOEXEC = 0x8
+_MS_REMOUNT = 0x20
+_MS_NOATIME = 0x400
+_MS_NODIRATIME = 0x800
+_MS_BIND = 0x1000
+_MS_REC = 0x4000
+_MS_PRIVATE = 0x40000
+_MS_RELATIME = 0x200000
+# statvfs.f_flag 与 mount flags 的对应关系；用户命名空间里重新挂载时必须保留这些被锁定的标志
+_STATVFS_TO_MS = {1: _MS_RDONLY, 2: _MS_NOSUID, 4: _MS_NODEV, 8: _MS_NOEXEC, 1024: _MS_NOATIME, 2048: _MS_NODIRATIME, 4096: _MS_RELATIME}
+
+_PR_SET_PDEATHSIG = 1
+_PR_SET_DUMPABLE = 4
+_PR_SET_SECCOMP = 22
+_PR_SET_NO_NEW_PRIVS = 38
+_SECCOMP_MODE_FILTER = 2
+_SECCOMP_RET_KILL_PROCESS = 0x80000000
+_SECCOMP_RET_ERRNO = 0x00050000
+_SECCOMP_RET_ALLOW = 0x7FFF0000
+_LINUX_CAPABILITY_VERSION_3 = 0x20080522
+
+# (AUDIT_ARCH, 被拒绝的系统调用号)：进程/线程创建、exec、socket、ptrace、挂载与命名空间、会话/进程组、prctl
+_SECCOMP_ARCH = {
+    "x86_64": (
+        0xC000003E,
+        (56, 57, 58, 59, 322, 435, 41, 42, 49, 53, 101, 165, 166, 155, 161, 272, 308, 109, 112, 157),
+    ),
+    "aarch64": (
+        0xC00000B7,
+        (220, 221, 281, 435, 198, 199, 200, 203, 117, 40, 39, 41, 51, 97, 268, 154, 157, 167),
+    ),
+}
+_NOBODY = 65534
+_SHARED_LIBS = ("/lib", "/lib64", "/usr/lib", "/usr/lib64", "/usr/local/lib", "/etc/ld.so.cache")
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.prctl.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+
+
+def isolation_supported():
+    return sys.platform.startswith("linux") and platform.machine() in _SECCOMP_ARCH
+
+
+def _check(ret, what):
+    if ret != 0:
+        err = ctypes.get_errno()
+        raise IsolationError(f"{what}: {os.strerror(err)}")
+
+
+def _bind_sources():
+    """需要在 chroot 里可见的路径：解释器的 sys.path 与系统共享库目录，去掉已被上级目录覆盖的条目。"""
+    paths = []
+    for path in list(sys.path) + list(_SHARED_LIBS):
+        if path and os.path.isabs(path) and os.path.exists(path):
+            paths.append(os.path.normpath(path))
+    out = []
+    for path in sorted(set(paths), key=len):
+        if not any(path == p or path.startswith(p.rstrip("/") + "/") for p in out):
+            out.append(path)
+    return out
+
+
+def _write_file(path, data):
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.write(fd, data.encode("ascii"))
+    finally:
+        os.close(fd)
+
+
+def _write_id_maps(pid):
+    """由命名空间外仍是 root 的父进程写映射：ns 内 0 对应宿主 root（只用于搭建根目录），65534 对应宿主 nobody。"""
+    _write_file(f"/proc/{pid}/uid_map", f"0 0 1\n{_NOBODY} {_NOBODY} 1")
+    _write_file(f"/proc/{pid}/gid_map", f"0 0 1\n{_NOBODY} {_NOBODY} 1")
+
+
+def _write_self_id_maps():
+    # 非 root 启动时只能把 ns 内的 0 映射到自己的 uid，执行前改为清空 capability
+    _write_file("/proc/self/setgroups", "deny")
+    _write_file("/proc/self/uid_map", f"0 {os.getuid()} 1")
+    _write_file("/proc/self/gid_map", f"0 {os.getgid()} 1")
+
+
+def _mount(source, target, fstype, flags, data=None):
+    _check(
+        _libc.mount(
+            source.encode() if source else None,
+            target.encode(),
+            fstype.encode() if fstype else None,
+            ctypes.c_ulong(flags),
+            data.encode() if data else None,
+        ),
+        f"mount {target}",
+    )
+
+
+def _build_root(root):
+    """在 root 上挂 tmpfs，把 sys.path 与共享库只读绑定进去，整体改为只读后 chroot。"""
+    _mount(None, "/", None, _MS_REC | _MS_PRIVATE)
+    _mount("tmpfs", root, "tmpfs", _MS_NOSUID | _MS_NODEV, "size=1m,mode=0755")
+    for path in _bind_sources():
+        target = root + path
+        if os.path.isdir(path):
+            os.makedirs(target, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.close(os.open(target, os.O_WRONLY | os.O_CREAT, 0o644))
+        _mount(path, target, None, _MS_BIND | _MS_REC)
+        locked = 0
+        for bit, ms in _STATVFS_TO_MS.items():
+            if os.statvfs(target).f_flag & bit:
+                locked |= ms
+        _mount(None, target, None, _MS_REMOUNT | _MS_BIND | _MS_RDONLY | _MS_NOSUID | _MS_NODEV | locked)
+    _mount(None, root, None, _MS_REMOUNT | _MS_BIND | _MS_RDONLY | _MS_NOSUID | _MS_NODEV)
+    os.chroot(root)
+    os.chdir("/")
+
+
+class _CapHeader(ctypes.Structure):
+    _fields_ = [("version", ctypes.c_uint32), ("pid", ctypes.c_int)]
+
+
+class _CapData(ctypes.Structure):
+    _fields_ = [("effective", ctypes.c_uint32), ("permitted", ctypes.c_uint32), ("inheritable", ctypes.c_uint32)]
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+
+def _drop_capabilities():
+    header = _CapHeader(_LINUX_CAPABILITY_VERSION_3, 0)
+    data = (_CapData * 2)()
+    _check(_libc.capset(ctypes.byref(header), data), "capset")
+
+
+def _seccomp_program():
+    arch, denied = _SECCOMP_ARCH[platform.machine()]
+    errno = _SECCOMP_RET_ERRNO | 1  # EPERM
+    ops = [
+        (0x20, 0, 0, 4),  # ld [arch]
+        (0x15, 1, 0, arch),  # jeq arch
+        (0x06, 0, 0, _SECCOMP_RET_KILL_PROCESS),
+        (0x20, 0, 0, 0),  # ld [nr]
+    ]
+    if platform.machine() == "x86_64":
+        ops += [(0x35, 0, 1, 0x40000000), (0x06, 0, 0, errno)]  # 拒绝 x32 ABI
+    for nr in denied:
+        ops += [(0x15, 0, 1, nr), (0x06, 0, 0, errno)]
+    ops.append((0x06, 0, 0, _SECCOMP_RET_ALLOW))
+    return b"".join(struct.pack("HBBI", *op) for op in ops), len(ops)
+
+
+def _install_seccomp():
+    program, length = _seccomp_program()
+    buf = ctypes.create_string_buffer(program)
+    prog = _SockFprog(length, ctypes.cast(buf, ctypes.c_void_p))
+    _check(_libc.prctl(_PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0), "prctl(NO_NEW_PRIVS)")
+    _check(_libc.prctl(_PR_SET_SECCOMP, _SECCOMP_MODE_FILTER, ctypes.addressof(prog), 0, 0), "seccomp")
+
+
+def _audit(event, args):
+    if event in _BLOCKED_EVENTS:
+        raise SandboxViolation(event)
+    if event == "open" and len(args) >= 3:
+        mode, flags = args[1], args[2]
+        if isinstance(mode, str) and any(c in mode for c in "wax+"):
+            raise SandboxViolation("open:write")
+        if isinstance(flags, int) and flags & (os.O_WRONLY | os.O_RDWR | os.O_CREAT):
+            raise SandboxViolation("open:write")
+
+
+def _apply_limits(cpu_seconds, memory_mb):
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+
+def _write_result(result_fd, status, detail):
+    try:
+        os.write(result_fd, json.dumps({"status": status, "detail": detail}).encode("utf-8"))
+    finally:
+        os._exit(0)
+
+
+def _execute(code, cpu_seconds, memory_mb, mapped_nobody, result_fd):
+    """新 PID 命名空间里的 1 号进程：降到 nobody（或清空 capability）、加限制与 seccomp 后执行代码。"""
+    try:
+        _check(_libc.prctl(_PR_SET_PDEATHSIG, signal.SIGKILL, 0, 0, 0), "prctl(PDEATHSIG)")
+        if mapped_nobody:
+            os.setgroups([])
+            os.setresgid(_NOBODY, _NOBODY, _NOBODY)
+            os.setresuid(_NOBODY, _NOBODY, _NOBODY)
+        else:
+            _drop_capabilities()
+        _apply_limits(cpu_seconds, memory_mb)
+        compiled = compile(code, "<sandbox>", "exec")
+        _install_seccomp()
+    except SyntaxError as e:
+        _write_result(result_fd, "error", type(e).__name__)
+    except Exception as e:
+        _write_result(result_fd, "unavailable", str(e) or type(e).__name__)
+
+    status, detail = "ok", ""
+    try:
+        sys.addaudithook(_audit)
+        exec(compiled, {"__name__": "__main__", "__builtins__": __builtins__})
+    except SandboxViolation as e:
+        status, detail = "blocked", str(e)
+    except PermissionError as e:
+        status, detail = "blocked", f"PermissionError: {e.strerror or ''}"
+    except MemoryError:
+        status, detail = "error", "MemoryError"
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status, detail = "error", f"SystemExit({e.code})"
+    except BaseException as e:
+        name = type(e).__name__
+        status, detail = ("skipped" if name in _SKIP_EXCEPTIONS else "error"), name
+    _write_result(result_fd, status, detail)
+
+
+def _enter_sandbox(code, cpu_seconds, memory_mb, workdir, ready_fd, mapped_fd, result_fd):
+    """进入新命名空间并搭好根目录，再 fork 出执行代码的 1 号进程。"""
+    try:
+        flags = _CLONE_NEWUSER | _CLONE_NEWNS | _CLONE_NEWNET | _CLONE_NEWPID | _CLONE_NEWIPC | _CLONE_NEWUTS
+        _check(_libc.unshare(flags), "unshare")
+        os.write(ready_fd, b"1")
+        mapped = os.read(mapped_fd, 1)
+        if not mapped:
+            raise IsolationError("id map")
+        if mapped == b"0":
+            _write_self_id_maps()
+        _build_root(workdir)
+        pid = os.fork()
+    except Exception as e:
+        _write_result(result_fd, "unavailable", str(e) or type(e).__name__)
+    if pid == 0:
+        _execute(code, cpu_seconds, memory_mb, mapped == b"1", result_fd)
+    os.close(result_fd)
+    _, wait_status = os.waitpid(pid, 0)
+    os._exit(0 if os.WIFEXITED(wait_status) else 1)
+
+
+def _child(code, cpu_seconds, memory_mb, workdir, result_fd):
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        os.close(devnull)
+        if not isolation_supported():
+            raise IsolationError(f"unsupported platform {sys.platform}/{platform.machine()}")
+        ready_r, ready_w = os.pipe()
+        mapped_r, mapped_w = os.pipe()
+        pid = os.fork()
+    except Exception as e:
+        _write_result(result_fd, "unavailable", str(e) or type(e).__name__)
+    if pid == 0:
+        os.close(ready_r)
+        os.close(mapped_w)
+        _enter_sandbox(code, cpu_seconds, memory_mb, workdir, ready_w, mapped_r, result_fd)
+    os.close(result_fd)
+    os.close(ready_w)
+    os.close(mapped_r)
+    try:
+        if os.read(ready_r, 1):
+            if os.geteuid() == 0:
+                _write_id_maps(pid)
+                os.write(mapped_w, b"1")
+            else:
+                os.write(mapped_w, b"0")
+    except OSError:
+        pass
+    os.close(mapped_w)
+    _, wait_status = os.waitpid(pid, 0)
+    os._exit(0 if os.WIFEXITED(wait_status) else 1)
+
+
+def _run(job):
+    code = str(job.get("code") or "")
+    timeout = float(job.get("timeout") or 2.0)
+    memory_mb = int(job.get("memory_mb") or 0)
+    workdir = tempfile.mkdtemp(prefix="qa-sandbox-")
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _child(code, max(1, int(timeout + 0.999)), memory_mb, workdir, write_fd)
+    os.close(write_fd)
+
+    deadline = started + timeout
+    exited = False
+    while time.perf_counter() < deadline:
+        done, _ = os.waitpid(pid, os.WNOHANG)
+        if done:
+            exited = True
+            break
+        time.sleep(0.002)
+    if not exited:
+        # 子进程已 setsid，连同命名空间里的进程一起按进程组杀掉
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        os.waitpid(pid, 0)
+
+    chunks = []
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_fd)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    elapsed_ms = int((time.perf_counter() - started) * 1000)
+    if not exited:
+        return {"status": "timeout", "detail": "", "elapsed_ms": elapsed_ms}
+    try:
+        out = json.loads(b"".join(chunks).decode("utf-8"))
+    except Exception:
+        out = {"status": "error", "detail": "crashed"}
+    out["elapsed_ms"] = elapsed_ms
+    return out
+
+
+def probe():
+    """实际跑一次空任务，确认当前环境能建立完整隔离。"""
+    try:
+        return _run({"code": "pass", "timeout": 5.0, "memory_mb": 0}).get("status") == "ok"
+    except Exception:
+        return False
+
+
+def main():
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            out = _run(json.loads(line))
+        except Exception as e:
+            out = {"status": "error", "detail": f"worker: {type(e).__name__}", "elapsed_ms": 0}
+        sys.stdout.write(json.dumps(out) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--probe"]:
+        sys.exit(0 if probe() else 1)
+    main()
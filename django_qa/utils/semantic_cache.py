@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from django.conf import settings
+from django.db.models import Min
+
+from django_qa.models import ConversationMessage
+from django_qa.utils.qa_match import get_default_matcher
+
+try:
+    from scipy.sparse import vstack
+except Exception:  # pragma: no cover
+    vstack = None  # type: ignore[assignment]
+
+
+@dataclass(frozen=True)
+class SemanticHit:
+    message_id: int
+    similarity: float
+
+
+@dataclass
+class _Bucket:
+    ids: list[int] = field(default_factory=list)
+    rows: list[Any] = field(default_factory=list)
+    matrix: Any | None = None
+    warmed: bool = False
+
+
+class SemanticAnswerCache:
+    """按 (prompt 版本, 会话所属用户) 索引“首轮提问 -> 助手回答”，相似度超过阈值的新问题直接复用已有回答。
+
+    只收录会话第一轮的问答：后续轮次的回答依赖上下文，不能跨会话复用。
+    回答与引用可能带有提问者自己的代码和信息，默认只在同一用户的会话之间复用；
+    shared=True 时所有用户共用一个索引，需要显式开启。
+    """
+
+    def __init__(
+        self,
+        vectorize: Callable[[list[str]], Any | None],
+        *,
+        threshold: float = 0.9,
+        max_entries: int = 2000,
+        shared: bool = False,
+    ) -> None:
+        self._vectorize = vectorize
+        self._threshold = float(threshold)
+        self._max_entries = max(1, int(max_entries))
+        self._shared = bool(shared)
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple[str, int | None], _Bucket] = {}
+
+    def _vector(self, question: str) -> Any | None:
+        vec = self._vectorize([question or ""])
+        if vec is None or vec.nnz == 0:
+            return None
+        return vec
+
+    def _bucket(self, prompt_version: str, owner_id: int) -> _Bucket:
+        key = (prompt_version, None if self._shared else owner_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets.setdefault(key, _Bucket())
+        if not bucket.warmed:
+            self._warm(key, bucket)
+        return bucket
+
+    def _warm(self, key: tuple[str, int | None], bucket: _Bucket) -> None:
+        prompt_version, owner_id = key
+        qs = ConversationMessage.objects.filter(role="assistant", prompt_version=prompt_version)
+        if owner_id is not None:
+            qs = qs.filter(thread__owner_id=owner_id)
+        rows = list(
+            qs.exclude(content="")
+            .order_by("-id")
+            .values_list("id", "thread_id")[: self._max_entries]
+        )
+        thread_ids = {t for _, t in rows}
+        first_assistant = dict(
+            ConversationMessage.objects.filter(thread_id__in=thread_ids, role="assistant")
+            .values("thread_id")
+            .annotate(first_id=Min("id"))
+            .values_list("thread_id", "first_id")
+        )
+        first_question: dict[int, str] = {}
+        for thread_id, content in (
+            ConversationMessage.objects.filter(thread_id__in=thread_ids, role="user")
+            .order_by("thread_id", "id")
+            .values_list("thread_id", "content")
+        ):
+            first_question.setdefault(thread_id, content)
+
+        entries = [
+            (msg_id, first_question[thread_id])
+            for msg_id, thread_id in reversed(rows)
+            if first_assistant.get(thread_id) == msg_id and first_question.get(thread_id)
+        ]
+        vectors = self._vectorize([q for _, q in entries]) if entries else None
+        with self._lock:
+            if bucket.warmed:
+                return
+            if vectors is not None:
+                for i, (msg_id, _) in enumerate(entries):
+                    row = vectors[i]
+                    if row.nnz:
+                        bucket.ids.append(msg_id)
+                        bucket.rows.append(row)
+                bucket.matrix = None
+            bucket.warmed = True
+
+    def lookup(self, question: str, prompt_version: str, owner_id: int) -> SemanticHit | None:
+        vec = self._vector(question)
+        if vec is None:
+            return None
+        bucket = self._bucket(prompt_version, owner_id)
+        with self._lock:
+            if not bucket.ids:
+                return None
+            if bucket.matrix is None:
+                bucket.matrix = vstack(bucket.rows).tocsr()
+            matrix, ids = bucket.matrix, list(bucket.ids)
+        # TF-IDF 向量已做 L2 归一化，点积即余弦相似度
+        scores = (matrix @ vec.T).toarray().ravel()
+        best = int(scores.argmax())
+        similarity = float(scores[best])
+        if similarity < self._threshold:
+            return None
+        return SemanticHit(message_id=ids[best], similarity=similarity)
+
+    def remember(self, question: str, prompt_version: str, owner_id: int, message_id: int) -> None:
+        vec = self._vector(question)
+        if vec is None:
+            return
+        bucket = self._bucket(prompt_version, owner_id)
+        with self._lock:
+            if message_id in bucket.ids:
+                return
+            bucket.ids.append(message_id)
+            bucket.rows.append(vec)
+            if len(bucket.ids) > self._max_entries:
+                del bucket.ids[0]
+                del bucket.rows[0]
+            bucket.matrix = None
+
+    def forget(self, message_id: int) -> None:
+        with self._lock:
+            for bucket in self._buckets.values():
+                if message_id in bucket.ids:
+                    i = bucket.ids.index(message_id)
+                    del bucket.ids[i]
+                    del bucket.rows[i]
+                    bucket.matrix = None
+
+
+_DEFAULT_CACHE: SemanticAnswerCache | None = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticAnswerCache | None:
+    global _DEFAULT_CACHE
+    if not getattr(settings, "QA_SEMANTIC_CACHE_ENABLED", False) or vstack is None:
+        return None
+    if _DEFAULT_CACHE is not None:
+        return _DEFAULT_CACHE
+    with _DEFAULT_LOCK:
+        if _DEFAULT_CACHE is None:
+            _DEFAULT_CACHE = SemanticAnswerCache(
+                get_default_matcher().vectorize,
+                threshold=float(getattr(settings, "QA_SEMANTIC_CACHE_THRESHOLD", 0.9) or 0.9),
+                max_entries=int(getattr(settings, "QA_SEMANTIC_CACHE_MAX_ENTRIES", 2000) or 2000),
+                shared=bool(getattr(settings, "QA_SEMANTIC_CACHE_SHARED", False)),
+            )
+        return _DEFAULT_CACHE
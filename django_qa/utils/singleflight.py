@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """合并同一个 key 的并发调用：只有一个调用真正执行，其余调用等待并共享它的结果。
+
+    进程内用 Event 协调；传入 lock_dir 时再用 flock 文件锁跨进程协调，
+    结果以 JSON 写入同目录，供等待锁的其它进程读取（因此跨进程时结果必须可 JSON 序列化）。
+    """
+
+    def __init__(
+        self,
+        *,
+        lock_dir: Path | None = None,
+        wait_timeout: float = 120.0,
+        result_ttl: float = 30.0,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._lock_dir = Path(lock_dir) if lock_dir is not None and fcntl is not None else None
+        self._wait_timeout = float(wait_timeout)
+        self._result_ttl = float(result_ttl)
+        self._writes = 0
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], T],
+        *,
+        wait_timeout: float | None = None,
+        local_errors: tuple[type[BaseException], ...] = (),
+    ) -> T:
+        """wait_timeout 进一步限制本次调用作为跟随者的等待时间（如调用方自己的排队预算），超时后自己执行 fn。
+
+        local_errors 是只属于发起者本人的错误（排队超时、熔断拒绝等准入错误）：领头调用因此失败时不分享给跟随者，
+        跟随者在剩余时间内重新合并或自己执行。
+        """
+        timeout = self._wait_timeout if wait_timeout is None else min(self._wait_timeout, float(wait_timeout))
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+            if leader:
+                break
+            if not call.event.wait(max(0.0, deadline - time.monotonic())):
+                return fn()
+            if call.error is None:
+                return call.value  # type: ignore[return-value]
+            if not isinstance(call.error, local_errors):
+                raise call.error
+
+        try:
+            if self._lock_dir is not None:
+                call.value = self._run_across_processes(key, fn, max(0.0, deadline - time.monotonic()))
+            else:
+                call.value = fn()
+            return call.value  # type: ignore[return-value]
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _run_across_processes(self, key: str, fn: Callable[[], T], wait_timeout: float) -> T:
+        assert self._lock_dir is not None
+        os.makedirs(self._lock_dir, exist_ok=True)
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        lock_path = self._lock_dir / f"{name}.lock"
+        result_path = self._lock_dir / f"{name}.json"
+
+        started = time.time()
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if time.time() - started > wait_timeout:
+                        return fn()
+                    time.sleep(0.05)
+
+            if waited:
+                # 其它进程刚完成同一个调用：读取它写下的结果，不再重复请求
+                try:
+                    if result_path.stat().st_mtime >= started - 1.0:
+                        return json.loads(result_path.read_text(encoding="utf-8"))["value"]
+                except (OSError, ValueError, KeyError):
+                    pass
+
+            value = fn()
+            tmp = result_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"value": value}, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, result_path)
+            self._purge_stale()
+            return value
+        finally:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+
+    def _purge_stale(self) -> None:
+        self._writes += 1
+        if self._writes % 100:
+            return
+        cutoff = time.time() - max(self._result_ttl, self._wait_timeout) * 2
+        for path in self._lock_dir.iterdir():  # type: ignore[union-attr]
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, QuerySet, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest
+
+from django_qa.models import PairTag, Tag
+
+
+def clean_tags(tags: Iterable[object] | None) -> list[str]:
+    """去空白、去重并保持原顺序；与 Tag.name 的长度上限一致。"""
+    out: list[str] = []
+    for t in tags or []:
+        name = str(t or "").strip()[:128]
+        if name and name not in out:
+            out.append(name)
+    return out
+
+
+def count_tags(tag_lists: Iterable[Iterable[object] | None]) -> Counter[str]:
+    counter: Counter[str] = Counter()
+    for tags in tag_lists:
+        counter.update(clean_tags(tags))
+    return counter
+
+
+def diff_tags(old: Iterable[object] | None, new: Iterable[object] | None) -> Counter[str]:
+    """一个问答对的标签从 old 改成 new 时各标签计数的增减量。"""
+    before, after = set(clean_tags(old)), set(clean_tags(new))
+    deltas: Counter[str] = Counter({name: 1 for name in after - before})
+    deltas.update({name: -1 for name in before - after})
+    return deltas
+
+
+def apply_tag_deltas(deltas: Counter[str] | dict[str, int]) -> None:
+    """把每个标签的增减量写回 Tag：缺的标签先补行，再按相同增量分组做 UPDATE ... SET pair_count = pair_count + n，减到 0 为止。"""
+    deltas = {name: n for name, n in deltas.items() if n}
+    if not deltas:
+        return
+    by_delta: dict[int, list[str]] = defaultdict(list)
+    for name, n in deltas.items():
+        by_delta[n].append(name)
+    with transaction.atomic():
+        Tag.objects.bulk_create([Tag(name=name) for name in deltas], ignore_conflicts=True, batch_size=500)
+        for n, names in by_delta.items():
+            for i in range(0, len(names), 500):
+                Tag.objects.filter(name__in=names[i : i + 500]).update(pair_count=Greatest(F("pair_count") + n, Value(0)))
+
+
+def tag_ids(names: Iterable[str], *, tag_model=Tag) -> dict[str, int]:
+    """按名字取 Tag 主键，不存在的先建出来（pair_count 保持 0，由调用方自己累加）。"""
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    tag_model.objects.bulk_create([tag_model(name=name) for name in names], ignore_conflicts=True, batch_size=500)
+    out: dict[str, int] = {}
+    for i in range(0, len(names), 500):
+        out.update(tag_model.objects.filter(name__in=names[i : i + 500]).values_list("name", "id"))
+    return out
+
+
+def link_pair_tags(
+    pairs: Iterable[tuple[int, Iterable[object] | None]], *, tag_model=Tag, pair_tag_model=PairTag
+) -> int:
+    """为 (pair_id, tags) 写入关联行，已存在的关联忽略；返回尝试写入的行数。迁移里传入历史模型。"""
+    cleaned = [(pair_id, clean_tags(tags)) for pair_id, tags in pairs]
+    ids = tag_ids((name for _, names in cleaned for name in names), tag_model=tag_model)
+    rows = [pair_tag_model(pair_id=pair_id, tag_id=ids[name]) for pair_id, names in cleaned for name in names]
+    pair_tag_model.objects.bulk_create(rows, ignore_conflicts=True, batch_size=1000)
+    return len(rows)
+
+
+def relink_pair_tags(pair_id: int, deltas: Counter[str] | dict[str, int]) -> None:
+    """按 diff_tags 的结果增删单个问答对的关联行。"""
+    link_pair_tags([(pair_id, [name for name, n in deltas.items() if n > 0])])
+    removed = [name for name, n in deltas.items() if n < 0]
+    if removed:
+        PairTag.objects.filter(pair_id=pair_id, tag__name__in=removed).delete()
+
+
+def recount_tags() -> None:
+    """按关联表重算全部 Tag.pair_count，用于回填之后校正计数。"""
+    counts = PairTag.objects.filter(tag=OuterRef("pk")).values("tag").annotate(n=Count("id")).values("n")
+    Tag.objects.update(pair_count=Coalesce(Subquery(counts), Value(0)))
+
+
+def tag_facets(pairs: QuerySet, limit: int = 20) -> list[dict[str, object]]:
+    """当前筛选结果里各标签的数量，走关联表的 (tag, pair) 索引分组计数。"""
+    # 先把筛选条件单独编译成 SQL：作为普通子查询时 Django 会给表起别名，全文检索 extra() 里写死的表名就对不上了
+    sql, params = pairs.order_by().values("id").query.sql_with_params()
+    rows = (
+        PairTag.objects.filter(pair_id__in=RawSQL(sql, params))
+        .values("tag__name")
+        .annotate(n=Count("id"))
+        .order_by("-n", "tag__name")[:limit]
+    )
+    return [{"tag": row["tag__name"], "count": int(row["n"])} for row in rows]
+
+
+def top_tags(limit: int = 20) -> list[dict[str, object]]:
+    rows = Tag.objects.filter(pair_count__gt=0).order_by("-pair_count", "name").values_list("name", "pair_count")[:limit]
+    return [{"tag": name, "count": int(n)} for name, n in rows]
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from django_qa.models import ConversationMessage, ConversationThread
+from django_qa.utils.context_budget import pack_latest, truncate_tokens
+from django_qa.utils.llm import LLMMessage, chat
+
+logger = logging.getLogger(__name__)
+
+_SYSTEM_PROMPT = (
+    "你负责压缩编程问答对话的历史。请把已有摘要与新增对话合并成一份新的摘要，"
+    "保留用户的目标、环境与约束、已经给出的关键结论和代码要点、仍未解决的问题；"
+    "省略寒暄和重复内容，使用中文，直接输出摘要正文。"
+)
+
+_EXECUTOR: ThreadPoolExecutor | None = None
+_EXECUTOR_LOCK = threading.Lock()
+_IN_FLIGHT: set[int] = set()
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        return _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qa-summary")
+        return _EXECUTOR
+
+
+def _keep_recent() -> int:
+    return max(0, int(getattr(settings, "QA_THREAD_SUMMARY_KEEP_RECENT", 4)))
+
+
+def prompt_history(thread: ConversationThread, *, exclude_id: int | None = None, limit: int = 12) -> list[ConversationMessage]:
+    """摘要之后的消息（最多 limit 条，按时间正序）；摘要本身由调用方单独放进提示词。"""
+    qs = ConversationMessage.objects.filter(thread=thread, id__gt=thread.summary_message_id)
+    if exclude_id is not None:
+        qs = qs.exclude(id=exclude_id)
+    rows = list(qs.order_by("-id")[:limit])
+    rows.reverse()
+    return rows
+
+
+def refresh_summary(thread_id: int) -> bool:
+    thread = ConversationThread.objects.filter(id=thread_id).first()
+    if thread is None:
+        return False
+    pending = list(
+        ConversationMessage.objects.filter(thread=thread, id__gt=thread.summary_message_id)
+        .order_by("id")
+        .values_list("id", "role", "content")
+    )
+    keep = _keep_recent()
+    to_fold = pending[: len(pending) - keep] if keep else pending
+    if not to_fold:
+        return False
+
+    max_tokens = int(getattr(settings, "QA_THREAD_SUMMARY_MAX_TOKENS", 600))
+    transcript = pack_latest(
+        [f"{role}: {truncate_tokens((content or '').strip(), max_tokens)}" for _, role, content in to_fold if content],
+        max_tokens * 4,
+    )
+    user_prompt = f"已有摘要：\n{thread.summary or '（无）'}\n\n新增对话：\n{transcript}\n\n请输出更新后的摘要，不超过 {max_tokens} 个 token。"
+    summary = chat(
+        [LLMMessage(role="system", content=_SYSTEM_PROMPT), LLMMessage(role="user", content=user_prompt)],
+        temperature=0.1,
+        scene="thread_summary",
+        user_key="background",
+    )
+    summary = truncate_tokens(summary.strip(), max_tokens)
+    if not summary:
+        return False
+    # 以旧的 summary_message_id 作为乐观锁，避免并发刷新互相覆盖；update() 不会改动会话的 updated_at
+    updated = ConversationThread.objects.filter(id=thread.id, summary_message_id=thread.summary_message_id).update(
+        summary=summary,
+        summary_message_id=to_fold[-1][0],
+        summary_updated_at=timezone.now(),
+    )
+    return bool(updated)
+
+
+def _run_in_worker(thread_id: int) -> None:
+    close_old_connections()
+    try:
+        refresh_summary(thread_id)
+    except Exception:
+        logger.exception("刷新会话摘要失败 thread_id=%s", thread_id)
+    finally:
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT.discard(thread_id)
+        close_old_connections()
+
+
+def _submit(thread_id: int) -> None:
+    with _IN_FLIGHT_LOCK:
+        if thread_id in _IN_FLIGHT:
+            return
+        _IN_FLIGHT.add(thread_id)
+    _get_executor().submit(_run_in_worker, thread_id)
+
+
+def schedule_summary_refresh(thread: ConversationThread) -> bool:
+    """摘要之后又积累了 QA_THREAD_SUMMARY_EVERY 条可折叠的消息时，在事务提交后交给后台线程刷新摘要。"""
+    every = int(getattr(settings, "QA_THREAD_SUMMARY_EVERY", 6) or 0)
+    if every <= 0:
+        return False
+    # 后台可能刚刷新过摘要，重新读取覆盖位置，避免用内存里过期的值重复触发
+    covered = ConversationThread.objects.filter(id=thread.id).values_list("summary_message_id", flat=True).first() or 0
+    pending = ConversationMessage.objects.filter(thread_id=thread.id, id__gt=covered).count()
+    if pending - _keep_recent() < every:
+        return False
+    if not getattr(settings, "QA_THREAD_SUMMARY_ASYNC", True):
+        try:
+            refresh_summary(thread.id)
+        except Exception:
+            logger.exception("刷新会话摘要失败 thread_id=%s", thread.id)
+        return True
+    thread_id = thread.id
+    transaction.on_commit(lambda: _submit(thread_id))
+    return True
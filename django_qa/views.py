@@ -1,14 +1,32 @@
 from __future__ import annotations
 
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from dataclasses import dataclass, field
 from datetime import timedelta
+import itertools
+import json
+import threading
 import time
+from typing import Any
 
-from django.db.models import Avg, Count, Q
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Avg, Count
 from django.db.models.functions import TruncDate
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.generics import GenericAPIView
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from django_auth.utils.decorators import admin_required, login_required
 from django_main.R import R
@@ -21,8 +39,10 @@ from django_qa.models import (
 )
 from django_qa.serializers import (
     AnswerMetricsSerializer,
+    BatchQARequestSerializer,
     DatasetPairSerializer,
     DatasetPairDetailSerializer,
+    EvaluationSerializer,
     MessageCreateSerializer,
     MessageListSerializer,
     PromptCreateSerializer,
@@ -32,10 +52,29 @@ from django_qa.serializers import (
     ThreadCreateSerializer,
     ThreadListSerializer,
 )
-from django_qa.utils.code_analysis import analyze_code_comprehensive
-from django_qa.utils.llm import LLMMessage, chat
+from django_qa.utils.circuit_breaker import CircuitOpenError
+from django_qa.utils.code_analysis import StreamingCodeAnalyzer, analyze_code_comprehensive
+from django_qa.utils.context_budget import allocate, count_tokens, pack_in_order, pack_latest
+from django_qa.utils.evaluation import clone_evaluation, enqueue_evaluation, evaluation_fields
+from django_qa.utils.fulltext import search_pairs
+from django_qa.utils.llm import (
+    LLMMessage,
+    achat,
+    chat,
+    chat_stream,
+    llm_cache_stats,
+    llm_circuit_stats,
+    llm_router_stats,
+    llm_scheduler_stats,
+)
+from django_qa.utils.llm_scheduler import LLMQueueTimeout
+from django_qa.utils.pagination import InvalidCursor, approximate_count, keyset_page, parse_limit
 from django_qa.utils.prompt import render_template
 from django_qa.utils.qa_match import get_default_matcher
+from django_qa.utils.sandbox import get_default_sandbox
+from django_qa.utils.semantic_cache import get_semantic_cache
+from django_qa.utils.tag_stats import tag_facets, top_tags
+from django_qa.utils.thread_summary import prompt_history, schedule_summary_refresh
 
 
 def _get_prompt(scene: str | None) -> PromptTemplate | None:
@@ -46,7 +85,39 @@ def _get_prompt(scene: str | None) -> PromptTemplate | None:
     return prompt
 
 
-def _build_context_text(messages: list[ConversationMessage], max_chars: int = 8000) -> str:
+def _prompt_version(prompt: PromptTemplate | None) -> str:
+    if prompt is None:
+        return ""
+    return f"{prompt.id}:{prompt.version}"
+
+
+def _llm_error(e: Exception) -> dict[str, Any]:
+    if isinstance(e, CircuitOpenError):
+        return {
+            "msg": "模型服务暂时不可用，请稍后重试",
+            "code": 50301,
+            "data": {"error_type": type(e).__name__, "retry_after": int(e.retry_after)},
+            "http_status": status.HTTP_503_SERVICE_UNAVAILABLE,
+        }
+    if isinstance(e, LLMQueueTimeout):
+        return {
+            "msg": "模型服务繁忙，请稍后重试",
+            "code": 42901,
+            "data": {"error_type": type(e).__name__, "reason": e.reason, "waited_ms": e.waited_ms},
+            "http_status": status.HTTP_429_TOO_MANY_REQUESTS,
+        }
+    return {
+        "msg": "模型调用失败，请检查后端模型配置与 API_KEY",
+        "code": 50201,
+        "data": {"error_type": type(e).__name__},
+        "http_status": status.HTTP_502_BAD_GATEWAY,
+    }
+
+
+_RETRIEVAL_HEADER = "相似问答检索结果（供参考，优先保证答案正确性）：\n"
+
+
+def _history_parts(messages: list[ConversationMessage]) -> list[str]:
     parts: list[str] = []
     for m in messages:
         role = (m.role or "").strip()
@@ -54,13 +125,10 @@ def _build_context_text(messages: list[ConversationMessage], max_chars: int = 80
         if not content:
             continue
         parts.append(f"{role}: {content}")
-    text = "\n\n".join(parts).strip()
-    if len(text) <= max_chars:
-        return text
-    return text[-max_chars:]
+    return parts
 
 
-def _build_retrieval_context(recommendations: list[dict], *, max_chars: int = 4500) -> str:
+def _retrieval_parts(recommendations: list[dict]) -> list[str]:
     parts: list[str] = []
     for i, rec in enumerate(recommendations[:3], start=1):
         title = str(rec.get("title") or "").strip()
@@ -73,10 +141,53 @@ def _build_retrieval_context(recommendations: list[dict], *, max_chars: int = 45
             parts.append(f"{header}\n标题：{title}\n参考答案要点：{ans}".strip())
         else:
             parts.append(f"{header}\n参考答案要点：{ans}".strip())
-    text = "\n\n".join([p for p in parts if p]).strip()
-    if len(text) <= max_chars:
-        return text
-    return text[:max_chars].rstrip() + "…"
+    return [p for p in parts if p]
+
+
+_MESSAGE_JSON_COLUMNS = (("citations", "citations_json"), ("tool_events", "tool_events_json"))
+
+
+def _message_fields(raw: str | None) -> set[str] | None:
+    """fields=id,role,content 这类逗号分隔的字段白名单；不传时返回全部字段。"""
+    if not raw:
+        return None
+    return {f.strip() for f in raw.split(",") if f.strip()}
+
+
+def _message_rows(thread: ConversationThread, fields: set[str] | None):
+    """一次查询带出消息与评估（反向一对一用 select_related），没请求的大 JSON 列直接不读。"""
+    rows = ConversationMessage.objects.filter(thread=thread)
+    if fields is None or "evaluation" in fields:
+        rows = rows.select_related("evaluation")
+    if fields is not None:
+        deferred = [col for name, col in _MESSAGE_JSON_COLUMNS if name not in fields]
+        if deferred:
+            rows = rows.defer(*deferred)
+    return rows
+
+
+def _message_list(thread: ConversationThread, params) -> Any:
+    """会话消息列表，同步与异步接口共用：传 limit 或 cursor 时按 (created_at, id) 游标分页，否则返回全部。"""
+    fields = _message_fields(params.get("fields"))
+    rows = _message_rows(thread, fields)
+    if "cursor" in params or "limit" in params:
+        return _keyset_response(params, rows, ["created_at", "id"], MessageListSerializer, fields=fields)
+    return R.ok(data=MessageListSerializer(rows.order_by("id"), many=True, fields=fields).data)
+
+
+def _keyset_response(params, qs, ordering: list[str], serializer_class, **serializer_kwargs: Any) -> Any:
+    """列表接口的游标分页（传 limit 或 cursor 时启用）：返回 items 与 next_cursor，没有下一页时为 null。"""
+    try:
+        result = keyset_page(
+            qs,
+            ordering,
+            limit=parse_limit(params.get("limit"), default=50, maximum=200),
+            cursor=params.get("cursor"),
+        )
+    except InvalidCursor as e:
+        return R.fail(msg=str(e))
+    items = serializer_class(result.rows, many=True, **serializer_kwargs).data
+    return R.ok(data={"items": items, "next_cursor": result.next_cursor})
 
 
 class QAView(GenericAPIView):
@@ -102,33 +213,25 @@ class QAView(GenericAPIView):
                 [
                     LLMMessage(role="system", content=system_prompt),
                     LLMMessage(role="user", content=user_prompt),
-                ]
+                ],
+                scene=scene,
+                prompt_version=_prompt_version(prompt),
+                user_key=str(request.user.id),
             )
         except Exception as e:
-            return R.fail(
-                msg="模型调用失败，请检查后端模型配置与 API_KEY",
-                code=50201,
-                data={"error_type": type(e).__name__},
-                http_status=status.HTTP_502_BAD_GATEWAY,
-            )
+            return R.fail(**_llm_error(e))
 
-        analysis = analyze_code_comprehensive(answer)
-        evaluation = {
-            "syntax_score": analysis["syntax_score"],
-            "logic_score": analysis["logic_score"],
-            "utility_score": analysis["utility_score"],
-            "readability_score": analysis["readability_score"],
-            "total_score": analysis["total_score"],
-            "analysis_report": analysis["report"],
-        }
+        evaluation = evaluation_fields(analyze_code_comprehensive(answer, sandbox=get_default_sandbox()))
         return R.ok(data={"answer": answer, "evaluation": evaluation})
 
 
 class ThreadListCreateView(GenericAPIView):
     @login_required
     def get(self, request: Request):
-        rows = ConversationThread.objects.filter(owner=request.user).order_by("-updated_at", "-id")
-        return R.ok(data=ThreadListSerializer(rows, many=True).data)
+        rows = ConversationThread.objects.filter(owner=request.user)
+        if "cursor" in request.query_params or "limit" in request.query_params:
+            return _keyset_response(request.query_params, rows, ["-updated_at", "-id"], ThreadListSerializer)
+        return R.ok(data=ThreadListSerializer(rows.order_by("-updated_at", "-id"), many=True).data)
 
     @login_required
     def post(self, request: Request):
@@ -151,14 +254,379 @@ class ThreadDeleteView(GenericAPIView):
         return R.ok(data=True)
 
 
+@dataclass
+class _PreparedTurn:
+    user_msg: ConversationMessage
+    prompt: PromptTemplate | None
+    llm_messages: list[LLMMessage]
+    citations: list[dict] = field(default_factory=list)
+    tool_events: list[dict] = field(default_factory=list)
+    scene: str = ""
+    standalone: bool = False
+    user_key: str = ""
+
+    @property
+    def llm_kwargs(self) -> dict[str, str]:
+        return {"scene": self.scene, "prompt_version": _prompt_version(self.prompt), "user_key": self.user_key}
+
+
+def _run_retrieval(content: str) -> tuple[list[dict], list[dict], list[dict]]:
+    try:
+        t0 = time.perf_counter()
+        matcher = get_default_matcher()
+        retrieval = matcher.match_and_recommend(content, top_k_match=8, top_k_recommend=3)
+        return _shape_retrieval(content, retrieval, int((time.perf_counter() - t0) * 1000))
+    except Exception as e:
+        return [], [_retrieval_failed_event(content, str(e), 0)], []
+
+
+def _shape_retrieval(content: str, retrieval: dict, elapsed_ms: int) -> tuple[list[dict], list[dict], list[dict]]:
+    tool_events = [
+        {
+            "name": "qa_match_and_recommend",
+            "payload": {"question": content, "top_k_match": 8, "top_k_recommend": 3},
+            "elapsed_ms": elapsed_ms,
+            "tool_out": {"ok": True, "result": retrieval, "error": None, "meta": {"tool": "qa_match_and_recommend"}},
+        }
+    ]
+    citations = [
+        {"type": "match", **m} for m in (retrieval.get("matches") or [])[:8]
+    ] + [
+        {"type": "recommendation", **r} for r in (retrieval.get("recommendations") or [])[:3]
+    ]
+    return citations, tool_events, list(retrieval.get("recommendations") or [])
+
+
+def _retrieval_failed_event(content: str, error: str, elapsed_ms: int, **meta: Any) -> dict:
+    return {
+        "name": "qa_match_and_recommend",
+        "payload": {"question": content, "top_k_match": 8, "top_k_recommend": 3},
+        "elapsed_ms": elapsed_ms,
+        "tool_out": {
+            "ok": False,
+            "result": {"matches": [], "recommendations": []},
+            "error": error,
+            "meta": {"tool": "qa_match_and_recommend", **meta},
+        },
+    }
+
+
+_RETRIEVAL_EXECUTOR: ThreadPoolExecutor | None = None
+_RETRIEVAL_EXECUTOR_LOCK = threading.Lock()
+# 超出时间预算、被放弃但仍在线程里跑的检索任务数；占满线程池时新请求直接跳过检索，不再排到它们后面
+_RETRIEVAL_ABANDONED = 0
+_RETRIEVAL_ABANDONED_LOCK = threading.Lock()
+
+
+def _retrieval_workers() -> int:
+    return max(1, int(getattr(settings, "QA_RETRIEVAL_WORKERS", 4) or 4))
+
+
+def _get_retrieval_executor() -> ThreadPoolExecutor:
+    global _RETRIEVAL_EXECUTOR
+    if _RETRIEVAL_EXECUTOR is not None:
+        return _RETRIEVAL_EXECUTOR
+    with _RETRIEVAL_EXECUTOR_LOCK:
+        if _RETRIEVAL_EXECUTOR is None:
+            _RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=_retrieval_workers(), thread_name_prefix="qa-retrieval")
+        return _RETRIEVAL_EXECUTOR
+
+
+def _abandon_retrieval(future: Future) -> None:
+    global _RETRIEVAL_ABANDONED
+    with _RETRIEVAL_ABANDONED_LOCK:
+        _RETRIEVAL_ABANDONED += 1
+    future.add_done_callback(_release_abandoned_retrieval)
+
+
+def _release_abandoned_retrieval(_future: Future) -> None:
+    global _RETRIEVAL_ABANDONED
+    with _RETRIEVAL_ABANDONED_LOCK:
+        _RETRIEVAL_ABANDONED -= 1
+
+
+@dataclass
+class _PendingRetrieval:
+    """已提交到检索线程池的检索任务；请求线程在此期间完成入库与读取，等结果时只等剩余的时间预算。"""
+
+    content: str
+    future: Future
+    started: float
+
+    def _remaining(self) -> float | None:
+        budget = float(getattr(settings, "QA_RETRIEVAL_TIMEOUT", 10.0) or 0)
+        if budget <= 0:
+            return None
+        return max(0.0, budget - (time.perf_counter() - self.started))
+
+    def _dropped(self) -> tuple[list[dict], list[dict], list[dict]]:
+        # 还在排队的直接取消；已经在跑的让它跑完，结果丢弃，不拖慢本次模型调用，但计入被放弃的任务数
+        if not self.future.cancel() and not self.future.done():
+            _abandon_retrieval(self.future)
+        elapsed_ms = int((time.perf_counter() - self.started) * 1000)
+        return [], [_retrieval_failed_event(self.content, "检索超出时间预算，已跳过", elapsed_ms, dropped=True)], []
+
+    def result(self) -> tuple[list[dict], list[dict], list[dict]]:
+        try:
+            return self.future.result(timeout=self._remaining())
+        except FutureTimeoutError:
+            return self._dropped()
+
+    async def aresult(self) -> tuple[list[dict], list[dict], list[dict]]:
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.future)), self._remaining())
+        except asyncio.TimeoutError:
+            return self._dropped()
+
+
+def _start_retrieval(content: str) -> _PendingRetrieval:
+    if _RETRIEVAL_ABANDONED >= _retrieval_workers():
+        future: Future = Future()
+        future.set_result(([], [_retrieval_failed_event(content, "检索线程池被超时任务占满，已跳过", 0, saturated=True)], []))
+    else:
+        future = _get_retrieval_executor().submit(_run_retrieval, content)
+    return _PendingRetrieval(content=content, future=future, started=time.perf_counter())
+
+
+def _build_llm_messages(
+    prompt: PromptTemplate | None,
+    content: str,
+    history: list[ConversationMessage],
+    recommendations: list[dict],
+    summary: str = "",
+) -> list[LLMMessage]:
+    """按 token 预算组装提示词：系统提示与问题原样保留，剩余预算在对话历史与检索结果之间分配。"""
+    system_prompt = prompt.system_prompt if prompt else ""
+    template = prompt.user_prompt_template if prompt else ""
+
+    history_parts = _history_parts(history)
+    if summary:
+        history_parts.insert(0, f"对话摘要：{summary}")
+    retrieval_parts = _retrieval_parts(recommendations)
+    fixed = count_tokens(system_prompt) + count_tokens(
+        render_template(template, {"question": content, "context": ""}) if prompt else content
+    )
+    if retrieval_parts:
+        fixed += count_tokens(_RETRIEVAL_HEADER) + 1
+    history_budget, retrieval_budget = allocate(
+        int(getattr(settings, "QA_PROMPT_TOKEN_BUDGET", 4096)) - fixed,
+        history_need=count_tokens("\n\n".join(history_parts)),
+        retrieval_need=count_tokens("\n\n".join(retrieval_parts)),
+        retrieval_share=float(getattr(settings, "QA_PROMPT_RETRIEVAL_SHARE", 0.4)),
+    )
+    context_text = pack_latest(history_parts, history_budget)
+    retrieval_context = pack_in_order(retrieval_parts, retrieval_budget)
+
+    merged_context = context_text
+    if retrieval_context:
+        merged_context = (merged_context + "\n\n" if merged_context else "") + _RETRIEVAL_HEADER + retrieval_context
+    user_prompt = render_template(template, {"question": content, "context": merged_context}) if prompt else content
+    return [
+        LLMMessage(role="system", content=system_prompt),
+        LLMMessage(role="user", content=user_prompt),
+    ]
+
+
+@dataclass
+class _TurnDraft:
+    """已写入用户消息、读好历史与提示词的一轮对话，只差检索结果；同步与异步视图共用。"""
+
+    thread: ConversationThread
+    content: str
+    scene: str
+    user_msg: ConversationMessage
+    history: list[ConversationMessage]
+    prompt: PromptTemplate | None
+    retrieval: _PendingRetrieval
+
+    def complete(self, retrieved: tuple[list[dict], list[dict], list[dict]]) -> _PreparedTurn:
+        citations, tool_events, recommendations = retrieved
+        return _PreparedTurn(
+            user_msg=self.user_msg,
+            prompt=self.prompt,
+            llm_messages=_build_llm_messages(self.prompt, self.content, self.history, recommendations, self.thread.summary),
+            citations=citations,
+            tool_events=tool_events,
+            scene=self.scene,
+            standalone=not self.history and not self.thread.summary_message_id,
+            user_key=str(self.thread.owner_id),
+        )
+
+
+def _draft_turn(thread: ConversationThread, content: str, scene: str) -> _TurnDraft:
+    # 检索只依赖问题文本，先丢进线程池，与下面的写入和读取并行
+    retrieval = _start_retrieval(content)
+    user_msg = ConversationMessage.objects.create(
+        thread=thread,
+        role="user",
+        content=content,
+        citations_json=[],
+        tool_events_json=[],
+    )
+
+    history = prompt_history(thread, exclude_id=user_msg.id)
+    prompt = _get_prompt(scene) or _get_prompt(None)
+    return _TurnDraft(thread, content, scene, user_msg, history, prompt, retrieval)
+
+
+def _prepare_turn(thread: ConversationThread, content: str, scene: str) -> _PreparedTurn:
+    draft = _draft_turn(thread, content, scene)
+    return draft.complete(draft.retrieval.result())
+
+
+def _touch_thread(thread: ConversationThread, question: str) -> None:
+    thread.updated_at = timezone.now()
+    if not thread.title:
+        thread.title = (question or "")[:40]
+    thread.save(update_fields=["updated_at", "title"])
+
+
+def _remember_answer(turn: _PreparedTurn, assistant_msg: ConversationMessage) -> None:
+    cache = get_semantic_cache()
+    if cache is None or not turn.standalone or not assistant_msg.content:
+        return
+    try:
+        cache.remember(turn.user_msg.content, assistant_msg.prompt_version, turn.user_msg.thread.owner_id, assistant_msg.id)
+    except Exception:
+        pass
+
+
+def _finish_turn(
+    thread: ConversationThread, turn: _PreparedTurn, answer_text: str, *, cacheable: bool = True
+) -> ConversationMessage:
+    assistant_msg = ConversationMessage.objects.create(
+        thread=thread,
+        role="assistant",
+        content=answer_text,
+        citations_json=turn.citations,
+        tool_events_json=turn.tool_events,
+        prompt_version=_prompt_version(turn.prompt) if cacheable else "",
+    )
+    _touch_thread(thread, turn.user_msg.content)
+    if cacheable:
+        _remember_answer(turn, assistant_msg)
+    schedule_summary_refresh(thread)
+    return assistant_msg
+
+
+def _turn_payload(user_msg: ConversationMessage, assistant_msg: ConversationMessage) -> dict[str, Any]:
+    return {
+        "user": MessageListSerializer(user_msg).data,
+        "assistant": MessageListSerializer(assistant_msg).data,
+    }
+
+
+def _finish_turn_payload(
+    thread: ConversationThread, turn: _PreparedTurn, answer_text: str, cacheable: bool
+) -> dict[str, Any]:
+    assistant_msg = _finish_turn(thread, turn, answer_text, cacheable=cacheable)
+    enqueue_evaluation(assistant_msg)
+    return _turn_payload(turn.user_msg, assistant_msg)
+
+
+def _retrieval_fallback(turn: _PreparedTurn, error: Exception) -> str | None:
+    """熔断期间用检索到的推荐问答拼一个降级回答；没有推荐结果时返回 None，由调用方照常报错。"""
+    if not isinstance(error, CircuitOpenError) or not getattr(settings, "QA_LLM_CIRCUIT_FALLBACK", True):
+        return None
+    recs = [c for c in turn.citations if c.get("type") == "recommendation"]
+    if not recs:
+        return None
+    lines = ["模型服务暂时不可用，以下是题库中与问题最相似的高质量问答，供参考：", ""]
+    for i, r in enumerate(recs, 1):
+        similarity = float(r.get("similarity") or 0.0)
+        lines.append(f"{i}. {r.get('title') or ''}（相似度 {similarity:.2f}，答案得分 {r.get('answer_score')}）")
+        if r.get("answer_excerpt"):
+            lines.append(f"   {r['answer_excerpt']}")
+        lines.append(f"   https://stackoverflow.com/a/{r.get('answer_id')}")
+    turn.tool_events.append(
+        {
+            "name": "llm_circuit_fallback",
+            "payload": {"scene": turn.scene},
+            "elapsed_ms": 0,
+            "tool_out": {
+                "ok": True,
+                "result": {"recommendations": len(recs), "retry_after": int(error.retry_after)},
+                "error": str(error),
+                "meta": {"tool": "llm_circuit_fallback"},
+            },
+        }
+    )
+    return "\n".join(lines)
+
+
+def _reuse_semantic_answer(
+    thread: ConversationThread, content: str, scene: str
+) -> tuple[ConversationMessage, ConversationMessage] | None:
+    """会话首轮问题命中语义缓存时，复制历史回答与评估落库，跳过检索和模型调用。"""
+    cache = get_semantic_cache()
+    if cache is None or ConversationMessage.objects.filter(thread=thread).exists():
+        return None
+    prompt = _get_prompt(scene) or _get_prompt(None)
+    version = _prompt_version(prompt)
+    t0 = time.perf_counter()
+    try:
+        hit = cache.lookup(content, version, thread.owner_id)
+    except Exception:
+        return None
+    if hit is None:
+        return None
+    source = ConversationMessage.objects.filter(id=hit.message_id, role="assistant").first()
+    if source is None:
+        cache.forget(hit.message_id)
+        return None
+
+    user_msg = ConversationMessage.objects.create(
+        thread=thread,
+        role="user",
+        content=content,
+        citations_json=[],
+        tool_events_json=[],
+    )
+    assistant_msg = ConversationMessage.objects.create(
+        thread=thread,
+        role="assistant",
+        content=source.content,
+        citations_json=source.citations_json,
+        tool_events_json=[
+            {
+                "name": "semantic_cache",
+                "payload": {"question": content, "prompt_version": version},
+                "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+                "tool_out": {
+                    "ok": True,
+                    "result": {"source_message_id": source.id, "similarity": hit.similarity},
+                    "error": None,
+                    "meta": {"tool": "semantic_cache"},
+                },
+            }
+        ],
+        prompt_version=version,
+    )
+    clone_evaluation(AnswerEvaluation.objects.filter(message_id=source.id).first(), assistant_msg)
+    _touch_thread(thread, content)
+    return user_msg, assistant_msg
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class _EventStreamRenderer(BaseRenderer):
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return _sse("error", data).encode(self.charset)
+
+
 class MessageListCreateView(GenericAPIView):
     @login_required
     def get(self, request: Request, thread_id: int):
         thread = ConversationThread.objects.filter(id=thread_id, owner=request.user).first()
         if thread is None:
             return R.fail(msg="会话不存在", http_status=status.HTTP_404_NOT_FOUND)
-        rows = ConversationMessage.objects.filter(thread=thread).order_by("id")
-        return R.ok(data=MessageListSerializer(rows, many=True).data)
+        return _message_list(thread, request.query_params)
 
     @login_required
     def post(self, request: Request, thread_id: int):
@@ -171,114 +639,345 @@ class MessageListCreateView(GenericAPIView):
         content = ser.validated_data["content"]
         scene = ser.validated_data.get("prompt_scene") or "cot_programming"
 
-        user_msg = ConversationMessage.objects.create(
-            thread=thread,
-            role="user",
-            content=content,
-            citations_json=[],
-            tool_events_json=[],
-        )
+        reused = _reuse_semantic_answer(thread, content, scene)
+        if reused is not None:
+            return R.ok(data=_turn_payload(*reused))
 
-        recent = list(ConversationMessage.objects.filter(thread=thread).order_by("-id")[:12])
-        recent.reverse()
-        context_text = _build_context_text(recent[:-1])
-        prompt = _get_prompt(scene) or _get_prompt(None)
-
-        tool_events: list[dict] = []
-        citations: list[dict] = []
-        retrieval_context = ""
+        turn = _prepare_turn(thread, content, scene)
+        cacheable = True
         try:
-            t0 = time.perf_counter()
-            matcher = get_default_matcher()
-            retrieval = matcher.match_and_recommend(content, top_k_match=8, top_k_recommend=3)
-            elapsed_ms = int((time.perf_counter() - t0) * 1000)
-            tool_events.append(
+            answer_text = chat(turn.llm_messages, **turn.llm_kwargs)
+        except Exception as e:
+            answer_text = _retrieval_fallback(turn, e)
+            if answer_text is None:
+                return R.fail(**_llm_error(e))
+            cacheable = False
+
+        return R.ok(data=_finish_turn_payload(thread, turn, answer_text, cacheable))
+
+
+class MessageStreamView(GenericAPIView):
+    """SSE 版本的发送消息接口：依次推送 citations、token 增量，结束时推送落库后的助手消息。"""
+
+    renderer_classes = [JSONRenderer, _EventStreamRenderer]
+
+    @login_required
+    def post(self, request: Request, thread_id: int):
+        thread = ConversationThread.objects.filter(id=thread_id, owner=request.user).first()
+        if thread is None:
+            return R.fail(msg="会话不存在", http_status=status.HTTP_404_NOT_FOUND)
+
+        ser = MessageCreateSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        content = ser.validated_data["content"]
+        scene = ser.validated_data.get("prompt_scene") or "cot_programming"
+
+        t0 = time.perf_counter()
+        turn = _prepare_turn(thread, content, scene)
+        prepare_ms = int((time.perf_counter() - t0) * 1000)
+
+        def events():
+            yield _sse("user", MessageListSerializer(turn.user_msg).data)
+            yield _sse("citations", turn.citations)
+
+            analyzer = StreamingCodeAnalyzer(sandbox=get_default_sandbox())
+            started = time.perf_counter()
+            ttft_ms: int | None = None
+            fallback: str | None = None
+            try:
+                for delta in chat_stream(turn.llm_messages, **turn.llm_kwargs):
+                    if ttft_ms is None:
+                        ttft_ms = int((time.perf_counter() - started) * 1000)
+                        yield _sse("meta", {"ttft_ms": ttft_ms, "prepare_ms": prepare_ms})
+                    analyzer.feed(delta)
+                    yield _sse("token", {"delta": delta})
+            except Exception as e:
+                fallback = _retrieval_fallback(turn, e) if ttft_ms is None else None
+                if fallback is None:
+                    err = _llm_error(e)
+                    yield _sse("error", {"code": err["code"], "msg": err["msg"], "data": err["data"]})
+                    return
+                analyzer.feed(fallback)
+                yield _sse("token", {"delta": fallback})
+            llm_ms = int((time.perf_counter() - started) * 1000)
+
+            if fallback is None:
+                turn.tool_events.append(
+                    {
+                        "name": "llm_stream",
+                        "payload": {"scene": scene},
+                        "elapsed_ms": llm_ms,
+                        "tool_out": {
+                            "ok": True,
+                            "result": {"ttft_ms": ttft_ms, "prepare_ms": prepare_ms},
+                            "error": None,
+                            "meta": {"tool": "llm_stream"},
+                        },
+                    }
+                )
+            assistant_msg = _finish_turn(thread, turn, analyzer.text.strip(), cacheable=fallback is None)
+            AnswerEvaluation.objects.create(message=assistant_msg, status="done", **evaluation_fields(analyzer.finish()))
+            yield _sse(
+                "done",
                 {
-                    "name": "qa_match_and_recommend",
-                    "payload": {"question": content, "top_k_match": 8, "top_k_recommend": 3},
-                    "elapsed_ms": elapsed_ms,
-                    "tool_out": {"ok": True, "result": retrieval, "error": None, "meta": {"tool": "qa_match_and_recommend"}},
-                }
+                    "assistant": MessageListSerializer(assistant_msg).data,
+                    "ttft_ms": ttft_ms,
+                    "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+                },
             )
-            citations = [
-                {"type": "match", **m} for m in (retrieval.get("matches") or [])[:8]
-            ] + [
-                {"type": "recommendation", **r} for r in (retrieval.get("recommendations") or [])[:3]
-            ]
-            retrieval_context = _build_retrieval_context(list(retrieval.get("recommendations") or []))
+
+        resp = StreamingHttpResponse(events(), content_type="text/event-stream; charset=utf-8")
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
+
+
+class _NDJSONRenderer(BaseRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps({"type": "error", **(data or {})}, ensure_ascii=False, default=str) + "\n").encode(self.charset)
+
+
+_BATCH_EXECUTOR: ThreadPoolExecutor | None = None
+_BATCH_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_batch_executor() -> ThreadPoolExecutor:
+    """所有批量请求共用的线程池，QA_BATCH_WORKERS 限定全进程同时在答的题数。"""
+    global _BATCH_EXECUTOR
+    if _BATCH_EXECUTOR is not None:
+        return _BATCH_EXECUTOR
+    with _BATCH_EXECUTOR_LOCK:
+        if _BATCH_EXECUTOR is None:
+            workers = max(1, int(getattr(settings, "QA_BATCH_WORKERS", 8) or 8))
+            _BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qa-batch")
+        return _BATCH_EXECUTOR
+
+
+class BatchQAView(GenericAPIView):
+    """批量问答：整批问题一次检索，模型调用按 QA_BATCH_CONCURRENCY 并发；每答完一题输出一行 NDJSON，最后一行是汇总。"""
+
+    renderer_classes = [JSONRenderer, _NDJSONRenderer]
+
+    @login_required
+    def post(self, request: Request):
+        ser = BatchQARequestSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        questions = ser.validated_data["questions"]
+        scene = ser.validated_data.get("prompt_scene") or "cot_programming"
+        prompt = _get_prompt(scene) or _get_prompt(None)
+        user_key = str(request.user.id)
+
+        t0 = time.perf_counter()
+        try:
+            retrievals = get_default_matcher().match_and_recommend_many(questions, top_k_match=8, top_k_recommend=3)
+            retrieval_error = None
         except Exception as e:
-            tool_events.append(
-                {
-                    "name": "qa_match_and_recommend",
-                    "payload": {"question": content, "top_k_match": 8, "top_k_recommend": 3},
-                    "elapsed_ms": 0,
-                    "tool_out": {
-                        "ok": False,
-                        "result": {"matches": [], "recommendations": []},
-                        "error": str(e),
-                        "meta": {"tool": "qa_match_and_recommend"},
-                    },
+            retrievals = [{"matches": [], "recommendations": []} for _ in questions]
+            retrieval_error = str(e)
+        retrieval_ms = int((time.perf_counter() - t0) * 1000)
+
+        def answer_one(index: int, question: str, retrieval: dict) -> dict:
+            if retrieval_error is None:
+                citations, _, recommendations = _shape_retrieval(question, retrieval, retrieval_ms)
+            else:
+                citations, recommendations = [], []
+            item: dict[str, Any] = {"index": index, "question": question, "citations": citations}
+            try:
+                answer = chat(
+                    _build_llm_messages(prompt, question, [], recommendations),
+                    scene=scene,
+                    prompt_version=_prompt_version(prompt),
+                    user_key=user_key,
+                )
+            except Exception as e:
+                err = _llm_error(e)
+                return {**item, "ok": False, "code": err["code"], "msg": err["msg"]}
+            try:
+                evaluation = evaluation_fields(analyze_code_comprehensive(answer, sandbox=get_default_sandbox()))
+            except Exception as e:
+                # 评分失败（如沙箱进程重启失败）只算这一题失败，答案照样返回，后面的题和汇总行不受影响
+                return {
+                    **item,
+                    "ok": False,
+                    "code": 50001,
+                    "msg": "答案评分失败",
+                    "error_type": type(e).__name__,
+                    "answer": answer,
                 }
-            )
+            return {**item, "ok": True, "answer": answer, "evaluation": evaluation}
 
-        system_prompt = prompt.system_prompt if prompt else ""
-        merged_context = context_text
-        if retrieval_context:
-            merged_context = (merged_context + "\n\n" if merged_context else "") + "相似问答检索结果（供参考，优先保证答案正确性）：\n" + retrieval_context
-        user_prompt = (
-            render_template(
-                prompt.user_prompt_template,
-                {"question": content, "context": merged_context},
-            )
-            if prompt
-            else content
-        )
+        def run_in_worker(index: int, question: str, retrieval: dict) -> dict:
+            close_old_connections()
+            try:
+                return answer_one(index, question, retrieval)
+            finally:
+                close_old_connections()
+
+        def lines():
+            workers = max(1, min(len(questions), int(getattr(settings, "QA_BATCH_CONCURRENCY", 4) or 1)))
+            executor = _get_batch_executor()
+            todo = iter(enumerate(zip(questions, retrievals)))
+            running: set[Future] = set()
+            succeeded = 0
+            try:
+                # 同一批次最多同时占 workers 个线程，答完一题再补提交一题，不把共享线程池一次塞满
+                for i, (q, r) in itertools.islice(todo, workers):
+                    running.add(executor.submit(run_in_worker, i, q, r))
+                while running:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        next_one = next(todo, None)
+                        if next_one is not None:
+                            i, (q, r) = next_one
+                            running.add(executor.submit(run_in_worker, i, q, r))
+                        item = future.result()
+                        succeeded += 1 if item["ok"] else 0
+                        yield json.dumps({"type": "item", **item}, ensure_ascii=False, default=str) + "\n"
+            finally:
+                # 客户端中途断开时丢弃还没开始的题目；线程池是共享的，不能关掉
+                for future in running:
+                    future.cancel()
+            yield json.dumps(
+                {
+                    "type": "done",
+                    "total": len(questions),
+                    "succeeded": succeeded,
+                    "failed": len(questions) - succeeded,
+                    "retrieval_ms": retrieval_ms,
+                    "retrieval_error": retrieval_error,
+                    "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+                },
+                ensure_ascii=False,
+            ) + "\n"
 
+        resp = StreamingHttpResponse(lines(), content_type="application/x-ndjson; charset=utf-8")
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
+
+
+async def _aget_token_user(request: HttpRequest):
+    """用 DRF 配置的认证类认证原生 Django 请求；认证失败与未携带凭据一样返回 None。"""
+    for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
         try:
-            answer_text = chat(
-                [
-                    LLMMessage(role="system", content=system_prompt),
-                    LLMMessage(role="user", content=user_prompt),
-                ]
+            result = await sync_to_async(authenticator().authenticate)(request)
+        except AuthenticationFailed:
+            return None
+        if result is not None:
+            return result[0]
+    return None
+
+
+async def _aget_prompt(scene: str | None) -> PromptTemplate | None:
+    qs = PromptTemplate.objects.filter(is_active=True)
+    if scene:
+        qs = qs.filter(scene=scene)
+    return await qs.order_by("-updated_at", "-id").afirst()
+
+
+def _json_r(resp: Response) -> JsonResponse:
+    """异步视图不经过 DRF 渲染：把 R 构造的响应原样转成 JsonResponse，保证 code/msg 与同步接口一致。"""
+    return JsonResponse(resp.data, status=resp.status_code, json_dumps_params={"ensure_ascii": False})
+
+
+def _parse_json_body(request: HttpRequest) -> dict:
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncQAView(View):
+    """ASGI 下的异步问答接口：模型调用期间不占用工作线程。"""
+
+    async def post(self, request: HttpRequest):
+        user = await _aget_token_user(request)
+        if user is None:
+            return _json_r(R.unauthorized(msg="请先登录"))
+        ser = QARequestSerializer(data=_parse_json_body(request))
+        if not ser.is_valid():
+            return _json_r(R.validation_error(msg="参数错误", data=ser.errors))
+        question = ser.validated_data["question"]
+        scene = ser.validated_data.get("prompt_scene") or "cot_programming"
+        prompt = await _aget_prompt(scene) or await _aget_prompt(None)
+
+        try:
+            answer = await achat(
+                _build_llm_messages(prompt, question, [], []),
+                scene=scene,
+                prompt_version=_prompt_version(prompt),
+                user_key=str(user.id),
             )
         except Exception as e:
-            return R.fail(
-                msg="模型调用失败，请检查后端模型配置与 API_KEY",
-                code=50201,
-                data={"error_type": type(e).__name__},
-                http_status=status.HTTP_502_BAD_GATEWAY,
-            )
+            return _json_r(R.fail(**_llm_error(e)))
 
-        assistant_msg = ConversationMessage.objects.create(
-            thread=thread,
-            role="assistant",
-            content=answer_text,
-            citations_json=citations,
-            tool_events_json=tool_events,
+        analysis = await sync_to_async(analyze_code_comprehensive, thread_sensitive=False)(
+            answer, sandbox=get_default_sandbox()
         )
+        return _json_r(R.ok(data={"answer": answer, "evaluation": evaluation_fields(analysis)}))
 
-        analysis = analyze_code_comprehensive(answer_text)
-        AnswerEvaluation.objects.create(
-            message=assistant_msg,
-            syntax_score=analysis["syntax_score"],
-            logic_score=analysis["logic_score"],
-            utility_score=analysis["utility_score"],
-            readability_score=analysis["readability_score"],
-            total_score=analysis["total_score"],
-            analysis_report=analysis["report"],
-        )
 
-        thread.updated_at = timezone.now()
-        if not thread.title:
-            thread.title = (content or "")[:40]
-        thread.save(update_fields=["updated_at", "title"])
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncMessageListCreateView(View):
+    async def get(self, request: HttpRequest, thread_id: int):
+        user = await _aget_token_user(request)
+        if user is None:
+            return _json_r(R.unauthorized(msg="请先登录"))
+        thread = await ConversationThread.objects.filter(id=thread_id, owner=user).afirst()
+        if thread is None:
+            return _json_r(R.fail(msg="会话不存在", http_status=status.HTTP_404_NOT_FOUND))
+        return _json_r(await sync_to_async(_message_list)(thread, request.GET))
 
-        return R.ok(
-            data={
-                "user": MessageListSerializer(user_msg).data,
-                "assistant": MessageListSerializer(assistant_msg).data,
-            }
+    async def post(self, request: HttpRequest, thread_id: int):
+        user = await _aget_token_user(request)
+        if user is None:
+            return _json_r(R.unauthorized(msg="请先登录"))
+        thread = await ConversationThread.objects.filter(id=thread_id, owner=user).afirst()
+        if thread is None:
+            return _json_r(R.fail(msg="会话不存在", http_status=status.HTTP_404_NOT_FOUND))
+        ser = MessageCreateSerializer(data=_parse_json_body(request))
+        if not ser.is_valid():
+            return _json_r(R.validation_error(msg="参数错误", data=ser.errors))
+        content = ser.validated_data["content"]
+        scene = ser.validated_data.get("prompt_scene") or "cot_programming"
+
+        reused = await sync_to_async(_reuse_semantic_answer)(thread, content, scene)
+        if reused is not None:
+            return _json_r(R.ok(data=await sync_to_async(_turn_payload)(*reused)))
+
+        # 写库与读取走与同步接口相同的函数，只有等检索和调用模型在事件循环里完成
+        draft = await sync_to_async(_draft_turn)(thread, content, scene)
+        turn = draft.complete(await draft.retrieval.aresult())
+        cacheable = True
+        try:
+            answer_text = await achat(turn.llm_messages, **turn.llm_kwargs)
+        except Exception as e:
+            answer_text = _retrieval_fallback(turn, e)
+            if answer_text is None:
+                return _json_r(R.fail(**_llm_error(e)))
+            cacheable = False
+
+        data = await sync_to_async(_finish_turn_payload)(thread, turn, answer_text, cacheable)
+        return _json_r(R.ok(data=data))
+
+
+class MessageEvaluationView(GenericAPIView):
+    @login_required
+    def get(self, request: Request, message_id: int):
+        row = (
+            AnswerEvaluation.objects.select_related("message__thread")
+            .filter(message_id=message_id, message__thread__owner=request.user)
+            .first()
         )
+        if row is None:
+            return R.fail(msg="评估不存在", http_status=status.HTTP_404_NOT_FOUND)
+        return R.ok(data=EvaluationSerializer(row).data)
 
 
 class AdminPromptListCreateView(GenericAPIView):
@@ -317,6 +1016,24 @@ class AdminPromptDetailView(GenericAPIView):
         return R.ok(data=True)
 
 
+class AdminLLMCacheStatsView(GenericAPIView):
+    @admin_required
+    def get(self, request: Request):
+        return R.ok(data=llm_cache_stats())
+
+
+class AdminLLMSchedulerStatsView(GenericAPIView):
+    @admin_required
+    def get(self, request: Request):
+        return R.ok(data=llm_scheduler_stats())
+
+
+class AdminLLMRoutingStatsView(GenericAPIView):
+    @admin_required
+    def get(self, request: Request):
+        return R.ok(data={**llm_router_stats(), "circuit": llm_circuit_stats()})
+
+
 class AdminAnswerMetricsView(GenericAPIView):
     @admin_required
     def get(self, request: Request):
@@ -352,28 +1069,18 @@ class AdminAnswerMetricsView(GenericAPIView):
         return R.ok(data=out.data)
 
 
+# 列表序列化只需要这些列；正文与代码片段 JSON 只在详情接口读取
+_PAIR_LIST_FIELDS = [f for f in DatasetPairSerializer.Meta.fields if f != "tags"] + ["tags_json"]
+
+
 class DatasetSummaryView(GenericAPIView):
     @login_required
     def get(self, request: Request):
         total = ProgrammingQAPair.objects.count()
-        top_pairs = ProgrammingQAPair.objects.order_by("-answer_score", "-id")[:8]
-        tags_counter: dict[str, int] = {}
-        for tags in ProgrammingQAPair.objects.values_list("tags_json", flat=True):
-            if not tags:
-                continue
-            for t in tags:
-                key = str(t or "").strip()
-                if not key:
-                    continue
-                tags_counter[key] = tags_counter.get(key, 0) + 1
-        top_tags = sorted(
-            [{"tag": k, "count": v} for k, v in tags_counter.items()],
-            key=lambda x: int(x["count"]),
-            reverse=True,
-        )[:20]
+        top_pairs = ProgrammingQAPair.objects.only(*_PAIR_LIST_FIELDS).order_by("-answer_score", "-id")[:8]
         data = {
             "total": int(total),
-            "top_tags": top_tags,
+            "top_tags": top_tags(20),
             "top_pairs": DatasetPairSerializer(top_pairs, many=True).data,
         }
         return R.ok(data=data)
@@ -384,38 +1091,52 @@ class DatasetPairsView(GenericAPIView):
     def get(self, request: Request):
         q = (request.query_params.get("q") or "").strip()
         tag = (request.query_params.get("tag") or "").strip()
-        sort = (request.query_params.get("sort") or "answer_score").strip()
-        page = int(request.query_params.get("page") or 1)
-        page_size = int(request.query_params.get("page_size") or 20)
-        page = 1 if page < 1 else page
-        page_size = 20 if page_size <= 0 else min(page_size, 100)
+        sort = (request.query_params.get("sort") or ("relevance" if q else "answer_score")).strip()
+        page_size = parse_limit(request.query_params.get("page_size"))
 
-        qs = ProgrammingQAPair.objects.all()
+        qs = ProgrammingQAPair.objects.only(*_PAIR_LIST_FIELDS)
+        ranked = False
         if q:
-            qs = qs.filter(
-                Q(title__icontains=q)
-                | Q(question_body__icontains=q)
-                | Q(answer_body__icontains=q)
-            )
+            qs, ranked = search_pairs(qs, q)
         if tag:
-            qs = qs.filter(tags_json__contains=[tag])
+            qs = qs.filter(pair_tags__tag__name=tag)
 
-        if sort == "recent":
-            qs = qs.order_by("-created_at", "-id")
+        if sort == "relevance" and ranked:
+            ordering = ["-search_rank", "-answer_score", "-id"]
+        elif sort == "recent":
+            ordering = ["-created_at", "-id"]
         elif sort == "question_score":
-            qs = qs.order_by("-question_score", "-id")
+            ordering = ["-question_score", "-id"]
         else:
-            qs = qs.order_by("-answer_score", "-id")
+            ordering = ["-answer_score", "-id"]
+
+        # 总数只数到上限，超过时 total_exact=False；传 with_total=0 可以完全跳过
+        with_total = request.query_params.get("with_total", "1") != "0"
+        data: dict[str, Any] = {"page_size": page_size}
+        if with_total:
+            data["total"], data["total_exact"] = approximate_count(qs)
+        if request.query_params.get("facets") == "1":
+            data["facets"] = tag_facets(qs)
 
-        total = qs.count()
+        # 传了 cursor 参数（首页传空串）即使用游标分页，翻多深都是一次索引范围扫描；否则保持原来的页码分页
+        if "cursor" in request.query_params:
+            try:
+                result = keyset_page(qs, ordering, limit=page_size, cursor=request.query_params.get("cursor"))
+            except InvalidCursor as e:
+                return R.fail(msg=str(e))
+            data["items"] = DatasetPairSerializer(result.rows, many=True).data
+            data["next_cursor"] = result.next_cursor
+            return R.ok(data=data)
+
+        try:
+            page = int(request.query_params.get("page") or 1)
+        except (TypeError, ValueError):
+            return R.fail(msg="page 必须是整数")
+        page = 1 if page < 1 else page
         start = (page - 1) * page_size
-        rows = qs[start : start + page_size]
-        data = {
-            "page": page,
-            "page_size": page_size,
-            "total": int(total),
-            "items": DatasetPairSerializer(rows, many=True).data,
-        }
+        rows = qs.order_by(*ordering)[start : start + page_size]
+        data["page"] = page
+        data["items"] = DatasetPairSerializer(rows, many=True).data
         return R.ok(data=data)
 
 
@@ -13,8 +13,6 @@ from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
-import requests
-
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 
@@ -28,6 +26,8 @@ except Exception:
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
+from django_qa.utils.llm_clients import get_registry, provider_config
+
 DEFAULT_DATASET_PATH = Path(r"d:\ai_assistant\data\stackoverflow-python-questions.jsonl")
 
 
@@ -106,17 +106,10 @@ def _sample_questions(items: list[dict[str, Any]], sample_size: int, seed: int)
 
 
 def _provider_config(provider: str) -> dict[str, str] | None:
-    if provider == "qwen":
-        return {
-            "api_key": os.environ.get("QWEN_API_KEY", "") or "",
-            "base_url": os.environ.get("QWEN_API_BASE", "https://dashscope.aliyuncs.com/compatible-mode/v1") or "",
-        }
-    if provider == "zhipu":
-        return {
-            "api_key": os.environ.get("ZHIPU_API_KEY", "") or "",
-            "base_url": os.environ.get("ZHIPU_API_BASE", "https://open.bigmodel.cn/api/paas/v4/") or "",
-        }
-    return None
+    cfg = provider_config(provider)
+    if cfg is None:
+        return None
+    return {"api_key": cfg.api_key, "base_url": cfg.base_url}
 
 
 def _chat_completion(
@@ -143,7 +136,7 @@ def _chat_completion(
     if max_tokens is not None:
         payload["max_tokens"] = max_tokens
 
-    resp = requests.post(url, headers=headers, json=payload, timeout=60)
+    resp = get_registry().http_client(provider).post(url, headers=headers, json=payload)
     resp.raise_for_status()
     data = resp.json()
     try:
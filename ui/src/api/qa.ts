@@ -3,6 +3,7 @@ import type {
   DatasetPairDetailData,
   DatasetPairsPageData,
   DatasetSummaryData,
+  EvaluationItem,
   MessageCreateRequest,
   MessageItem,
   PromptCreateRequest,
@@ -38,6 +39,10 @@ export async function sendMessage(threadId: number, payload: MessageCreateReques
   return requestRJson<SendMessageResponse>(`/api/qa/threads/${threadId}/messages/`, "POST", payload)
 }
 
+export async function getMessageEvaluation(messageId: number): Promise<EvaluationItem> {
+  return requestR<EvaluationItem>(`/api/qa/messages/${messageId}/evaluation/`, { method: "GET" })
+}
+
 export async function listAdminPrompts(): Promise<PromptTemplateItem[]> {
   return requestR<PromptTemplateItem[]>("/api/qa/admin/prompts/", { method: "GET" })
 }
@@ -44,7 +44,10 @@ export interface EvaluationItem {
   readability_score: number
   total_score: number
   analysis_report: string
+  status: "pending" | "done" | "failed"
+  error_msg: string
   created_at: string
+  updated_at: string
 }
 
 export interface MessageItem {
@@ -121,9 +124,14 @@ export interface DatasetSummaryData {
 }
 
 export interface DatasetPairsPageData {
-  page: number
+  // 页码分页时返回 page；传 cursor 时改为返回 next_cursor（没有下一页时为 null）
+  page?: number
+  next_cursor?: string | null
   page_size: number
-  total: number
+  // 总数最多数到 10000，超过时 total_exact 为 false，total 只是下限；with_total=0 时两者都不返回
+  total?: number
+  total_exact?: boolean
+  facets?: DatasetTagCount[]
   items: DatasetPairItem[]
 }
 